@@ -0,0 +1,135 @@
+# benchmarks/bench_chat_view.py
+#
+# Mede a latência de cada mensagem acrescentada ao chat e o crescimento da memória em sessões longas.
+#
+#   QT_QPA_PLATFORM=offscreen python -m benchmarks.bench_chat_view --messages 10000
+#   QT_QPA_PLATFORM=offscreen python -m benchmarks.bench_chat_view --messages 10000 --textedit
+#
+# Sem --textedit, usa o ChatView; com --textedit, um QTextEdit com markdown por mensagem, como antes.
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+
+import markdown
+from PyQt5.QtWidgets import QApplication, QTextEdit
+
+from chat_history import ROLE_ASSISTANT, ROLE_USER
+from chat_view import ChatView
+
+SAMPLE_ANSWER = """Aqui está uma função que resolve o problema:
+
+```python
+def soma(valores):
+    total = 0
+    for valor in valores:
+        total += valor
+    return total
+```
+
+- percorre a lista uma vez;
+- funciona com **qualquer** iterável de números.
+"""
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def rss_mb():
+    """
+    Memória residente atual do processo, ou o pico quando /proc não está disponível.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        scale = 2 ** 20 if sys.platform == "darwin" else 2 ** 10
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+
+def message_text(i):
+    if i % 2 == 0:
+        return ROLE_USER, f"Pergunta {i}: como somar os valores de uma lista sem usar sum()?"
+    return ROLE_ASSISTANT, f"Resposta {i}. {SAMPLE_ANSWER}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede o custo de acrescentar mensagens ao chat.")
+    parser.add_argument("--messages", type=int, default=10000, help="Mensagens acrescentadas.")
+    parser.add_argument("--textedit", action="store_true", help="Mede o QTextEdit em vez do ChatView.")
+    parser.add_argument("--out", help="Grava o resultado em JSON neste arquivo.")
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    if args.textedit:
+        view = QTextEdit()
+        view.setReadOnly(True)
+        label = {ROLE_USER: "User", ROLE_ASSISTANT: "Chatbot"}
+
+        def append(role, text):
+            view.append(f"<b>{label[role]}:</b> {markdown.markdown(text)}")
+    else:
+        view = ChatView()
+
+        def append(role, text):
+            view.add_message(role, text)
+    view.resize(600, 800)
+    view.show()
+    app.processEvents()
+
+    rss_start = rss_mb()
+    latencies = []
+    inicio = time.perf_counter()
+    for i in range(args.messages):
+        role, text = message_text(i)
+        t0 = time.perf_counter()
+        append(role, text)
+        # Inclui o layout e a pintura que a mensagem provoca
+        app.processEvents()
+        latencies.append(time.perf_counter() - t0)
+    total = time.perf_counter() - inicio
+    rss_end = rss_mb()
+
+    # Mudar a largura obriga a refazer o layout do que está carregado
+    t0 = time.perf_counter()
+    view.resize(700, 800)
+    app.processEvents()
+    resize_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    bar = view.verticalScrollBar()
+    bar.setValue(bar.maximum() // 2)
+    app.processEvents()
+    scroll_s = time.perf_counter() - t0
+
+    bloco = max(len(latencies) // 10, 1)
+    result = {
+        "view": "QTextEdit" if args.textedit else "ChatView",
+        "messages": args.messages,
+        "total_s": total,
+        "append_p50_ms": percentile(latencies, 0.5) * 1e3,
+        "append_p99_ms": percentile(latencies, 0.99) * 1e3,
+        "append_max_ms": max(latencies) * 1e3,
+        "first_10pct_mean_ms": statistics.mean(latencies[:bloco]) * 1e3,
+        "last_10pct_mean_ms": statistics.mean(latencies[-bloco:]) * 1e3,
+        "resize_ms": resize_s * 1e3,
+        "scroll_ms": scroll_s * 1e3,
+        "rss_start_mb": rss_start,
+        "rss_end_mb": rss_end,
+        "rss_growth_mb": rss_end - rss_start,
+    }
+    for name, value in result.items():
+        print(f"{name:>22}: {value:.4f}" if isinstance(value, float) else f"{name:>22}: {value}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
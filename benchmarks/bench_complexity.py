@@ -0,0 +1,84 @@
+# benchmarks/bench_complexity.py
+#
+# Compara o classificador local de complexidade com o caminho via LLM em latência e concordância.
+#
+#   python -m benchmarks.bench_complexity complexity_decisions.jsonl
+#   python -m benchmarks.bench_complexity perguntas.jsonl --live
+#
+# Sem --live, usa as decisões do LLM registradas pelo CoderCore (rótulo e latência).
+# Com --live, cada linha precisa de "pergunta" (e opcionalmente "existing_code") e o LLM é consultado agora.
+
+import argparse
+import json
+import statistics
+import time
+
+from complexity import ComplexityClassifier, load_records
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def run_live(records):
+    from coder_core import CoderCore
+
+    core = CoderCore()
+    # Limiares impossíveis forçam a consulta ao LLM em todas as perguntas
+    core.complexity_classifier = ComplexityClassifier(low=-1.0, high=2.0)
+    for record in records:
+        existing_code = record.get("existing_code", "")
+        inicio = time.perf_counter()
+        record["label"] = core.decide_complexidade_pergunta(record["pergunta"], [], existing_code)
+        record["llm_seconds"] = time.perf_counter() - inicio
+        record["code_lines"] = existing_code.count("\n") + 1 if existing_code.strip() else 0
+    return records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara o classificador local de complexidade com o LLM.")
+    parser.add_argument("records", help="JSONL com decisões registradas ou perguntas (--live).")
+    parser.add_argument("--live", action="store_true", help="Consulta o LLM para obter rótulos e latências.")
+    parser.add_argument("--weights", default="complexity_weights.json", help="Pesos do classificador.")
+    parser.add_argument("--repeat", type=int, default=100, help="Repetições por pergunta na medição local.")
+    parser.add_argument("--out", help="Grava o resultado em JSON neste arquivo.")
+    args = parser.parse_args()
+
+    records = load_records(args.records)
+    if args.live:
+        records = run_live(records)
+    classifier = ComplexityClassifier.load(args.weights)
+
+    local_seconds = []
+    agree = agree_confident = confident = 0
+    for record in records:
+        inicio = time.perf_counter()
+        for _ in range(args.repeat):
+            decisao, probabilidade, _ = classifier.classify(record["pergunta"], record.get("code_lines", 0))
+        local_seconds.append((time.perf_counter() - inicio) / args.repeat)
+        if (probabilidade >= 0.5) == record["label"]:
+            agree += 1
+        if decisao is not None:
+            confident += 1
+            agree_confident += decisao == record["label"]
+
+    llm_seconds = [r["llm_seconds"] for r in records if r.get("llm_seconds") is not None]
+    result = {
+        "cases": len(records),
+        "local_p50_us": percentile(local_seconds, 0.5) * 1e6,
+        "local_p99_us": percentile(local_seconds, 0.99) * 1e6,
+        "llm_mean_s": statistics.mean(llm_seconds) if llm_seconds else None,
+        "agreement": agree / len(records),
+        "confident_fraction": confident / len(records),
+        "agreement_when_confident": agree_confident / confident if confident else None,
+    }
+    for name, value in result.items():
+        print(f"{name:>26}: {value:.4f}" if isinstance(value, float) else f"{name:>26}: {value}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
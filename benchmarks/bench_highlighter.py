@@ -0,0 +1,107 @@
+# benchmarks/bench_highlighter.py
+#
+# Mede a vazão do destaque de sintaxe (linhas por segundo) e o tempo em que a interface fica bloqueada ao
+# substituir um arquivo grande.
+#
+#   QT_QPA_PLATFORM=offscreen python -m benchmarks.bench_highlighter --lines 20000
+
+import argparse
+import json
+import sys
+import time
+
+from PyQt5.QtGui import QTextCursor
+from PyQt5.QtWidgets import QApplication, QPlainTextEdit
+
+from highlighter import PythonHighlighter
+
+SAMPLE = '''@decorador
+def funcao_{i}(valor, outro=None):
+    """
+    Docstring de várias linhas {i}.
+    """
+    if valor and not outro:  # comentário
+        return "texto {i}" + 'outro' + str(0x{i:x})
+    for item in range(10):
+        pass
+    return valor
+
+'''
+
+
+def sample_code(lines):
+    blocos = [SAMPLE.format(i=i) for i in range(lines // SAMPLE.count("\n") + 1)]
+    return "".join(blocos)
+
+
+def timed(app, action):
+    inicio = time.perf_counter()
+    action()
+    app.processEvents()
+    return time.perf_counter() - inicio
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede o desempenho do PythonHighlighter.")
+    parser.add_argument("--lines", type=int, default=20000, help="Linhas do arquivo de teste.")
+    parser.add_argument("--out", help="Grava o resultado em JSON neste arquivo.")
+    args = parser.parse_args()
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    code = sample_code(args.lines)
+    editor = QPlainTextEdit()
+    editor.resize(800, 600)
+    editor.show()
+    highlighter = PythonHighlighter(editor.document())
+    editor.setPlainText(code)
+    app.processEvents()
+    linhas = editor.document().blockCount()
+
+    # Passada completa: todas as linhas destacadas de uma vez
+    full_s = timed(app, highlighter.rehighlight)
+
+    # Substituição do arquivo inteiro sem e com destaque adiado: tempo até a interface voltar a responder
+    replace_s = timed(app, lambda: editor.setPlainText(code + "\n"))
+
+    def replace_deferred():
+        highlighter.defer()
+        editor.setPlainText(code)
+    replace_deferred_s = timed(app, replace_deferred)
+    inicio = time.perf_counter()
+    while highlighter._limit is not None:
+        app.processEvents()
+    deferred_total_s = time.perf_counter() - inicio + replace_deferred_s
+
+    # Uma tecla no meio do arquivo: só a linha alterada é destacada de novo
+    cursor = QTextCursor(editor.document().findBlockByNumber(linhas // 2))
+    keystroke_s = timed(app, lambda: cursor.insertText("x"))
+
+    # Abrir uma string de três aspas muda o estado das linhas seguintes até a próxima delimitação
+    cursor = QTextCursor(editor.document().findBlockByNumber(linhas // 2 + 5))
+    open_string_s = timed(app, lambda: cursor.insertText('"""'))
+
+    # Um parêntese aberto no topo do arquivo só muda a profundidade até a próxima instrução de nível superior
+    cursor = QTextCursor(editor.document().findBlockByNumber(1))
+    cursor.movePosition(QTextCursor.EndOfBlock)
+    open_bracket_s = timed(app, lambda: cursor.insertText("("))
+
+    result = {
+        "lines": linhas,
+        "full_rehighlight_s": full_s,
+        "lines_per_second": linhas / full_s,
+        "replace_blocking_s": replace_s,
+        "replace_deferred_blocking_s": replace_deferred_s,
+        "replace_deferred_total_s": deferred_total_s,
+        "keystroke_ms": keystroke_s * 1e3,
+        "open_triple_quote_ms": open_string_s * 1e3,
+        "open_bracket_ms": open_bracket_s * 1e3,
+    }
+    for name, value in result.items():
+        print(f"{name:>28}: {value:.4f}" if isinstance(value, float) else f"{name:>28}: {value}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
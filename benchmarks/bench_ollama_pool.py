@@ -0,0 +1,108 @@
+# benchmarks/bench_ollama_pool.py
+#
+# Mede a vazão do OllamaPool com 1, 2, ... servidores Ollama falsos (benchmarks/fake_ollama.py), cada um
+# atendendo poucas gerações por vez, como uma GPU. Com a distribuição por requisições em andamento, a
+# vazão deve crescer quase na proporção do número de servidores. Por fim, repete a medida com um servidor
+# fora do ar e outro instável, mostrando as novas tentativas e o circuito aberto.
+#
+#   python -m benchmarks.bench_ollama_pool --hosts 4 --requests 64 --concurrency 16
+#   python -m benchmarks.bench_ollama_pool --stream --latency 0.05 --tokens-per-second 500
+
+import argparse
+import logging
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.fake_ollama import FakeOllama
+from ollama_pool import OllamaError, OllamaPool
+
+
+def start_server(args, fail_rate=0.0):
+    server = FakeOllama(
+        ("127.0.0.1", 0), args.latency, args.tokens_per_second, slots=args.slots, fail_rate=fail_rate
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def closed_port_url():
+    # Uma porta livre, sem ninguém escutando, faz o papel de um servidor fora do ar
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def run(pool, args):
+    """
+    Envia args.requests gerações com args.concurrency simultâneas.
+
+    Returns:
+        tuple: (segundos, sucessos, falhas por tipo de erro).
+    """
+    def one(i):
+        prompt = f"Pergunta {i}"
+        if args.stream:
+            "".join(pool.stream(prompt, num_predict=args.tokens))
+        else:
+            pool.invoke(prompt, num_predict=args.tokens)
+
+    errors = {}
+    ok = 0
+    inicio = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for future in [executor.submit(one, i) for i in range(args.requests)]:
+            try:
+                future.result()
+                ok += 1
+            except OllamaError as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+    return time.perf_counter() - inicio, ok, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Vazão do OllamaPool com vários servidores Ollama falsos.")
+    parser.add_argument("--hosts", type=int, default=4, help="Maior número de servidores medido.")
+    parser.add_argument("--requests", type=int, default=64)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--slots", type=int, default=2, help="Gerações simultâneas por servidor.")
+    parser.add_argument("--latency", type=float, default=0.1, help="Segundos até o primeiro token.")
+    parser.add_argument("--tokens-per-second", type=float, default=0.0, help="0 responde de uma vez.")
+    parser.add_argument("--tokens", type=int, default=20, help="Tokens por geração (num_predict).")
+    parser.add_argument("--stream", action="store_true", help="Usa gerações em streaming.")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)  # As falhas injetadas gerariam um aviso por tentativa
+    servers = [start_server(args) for _ in range(args.hosts)]
+    try:
+        base = None
+        for count in range(1, args.hosts + 1):
+            pool = OllamaPool([server.url for server in servers[:count]])
+            seconds, ok, errors = run(pool, args)
+            base = base or ok / seconds
+            por_servidor = ", ".join(str(host["requests"]) for host in pool.stats())
+            print(
+                f"{count} servidor(es): {ok / seconds:7.1f} req/s ({ok / seconds / base:4.2f}x)  "
+                f"requisições por servidor [{por_servidor}]  erros {errors or 0}"
+            )
+
+        # Um servidor fora do ar e outro que responde 503 em 30% das gerações
+        flaky = start_server(args, fail_rate=0.3)
+        pool = OllamaPool(
+            [server.url for server in servers] + [closed_port_url(), flaky.url], base_delay=0.05, max_delay=0.5
+        )
+        seconds, ok, errors = run(pool, args)
+        print(f"\nCom falhas: {ok / seconds:7.1f} req/s, {ok} sucessos, erros {errors or 0}")
+        for host in pool.stats():
+            print(f"  {host['url']:<26} {host['state']:<10} {host['requests']:4d} requisições  {host['errors']:3d} falhas")
+        flaky.shutdown()
+        flaky.server_close()
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
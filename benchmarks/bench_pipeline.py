@@ -0,0 +1,329 @@
+# benchmarks/bench_pipeline.py
+#
+# Mede o pipeline do CoderCore (latência de ponta a ponta e por etapa, chamadas ao LLM, tokens e memória) em
+# cenários representativos, com o LLM, os embeddings e o Chroma substituídos pelos de benchmarks/fakes.py.
+# O resultado é comparado com uma linha de base gravada.
+#
+#   python -m benchmarks.bench_pipeline --out resultados.json
+#   python -m benchmarks.bench_pipeline --baseline benchmarks/baseline_pipeline.json
+#   python -m benchmarks.bench_pipeline --update-baseline benchmarks/baseline_pipeline.json
+#   python -m benchmarks.bench_pipeline --concurrency 1 --no-speculative   # etapas em série, para comparar
+#
+# Com --baseline, termina com código 1 se alguma métrica piorar além de --tolerance. Para cada cenário também
+# são mostrados o caminho crítico do grafo de etapas (o tempo com vagas ilimitadas) e o tempo gasto em
+# etapas especulativas canceladas.
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+from benchmarks.fakes import HashEmbeddings, MemoryVectorStore, ScriptedOllama
+from code_patch import EDIT_FORMAT_INSTRUCTIONS
+from complexity import ComplexityClassifier
+from llm_cache import LLMCache, set_llm_cache
+
+ONE_BLOCK = """Aqui está a solução:
+
+```python
+def inverter(texto):
+    return texto[::-1]
+```
+"""
+
+MULTI_BLOCK = """Primeiro, a leitura:
+
+```python
+import csv
+
+def ler(caminho):
+    with open(caminho, newline="") as f:
+        return list(csv.DictReader(f))
+```
+
+Depois, a validação:
+
+```python
+def validar(linhas):
+    return [linha for linha in linhas if all(linha.values())]
+```
+
+E por fim a gravação, usando a leitura acima:
+
+```python
+import csv
+
+def salvar(caminho, linhas):
+    with open(caminho, "w", newline="") as f:
+        escritor = csv.DictWriter(f, fieldnames=linhas[0].keys())
+        escritor.writeheader()
+        escritor.writerows(linhas)
+```
+"""
+
+LARGE_CODE_FUNCTIONS = 2500  # Cerca de 7500 linhas
+
+LARGE_CODE_EDIT = """<<<<<<< SEARCH
+def funcao_1250(valor):
+    return valor * 1250
+=======
+def funcao_1250(valor):
+    if not isinstance(valor, (int, float)):
+        raise TypeError("valor deve ser numérico")
+    return valor * 1250
+>>>>>>> REPLACE"""
+
+SUBQUERIES = """Subconsultas:
+1. Quais são os requisitos de consistência do sistema?
+2. Como cada arquitetura lida com falhas de nós?
+3. Qual o custo de operação de cada alternativa?"""
+
+CHAIN = " ".join(
+    f"{passo}: análise do passo considerando a pergunta e o código." for passo in (
+        "Compreensão da pergunta", "Identificação dos dados relevantes", "Formulação de hipóteses",
+        "Análise lógica", "Verificação da consistência", "Síntese da resposta", "Revisão e refinamento",
+    )
+)
+
+DOCUMENTS = [
+    f"Documento {i}: exemplo de {tema} em Python com funções, testes e tratamento de erros."
+    for i, tema in enumerate(
+        ["strings", "listas", "arquivos CSV", "filas distribuídas", "tolerância a falhas", "ordenação",
+         "concorrência", "validação de entrada", "serialização", "consistência eventual"] * 30
+    )
+]
+
+
+def large_code():
+    return "".join(f"def funcao_{i}(valor):\n    return valor * {i}\n\n" for i in range(LARGE_CODE_FUNCTIONS))
+
+
+SCENARIOS = {
+    "simple": {
+        "query": "Como inverter uma string em Python?",
+        "code": "",
+        "complexity": "Simples",
+        "code_reply": ONE_BLOCK,
+    },
+    "complex": {
+        "query": (
+            "Projete e compare duas arquiteturas para um sistema distribuído de filas com tolerância a falhas, "
+            "analisando desempenho, consistência e custos de operação em detalhes, e explique as vantagens "
+            "e desvantagens de cada uma considerando também a evolução do sistema."
+        ),
+        "code": "",
+        "complexity": "Complexa",
+        "code_reply": ONE_BLOCK,
+    },
+    "multi_block": {
+        "query": "Crie funções para ler, validar e salvar um arquivo CSV.",
+        "code": "",
+        "complexity": "Simples",
+        "code_reply": MULTI_BLOCK,
+    },
+    "large_code": {
+        "query": "Adicione validação de entrada em funcao_1250.",
+        "code": large_code(),
+        "complexity": "Simples",
+        "code_reply": LARGE_CODE_EDIT,
+    },
+}
+
+
+def script(scenario):
+    """
+    Regras do ScriptedOllama para um cenário, identificando a etapa por trechos fixos de cada prompt.
+    """
+    return [
+        ('Responda apenas com "Simples" ou "Complexa"', scenario["complexity"]),
+        ("Descomponha a seguinte consulta", SUBQUERIES),
+        ("<raciocinio>", f"<raciocinio>{CHAIN}</raciocinio>\n<resposta>Resposta direta.</resposta>\n"
+                         f"<codigo>{scenario['code_reply']}</codigo>"),
+        (EDIT_FORMAT_INSTRUCTIONS[:40], scenario["code_reply"]),
+        ("Solução de Código:", scenario["code_reply"]),
+        ("Gere uma cadeia de pensamento", CHAIN),
+        ("Subconsulta:", "Resposta parcial concisa à subconsulta, com os pontos principais."),
+        ("Combine as respostas parciais", "Resposta sintetizada a partir das respostas parciais."),
+        ("Forneça uma resposta direta", "Resposta direta e concisa para a pergunta original."),
+    ]
+
+
+def build_core(scenario, store, args):
+    from coder_core import CoderCore, ModeloLLM, VectorStoreManager
+
+    llm = ScriptedOllama(script(scenario), latency=args.latency, tokens_per_second=args.tokens_per_second)
+    manager = VectorStoreManager(embeddings=store.embeddings, vectorstore=store.vectorstore)
+    return CoderCore(
+        default_mode=args.mode,
+        model=ModeloLLM(cliente=llm),
+        vectorstore_manager=manager,
+        complexity_classifier=ComplexityClassifier.load("complexity_weights.json"),
+        max_concurrency=args.concurrency,
+        speculative=args.speculative,
+    )
+
+
+class _Store:
+    def __init__(self):
+        self.embeddings = HashEmbeddings()
+        self.vectorstore = MemoryVectorStore(self.embeddings, DOCUMENTS)
+
+
+def run_once(scenario, store, args):
+    from coder_core import RequestContext
+
+    # Cache vazio a cada execução: cada rodada paga todas as chamadas ao LLM
+    set_llm_cache(LLMCache(None))
+    core = build_core(scenario, store, args)
+    context = RequestContext()
+    inicio = time.perf_counter()
+    core.run_pipeline(scenario["query"], [], scenario["code"], context=context)
+    seconds = time.perf_counter() - inicio
+    summary = context.trace.summary()
+    stages = {}
+    for span in summary["spans"]:
+        stages[span["name"]] = stages.get(span["name"], 0.0) + span["seconds"]
+    return seconds, stages, dict(context.counters), core.model.modelo.calls, summary["schedule"]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def bench_scenario(name, store, args):
+    scenario = SCENARIOS[name]
+    run_once(scenario, store, args)  # Aquecimento (imports, caches do interpretador)
+    totals, stage_runs, schedules = [], [], []
+    for _ in range(args.runs):
+        seconds, stages, counters, calls, schedule = run_once(scenario, store, args)
+        totals.append(seconds)
+        stage_runs.append(stages)
+        schedules.append(schedule)
+
+    # Memória medida em uma rodada à parte, pois o tracemalloc deixa tudo mais lento
+    tracemalloc.start()
+    run_once(scenario, store, args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    names = sorted({stage for stages in stage_runs for stage in stages})
+    return {
+        "e2e_p50_s": percentile(totals, 0.5),
+        "e2e_p95_s": percentile(totals, 0.95),
+        "e2e_mean_s": statistics.mean(totals),
+        "stages_mean_s": {stage: statistics.mean(s.get(stage, 0.0) for s in stage_runs) for stage in names},
+        "critical_path_mean_s": statistics.mean(s["critical_path_seconds"] for s in schedules),
+        "cancelled_mean_s": statistics.mean(s["cancelled_seconds"] for s in schedules),
+        "critical_path": schedules[-1]["critical_path"],
+        "llm_calls": calls,
+        "cache_hits": counters["cache_hits"],
+        "retries": counters["retries"],
+        "prompt_tokens": counters["prompt_tokens"],
+        "completion_tokens": counters["completion_tokens"],
+        "peak_kb": peak / 1024,
+    }
+
+
+# Métricas comparadas com a linha de base e a diferença absoluta mínima para contar como piora
+COMPARED = {
+    "e2e_p50_s": 0.005, "e2e_mean_s": 0.005, "critical_path_mean_s": 0.005, "llm_calls": 0, "prompt_tokens": 0, "completion_tokens": 0,
+    "peak_kb": 256,
+}
+
+
+def compare(result, baseline, tolerance):
+    """
+    Compara cada métrica com a linha de base.
+
+    Returns:
+        list: Tuplas (cenário, métrica, base, atual, variação relativa, piorou).
+    """
+    rows = []
+    for name, current in result["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if base is None:
+            continue
+        metrics = [(metric, base.get(metric), current[metric], slack) for metric, slack in COMPARED.items()]
+        metrics += [
+            (f"stage:{stage}", base.get("stages_mean_s", {}).get(stage), seconds, 0.005)
+            for stage, seconds in current["stages_mean_s"].items()
+        ]
+        for metric, old, new, slack in metrics:
+            if old is None:
+                continue
+            change = (new - old) / old if old else (0.0 if new == old else float("inf"))
+            rows.append((name, metric, old, new, change, change > tolerance and new - old > slack))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mede o pipeline do CoderCore com LLM e embeddings falsos.")
+    parser.add_argument("--scenarios", nargs="+", choices=sorted(SCENARIOS), default=list(SCENARIOS))
+    parser.add_argument("--runs", type=int, default=5, help="Rodadas medidas por cenário.")
+    parser.add_argument("--mode", default="decompose", help="Modo do pipeline (chain, decompose ou single).")
+    parser.add_argument("--latency", type=float, default=0.02, help="Segundos até o primeiro token do LLM falso.")
+    parser.add_argument("--tokens-per-second", type=float, default=2000.0, help="Velocidade do LLM falso.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Etapas simultâneas do grafo do pipeline.")
+    parser.add_argument("--no-speculative", dest="speculative", action="store_false",
+                        help="Não começa os caminhos simples e complexo antes da classificação pelo LLM.")
+    parser.add_argument("--out", help="Grava o resultado em JSON neste arquivo.")
+    parser.add_argument("--baseline", help="Linha de base (JSON) com a qual comparar o resultado.")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Piora relativa tolerada na comparação.")
+    parser.add_argument("--update-baseline", metavar="PATH", help="Grava o resultado como nova linha de base.")
+    args = parser.parse_args()
+
+    import logging
+    logging.disable(logging.INFO)  # Os logs por chamada distorceriam as medidas
+
+    store = _Store()
+    result = {
+        "meta": {
+            "created": time.time(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "runs": args.runs,
+            "mode": args.mode,
+            "latency_s": args.latency,
+            "tokens_per_second": args.tokens_per_second,
+            "concurrency": args.concurrency,
+            "speculative": args.speculative,
+        },
+        "scenarios": {},
+    }
+    for name in args.scenarios:
+        result["scenarios"][name] = data = bench_scenario(name, store, args)
+        stages = ", ".join(f"{stage} {seconds * 1e3:.0f}ms" for stage, seconds in data["stages_mean_s"].items())
+        print(
+            f"{name:>12}: p50 {data['e2e_p50_s'] * 1e3:7.1f}ms  p95 {data['e2e_p95_s'] * 1e3:7.1f}ms  "
+            f"{data['llm_calls']:2d} chamadas  {data['prompt_tokens']:6d}→{data['completion_tokens']:<5d} tok  "
+            f"pico {data['peak_kb']:8.0f} KiB  [{stages}]"
+        )
+        print(
+            f"{'':>12}  caminho crítico {data['critical_path_mean_s'] * 1e3:7.1f}ms de {data['e2e_mean_s'] * 1e3:.1f}ms "
+            f"({' → '.join(data['critical_path'])}), canceladas {data['cancelled_mean_s'] * 1e3:.1f}ms"
+        )
+
+    for path in (args.out, args.update_baseline):
+        if path:
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(result, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        piorou = False
+        print(f"\nComparação com {args.baseline} (tolerância {args.tolerance:.0%}):")
+        for name, metric, old, new, change, worse in compare(result, baseline, args.tolerance):
+            piorou |= worse
+            marca = "PIOROU" if worse else ""
+            print(f"{name:>12} {metric:<24} {old:12.4f} -> {new:12.4f}  {change:+7.1%}  {marca}")
+        return 1 if piorou else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
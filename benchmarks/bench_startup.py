@@ -0,0 +1,125 @@
+# benchmarks/bench_startup.py
+#
+# Mede o início da interface em um processo novo: o tempo de importação de cada módulo de canvas.py
+# (python -X importtime) e o tempo até a janela aparecer. Termina com código 1 se uma dependência pesada
+# (torch, langchain, chromadb, ...) for importada antes de a janela aparecer, ou se um tempo passar do
+# limite, para que regressões no início sejam percebidas.
+#
+#   QT_QPA_PLATFORM=offscreen python -m benchmarks.bench_startup
+#   QT_QPA_PLATFORM=offscreen python -m benchmarks.bench_startup --top 30 --max-import-ms 1000 --out inicio.json
+#
+# O CoderCore (cliente do LLM, embeddings e Chroma) é carregado depois, em segundo plano, pelo CoreLoader;
+# o processo medido termina assim que a janela aparece, sem esperar por ele.
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# Módulos que só podem ser importados pelo CoreLoader, depois de a janela aparecer
+HEAVY_MODULES = (
+    "torch", "transformers", "sentence_transformers", "langchain", "langchain_core", "langchain_community",
+    "langchain_huggingface", "chromadb", "numpy",
+)
+
+# Separa, na saída de erro, as importações de canvas das feitas ao criar a janela
+_MARKER = "--- canvas importado ---"
+
+_PROBE = f"""
+import json, os, sys, time
+inicio = time.perf_counter()
+import canvas
+importado = time.perf_counter()
+print({_MARKER!r}, file=sys.stderr, flush=True)
+from PyQt5.QtWidgets import QApplication
+app = QApplication(sys.argv)
+janela = canvas.ChatbotCanvas()
+carregados = sorted(name for name in sys.modules if name.split(".")[0] in {HEAVY_MODULES!r})
+janela.show()
+app.processEvents()
+exibido = time.perf_counter()
+print(json.dumps({{
+    "import_ms": (importado - inicio) * 1000,
+    "window_ms": (exibido - inicio) * 1000,
+    "heavy_modules": carregados,
+}}), flush=True)
+os._exit(0)  # Não espera o CoreLoader, que continua carregando os modelos
+"""
+
+
+def parse_importtime(stderr):
+    """
+    Lê a saída de python -X importtime.
+
+    Returns:
+        list: {"module", "self_ms", "cumulative_ms", "depth"} na ordem em que as importações terminaram.
+    """
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        imports.append({
+            "module": name.strip(),
+            "self_ms": int(self_us) / 1000,
+            "cumulative_ms": int(cumulative_us) / 1000,
+            "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+        })
+    return imports
+
+
+def measure():
+    """
+    Executa a sonda em um processo novo a partir da raiz do repositório.
+
+    Returns:
+        tuple: (resultado da sonda, importações feitas por "import canvas").
+    """
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ)
+    env.setdefault("QT_QPA_PLATFORM", "offscreen")
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", _PROBE], cwd=root, env=env, capture_output=True, text=True
+    )
+    if process.returncode != 0 or not process.stdout.strip():
+        raise RuntimeError(f"A sonda de início falhou:\n{process.stderr[-2000:]}")
+    stderr = process.stderr.split(_MARKER, 1)[0]
+    return json.loads(process.stdout.strip().splitlines()[-1]), parse_importtime(stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo de importação e de abertura da janela da interface.")
+    parser.add_argument("--top", type=int, default=20, help="Módulos mostrados, pelo tempo acumulado.")
+    parser.add_argument("--max-import-ms", type=float, help="Limite para importar canvas.")
+    parser.add_argument("--max-window-ms", type=float, help="Limite até a janela aparecer.")
+    parser.add_argument("--out", help="Arquivo JSON com os tempos e todas as importações.")
+    args = parser.parse_args()
+
+    probe, imports = measure()
+    print(f"{'acumulado':>10} {'próprio':>9}  módulo")
+    for item in sorted(imports, key=lambda item: item["cumulative_ms"], reverse=True)[:args.top]:
+        print(f"{item['cumulative_ms']:8.1f}ms {item['self_ms']:7.1f}ms  {'  ' * item['depth']}{item['module']}")
+    print(f"\nimport canvas: {probe['import_ms']:.1f}ms  janela visível: {probe['window_ms']:.1f}ms")
+
+    heavy = sorted({item["module"] for item in imports if item["module"].split(".")[0] in HEAVY_MODULES})
+    heavy = sorted(set(heavy) | set(probe["heavy_modules"]))
+    problems = []
+    if heavy:
+        problems.append(f"dependências pesadas importadas antes da janela: {', '.join(heavy[:10])}")
+    if args.max_import_ms is not None and probe["import_ms"] > args.max_import_ms:
+        problems.append(f"import canvas levou {probe['import_ms']:.1f}ms (limite {args.max_import_ms:.0f}ms)")
+    if args.max_window_ms is not None and probe["window_ms"] > args.max_window_ms:
+        problems.append(f"a janela levou {probe['window_ms']:.1f}ms (limite {args.max_window_ms:.0f}ms)")
+
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({**probe, "heavy_modules": heavy, "imports": imports}, f, indent=2)
+    for problem in problems:
+        print(f"PIOROU: {problem}")
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# benchmarks/fake_ollama.py
+#
+# Servidor que imita a API /api/generate do Ollama com latência e velocidade configuráveis, para medir a
+# vazão do pipeline sem um modelo de verdade.
+#
+#   python -m benchmarks.fake_ollama --port 11500 --latency 0.2 --tokens-per-second 300
+#   python headless.py --ollama-url http://127.0.0.1:11500 batch perguntas.jsonl --concurrency 8
+#
+# --slots limita as gerações simultâneas, como uma GPU; com vários servidores assim, a vazão mostra a
+# distribuição feita por ollama_pool.OllamaPool (ver bench_ollama_pool.py).
+#
+# A resposta padrão é válida para todas as etapas: decide "Simples" na classificação e traz as seções
+# <raciocinio>, <resposta> e <codigo> do modo de passagem única, com um bloco de código Python.
+
+import argparse
+import contextlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_REPLY = """<raciocinio>Simples: a pergunta pede uma função pequena; basta percorrer os valores.</raciocinio>
+<resposta>Use um laço que acumula os valores em uma variável.</resposta>
+<codigo>```python
+def soma(valores):
+    total = 0
+    for valor in valores:
+        total += valor
+    return total
+```</codigo>"""
+
+
+class FakeOllama(ThreadingHTTPServer):
+    """
+    Args:
+        address (tuple): (host, porta); porta 0 escolhe uma livre.
+        latency (float): Segundos até o primeiro token.
+        tokens_per_second (float): Velocidade de geração; 0 envia tudo de uma vez.
+        reply (str): Texto devolvido a todos os prompts.
+        slots (int): Gerações simultâneas, como uma GPU que atende poucas por vez; as demais esperam.
+            0 não limita.
+        fail_rate (float): Fração das gerações que respondem 503, para exercitar novas tentativas.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, latency=0.2, tokens_per_second=300.0, reply=DEFAULT_REPLY, slots=0,
+                 fail_rate=0.0):
+        super().__init__(address, _FakeOllamaHandler)
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.reply = reply
+        self.slots = threading.Semaphore(slots) if slots else contextlib.nullcontext()
+        self.fail_rate = fail_rate
+        self.failures = 0
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def track(self, delta):
+        with self._lock:
+            if delta > 0:
+                self.requests += 1
+            self.in_flight += delta
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def chunks(self):
+        # Cada palavra (com o espaço seguinte) conta como um token
+        words = self.reply.split(" ")
+        return [word + " " for word in words[:-1]] + [words[-1]]
+
+
+class _FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, body, status=200):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        server = self.server
+        if self.path == "/api/tags":
+            self._send_json({"models": [{"name": "llama3.2:latest", "model": "llama3.2:latest"}]})
+        elif self.path == "/stats":
+            self._send_json({"requests": server.requests, "max_in_flight": server.max_in_flight,
+                             "failures": server.failures})
+        else:
+            self._send_json({"status": "Ollama is running"})
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        model = request.get("model", "llama3.2")
+        if server.fail_rate and random.random() < server.fail_rate:
+            with server._lock:
+                server.failures += 1
+            self._send_json({"error": "servidor sobrecarregado"}, status=503)
+            return
+        server.track(1)
+        try:
+            with server.slots:
+                self._generate(request, model)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # O cliente cancelou a geração
+        finally:
+            server.track(-1)
+
+    def _generate(self, request, model):
+        server = self.server
+        time.sleep(server.latency)
+        chunks = server.chunks()
+        limit = request.get("options", {}).get("num_predict")
+        if isinstance(limit, int) and limit > 0:
+            chunks = chunks[:limit]
+        if not request.get("stream", True):
+            time.sleep(len(chunks) / server.tokens_per_second if server.tokens_per_second else 0)
+            self._send_json({"model": model, "response": "".join(chunks), "done": True})
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            if server.tokens_per_second:
+                time.sleep(1 / server.tokens_per_second)
+            self._write_chunk({"model": model, "response": chunk, "done": False})
+        self._write_chunk({"model": model, "response": "", "done": True, "done_reason": "stop",
+                           "eval_count": len(chunks)})
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, body):
+        data = json.dumps(body).encode("utf-8") + b"\n"
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor Ollama falso para medir vazão sem um modelo.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11500)
+    parser.add_argument("--latency", type=float, default=0.2, help="Segundos até o primeiro token.")
+    parser.add_argument("--tokens-per-second", type=float, default=300.0, help="0 para responder de uma vez.")
+    parser.add_argument("--reply", help="Arquivo com o texto devolvido a todos os prompts.")
+    parser.add_argument("--slots", type=int, default=0, help="Gerações simultâneas (0 não limita).")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fração das gerações que respondem 503.")
+    args = parser.parse_args()
+
+    reply = DEFAULT_REPLY
+    if args.reply:
+        with open(args.reply, "r", encoding="utf-8") as f:
+            reply = f.read()
+    server = FakeOllama(
+        (args.host, args.port), args.latency, args.tokens_per_second, reply, args.slots, args.fail_rate
+    )
+    print(f"Ollama falso em {server.url}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# benchmarks/fakes.py
+#
+# Substitutos determinísticos do Ollama, do modelo de embeddings e do Chroma, para medir o pipeline sem
+# modelos: as respostas vêm de um roteiro e o custo de cada chamada é uma espera configurável.
+
+import math
+import re
+import threading
+import time
+import zlib
+
+
+class _Generation:
+    def __init__(self, text):
+        self.text = text
+
+
+class _LLMResult:
+    def __init__(self, text):
+        self.generations = [[_Generation(text)]]
+
+
+class ScriptedOllama:
+    """
+    Imita o cliente Ollama do LangChain (model, generate, stream, invoke) com respostas roteirizadas.
+
+    Args:
+        rules (list): Pares (trecho, resposta); vale a primeira regra cujo trecho aparece no prompt. A resposta
+            pode ser um texto ou uma função que recebe o prompt.
+        default (str): Resposta quando nenhuma regra se aplica.
+        latency (float): Segundos até o primeiro token de cada chamada.
+        tokens_per_second (float): Velocidade de geração (cada palavra conta como um token); 0 para instantânea.
+    """
+    def __init__(self, rules, default="Ok.", latency=0.02, tokens_per_second=2000.0, model="scripted"):
+        self.model = model
+        self.rules = list(rules)
+        self.default = default
+        self.latency = latency
+        self.tokens_per_second = tokens_per_second
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def reply(self, prompt):
+        with self._lock:
+            self.calls += 1
+        for marker, answer in self.rules:
+            if marker in prompt:
+                return answer(prompt) if callable(answer) else answer
+        return self.default
+
+    def _chunks(self, text):
+        words = text.split(" ")
+        return [word + " " for word in words[:-1]] + [words[-1]]
+
+    def _token_delay(self):
+        return 1 / self.tokens_per_second if self.tokens_per_second else 0.0
+
+    def generate(self, prompts, **kwargs):
+        text = self.reply(prompts[0])
+        time.sleep(self.latency + len(self._chunks(text)) * self._token_delay())
+        return _LLMResult(text)
+
+    def stream(self, prompt, **kwargs):
+        text = self.reply(prompt)
+        time.sleep(self.latency)
+        delay = self._token_delay()
+        for chunk in self._chunks(text):
+            if delay:
+                time.sleep(delay)
+            yield chunk
+
+    def invoke(self, prompt, **kwargs):
+        return self.generate([prompt]).generations[0][0].text
+
+
+class HashEmbeddings:
+    """
+    Embeddings baratos e determinísticos: cada palavra soma ±1 em uma dimensão escolhida pelo seu hash.
+    Textos com palavras em comum ficam próximos, o que basta para exercitar a recuperação.
+    """
+    def __init__(self, dim=64):
+        self.dim = dim
+
+    def _vector(self, text):
+        vector = [0.0] * self.dim
+        for word in re.findall(r"\w+", text.lower()):
+            h = zlib.crc32(word.encode("utf-8"))
+            vector[h % self.dim] += 1.0 if (h >> 16) & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts):
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+class Document:
+    def __init__(self, page_content, metadata=None):
+        self.page_content = page_content
+        self.metadata = metadata or {}
+
+
+class MemoryVectorStore:
+    """
+    Busca por similaridade em memória, por força bruta, com a interface usada do Chroma.
+    """
+    def __init__(self, embeddings, texts):
+        self.documents = [Document(text, {"source": f"doc_{i}"}) for i, text in enumerate(texts)]
+        self.vectors = embeddings.embed_documents(texts)
+
+    def similarity_search_by_vector(self, vector, k=4):
+        scores = [sum(a * b for a, b in zip(vector, other)) for other in self.vectors]
+        best = sorted(range(len(scores)), key=scores.__getitem__, reverse=True)[:k]
+        return [self.documents[i] for i in best]
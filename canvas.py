@@ -1,76 +1,195 @@
 # canvas.py
 
 from PyQt5.QtWidgets import (
-    QApplication, QWidget, QVBoxLayout, QHBoxLayout, QTextEdit, QPushButton,
+    QApplication, QWidget, QVBoxLayout, QHBoxLayout, QPushButton,
     QSplitter, QLineEdit, QMenuBar, QAction, QSizePolicy, QPlainTextEdit,
-    QToolBar, QFileDialog, QLabel
+    QToolBar, QFileDialog, QLabel, QComboBox, QStatusBar, QMenu, QToolButton
 )
-from PyQt5.QtCore import Qt, QThread, pyqtSignal, QEvent
-from PyQt5.QtGui import QIcon, QMovie, QSyntaxHighlighter, QTextCharFormat, QColor, QFont
+from PyQt5.QtCore import Qt, QThread, QTimer, pyqtSignal, QEvent
+from PyQt5.QtGui import QIcon, QMovie, QTextCursor, QKeySequence
 import sys
-import markdown
-import json
-import re
-from coder_core import CoderCore
+import time
+import logging
+from chat_history import (
+    ChatHistory, ROLE_USER, ROLE_ASSISTANT, ROLE_SYSTEM, STATUS_PENDING, STATUS_STREAMING, STATUS_DONE,
+    STATUS_CANCELLED, STATUS_FAILED,
+)
+from chat_view import ChatView
+from code_patch import compute_edits
+from edit_history import EditHistory, KIND_AI
+from highlighter import PythonHighlighter
+from session_store import SessionStore, SESSION_VERSION
+from telemetry import format_summary
+from coder_core import get_coder_core, RequestCancelled, RequestContext, PIPELINE_MODES
+
+# Labels shown while each pipeline stage runs
+STAGE_LABELS = {
+    "classify": "Classificando a pergunta...",
+    "single": "Gerando raciocínio, resposta e código em uma única chamada...",
+    "decompose": "Dividindo a pergunta em subconsultas...",
+    "subqueries": "Respondendo às subconsultas em paralelo...",
+    "synthesize": "Sintetizando as respostas parciais...",
+    "reason": "Gerando a cadeia de pensamento...",
+    "answer": "Gerando a resposta...",
+    "code": "Gerando o código...",
+    "modify": "Gerando as edições do código...",
+}
+
+AUTOSAVE_INTERVAL_MS = 30000  # Autosave of a session that already has a file
+
+UNDO_MENU_STEPS = 20  # Undo steps listed in the undo dropdown
+
+# Readiness of the shared CoderCore, shown in the toolbar
+CORE_LOADING = "loading"
+CORE_WARMING = "warming"
+CORE_READY = "ready"
+CORE_FAILED = "failed"
+CORE_STATE_LABELS = {
+    CORE_LOADING: "⏳ Carregando modelos...",
+    CORE_WARMING: "⏳ Aquecendo modelos...",
+    CORE_READY: "🟢 Pronto",
+    CORE_FAILED: "🔴 Falha ao carregar",
+}
+
+def _qt_position(text, offset):
+    """
+    Convert a character offset in text to a QTextDocument position, which counts UTF-16 code units.
+    """
+    prefix = text[:offset]
+    return offset + sum(1 for ch in prefix if ord(ch) > 0xFFFF)
+
+
+class CoreLoader(QThread):
+    """
+    Load the shared CoderCore (LLM client, embeddings and vector store) in the background and warm up its models.
+    """
+    warming = pyqtSignal()  # The core was created and its models are being warmed up
+    loaded = pyqtSignal(dict)  # Health state after the warm-up
+    failed = pyqtSignal(str)  # The core could not be created
 
-class Worker(QThread):
-    finished = pyqtSignal(str, list)
+    def run(self):
+        try:
+            coder_core = get_coder_core()
+        except Exception as e:
+            logging.error(f"Erro ao carregar o CoderCore: {str(e)}")
+            self.failed.emit(str(e))
+            return
+        self.warming.emit()
+        self.loaded.emit(coder_core.warm_up())
 
-    def __init__(self, user_query, chat_history, existing_code):
+class Worker(QThread):
+    """
+    Run the whole query pipeline in the background: classification, chain of thought,
+    answer and code generation or modification.
+    """
+    response_ready = pyqtSignal(str, list)  # Final answer and chain-of-thought steps
+    code_ready = pyqtSignal(str)  # Generated or modified code (may be empty)
+    stage = pyqtSignal(str)  # Name of the pipeline stage that just started
+    token = pyqtSignal(str)  # Answer tokens as they arrive from the model
+    code_token = pyqtSignal(str)  # Code tokens as they arrive from the model
+    first_token = pyqtSignal(float)  # Seconds from start to the first answer token
+    cancelled = pyqtSignal()
+    failed = pyqtSignal(str)
+    trace_ready = pyqtSignal(dict)  # Per-stage timings of the finished request (telemetry.Trace.summary)
+
+    def __init__(self, user_query, chat_history, existing_code, mode=None):
         super().__init__()
         self.user_query = user_query
         self.chat_history = chat_history
         self.existing_code = existing_code
-        self.coder_core = CoderCore()
+        self.mode = mode
+        self.context = RequestContext(on_stage=self.stage.emit)
+        self.started_at = None
+
+    def cancel(self):
+        self.context.cancel()
+
+    def emit_token(self, token):
+        if self.started_at is not None:
+            self.first_token.emit(time.perf_counter() - self.started_at)
+            self.started_at = None
+        self.token.emit(token)
 
     def run(self):
-        response, steps = self.coder_core.process_query(
-            self.user_query, self.chat_history, self.existing_code
-        )
-        self.finished.emit(response, steps)
-
-class PythonHighlighter(QSyntaxHighlighter):
-    def __init__(self, document):
-        super().__init__(document)
-        self.highlighting_rules = []
-
-        # Palavras-chave do Python
-        keyword_format = QTextCharFormat()
-        keyword_format.setForeground(QColor("#569CD6"))
-        keyword_format.setFontWeight(QFont.Bold)
-        keywords = [
-            "def", "class", "if", "elif", "else", "while", "for", "try",
-            "except", "import", "from", "return", "with", "as", "pass",
-            "break", "continue", "raise", "in", "is", "not", "and", "or"
-        ]
-        for word in keywords:
-            pattern = r'\b' + word + r'\b'
-            self.highlighting_rules.append((re.compile(pattern), keyword_format))
-
-        # Strings
-        string_format = QTextCharFormat()
-        string_format.setForeground(QColor("#D69D85"))
-        self.highlighting_rules.append((re.compile(r'\".*\"'), string_format))
-        self.highlighting_rules.append((re.compile(r'\'.*\''), string_format))
-
-        # Comentários
-        comment_format = QTextCharFormat()
-        comment_format.setForeground(QColor("#6A9955"))
-        self.highlighting_rules.append((re.compile(r'#.*'), comment_format))
-
-    def highlightBlock(self, text):
-        for pattern, fmt in self.highlighting_rules:
-            for match in pattern.finditer(text):
-                start, end = match.span()
-                self.setFormat(start, end - start, fmt)
+        self.started_at = time.perf_counter()
+        try:
+            # Blocks until the shared core is loaded if CoreLoader is still running
+            coder_core = get_coder_core()
+            self.context.check()
+            _, _, code_solution = coder_core.run_pipeline(
+                self.user_query, self.chat_history, self.existing_code,
+                context=self.context,
+                on_token=self.emit_token,
+                on_code_token=self.code_token.emit,
+                on_answer=self.response_ready.emit,
+                mode=self.mode,
+            )
+            self.code_ready.emit(code_solution)
+        except RequestCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            logging.error(f"Erro no pipeline: {str(e)}")
+            self.failed.emit(str(e))
+        finally:
+            if self.context.trace.status is not None:
+                self.trace_ready.emit(self.context.trace.summary())
+
+class CodeEditor(QPlainTextEdit):
+    """
+    Plain-text code editor. Large pastes are highlighted in chunks so the window stays responsive.
+    """
+    cursor_jumped = pyqtSignal()  # The cursor moved by a click or a navigation key, not by typing
+
+    NAVIGATION_KEYS = (
+        Qt.Key_Left, Qt.Key_Right, Qt.Key_Up, Qt.Key_Down, Qt.Key_Home, Qt.Key_End, Qt.Key_PageUp, Qt.Key_PageDown,
+    )
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.highlighter = PythonHighlighter(self.document())
+
+    def mousePressEvent(self, event):
+        self.cursor_jumped.emit()
+        super().mousePressEvent(event)
+
+    def keyPressEvent(self, event):
+        if event.key() in self.NAVIGATION_KEYS:
+            self.cursor_jumped.emit()
+        super().keyPressEvent(event)
+
+    def set_code(self, text):
+        """
+        Replace the whole text, deferring the highlighting of long files.
+        """
+        self.defer_highlight(text)
+        self.setPlainText(text)
+
+    def defer_highlight(self, text):
+        if text.count("\n") > PythonHighlighter.CHUNK_LINES:
+            self.highlighter.defer()
+
+    def insertFromMimeData(self, source):
+        if source.hasText():
+            self.defer_highlight(source.text())
+        super().insertFromMimeData(source)
 
 class ChatbotCanvas(QWidget):
+    session_saved = pyqtSignal(str, str, bool)  # Path, error message (empty on success), notify the user
+
     def __init__(self):
         super().__init__()
-        self.coder_core = CoderCore()  # Instantiate CoderCore for processing queries
-        self.undo_stack = []  # Stack to manage undo actions
-        self.redo_stack = []  # Stack to manage redo actions
+        self.core_loader = None  # Loads the shared CoderCore once the window is shown
+        self.core_state = CORE_LOADING
+        self.queued_messages = []  # (user message, pending message, mode) waiting for the core or earlier requests
+        self.worker = None  # Worker running the current request
+        self.retired_workers = []  # Cancelled workers kept alive until their thread ends
+        self.history = ChatHistory()  # Source of truth for the chat view and the history sent to the core
+        self.pending_message = None  # Assistant message of the current request
+        self.code_streaming = False  # Whether the code area is showing streamed tokens
+        self.edit_history = EditHistory()  # Delta-based undo/redo of the code area
         self.updating_code = False  # Flag to indicate AI updates
+        self.session = SessionStore()  # Session file, written incrementally once saved or loaded
+        self.loading_session = None  # Session whose older messages are still being decoded
         self.initUI()
 
     def initUI(self):
@@ -85,9 +204,13 @@ class ChatbotCanvas(QWidget):
         settings_action = QAction("⚙️ Settings", self)
         save_action = QAction("💾 Salvar Sessão", self)
         load_action = QAction("📂 Carregar Sessão", self)
+        timings_action = QAction("📊 Tempos", self)
+        timings_action.setCheckable(True)
+        timings_action.setChecked(True)
         menubar.addAction(settings_action)
         menubar.addAction(save_action)
         menubar.addAction(load_action)
+        menubar.addAction(timings_action)
         main_layout.addWidget(menubar)
 
         # Conectar ações de salvar e carregar
@@ -97,11 +220,35 @@ class ChatbotCanvas(QWidget):
         # Toolbar with undo and redo buttons
         toolbar = QToolBar("Edit Tools")
         undo_action = QAction("⮪ Undo", self)
-        undo_action.triggered.connect(self.undo_action)
+        undo_action.setShortcut(QKeySequence.Undo)
+        undo_action.triggered.connect(lambda: self.undo_action())
+        # Dropdown with the labeled steps, to undo several at once
+        self.undo_menu = QMenu(self)
+        self.undo_menu.aboutToShow.connect(self.populate_undo_menu)
+        undo_action.setMenu(self.undo_menu)
         redo_action = QAction("⮫ Redo", self)
+        redo_action.setShortcut(QKeySequence.Redo)
         redo_action.triggered.connect(self.redo_action)
+        self.undo_button = undo_action
+        self.redo_button = redo_action
+        stop_action = QAction("⏹ Stop", self)
+        stop_action.triggered.connect(self.stop_request)
         toolbar.addAction(undo_action)
+        toolbar.widgetForAction(undo_action).setPopupMode(QToolButton.MenuButtonPopup)
         toolbar.addAction(redo_action)
+        toolbar.addAction(stop_action)
+
+        # Pipeline mode used for the next messages
+        self.mode_selector = QComboBox()
+        self.mode_selector.addItems(PIPELINE_MODES)
+        self.mode_selector.setCurrentText("decompose")
+        self.mode_selector.setToolTip("Modo do pipeline: chain, decompose ou single (uma única chamada)")
+        toolbar.addWidget(self.mode_selector)
+
+        # Readiness of the models; messages sent before they are ready wait in a queue
+        self.core_status = QLabel(CORE_STATE_LABELS[CORE_LOADING])
+        self.core_status.setContentsMargins(8, 0, 8, 0)
+        toolbar.addWidget(self.core_status)
         main_layout.addWidget(toolbar)
 
         # Splitter to separate chat and code editor areas
@@ -109,22 +256,22 @@ class ChatbotCanvas(QWidget):
         splitter.setContentsMargins(0, 0, 0, 0)
 
         # Chat area (left side)
-        self.chat_area = QTextEdit()
-        self.chat_area.setReadOnly(True)
-        self.chat_area.setPlaceholderText("Chat with the bot...")
+        self.chat_area = ChatView(self.history)  # Renders only the visible messages
         self.chat_area.setStyleSheet("background-color: #1e1e1e; color: #ffffff;")
         splitter.addWidget(self.chat_area)
 
         # Code area (right side)
-        self.code_area = QTextEdit()  # Use QTextEdit for better code formatting and syntax highlighting
+        self.code_area = CodeEditor()  # Plain text layout keeps long files fast to edit and highlight
         self.code_area.setPlaceholderText("Code editor...")
-        self.code_area.setAcceptRichText(False)
         self.code_area.setStyleSheet("font-family: 'Courier New', monospace; font-size: 12pt; background-color: #1e1e1e; color: #ffffff;")
+        self.code_area.setUndoRedoEnabled(False)  # The toolbar actions use self.edit_history instead
         self.code_area.textChanged.connect(self.track_code_changes)
+        # Typing after the cursor jumps elsewhere starts a new undo step
+        self.code_area.cursor_jumped.connect(lambda: self.edit_history.break_group())
         splitter.addWidget(self.code_area)
 
         # Aplicar destaque de sintaxe
-        self.highlighter = PythonHighlighter(self.code_area.document())
+        self.highlighter = self.code_area.highlighter
 
         # Setting the stretch factor to make it look like the canvas you described
         splitter.setStretchFactor(0, 1)  # Chat area occupies one-third
@@ -168,11 +315,71 @@ class ChatbotCanvas(QWidget):
         self.loading_label.setMovie(loading_movie)
         main_layout.addWidget(self.loading_label)
 
+        # Current pipeline stage
+        self.stage_label = QLabel(self)
+        self.stage_label.setVisible(False)
+        main_layout.addWidget(self.stage_label)
+
+        # Timing breakdown of the last request, toggled from the menu
+        self.status_bar = QStatusBar(self)
+        self.status_bar.setSizeGripEnabled(False)
+        main_layout.addWidget(self.status_bar)
+        timings_action.toggled.connect(self.status_bar.setVisible)
+
         # Set the main widget layout
         self.setLayout(main_layout)
         self.setWindowTitle("Chatbot Canvas Interface")
         self.setGeometry(100, 100, 1200, 800)
         self.applyTheme("dark")
+        self.update_undo_actions()
+
+        # Background autosave of the session file
+        self.session_saved.connect(self.handle_session_saved)
+        self.autosave_timer = QTimer(self)
+        self.autosave_timer.setInterval(AUTOSAVE_INTERVAL_MS)
+        self.autosave_timer.timeout.connect(self.autosave_session)
+        self.autosave_timer.start()
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        if self.core_loader is None:
+            self.start_core_loader()
+
+    def start_core_loader(self):
+        """
+        Create the shared CoderCore in the background, so the window is usable while the models load.
+        """
+        self.core_loader = CoreLoader()
+        self.core_loader.warming.connect(lambda: self.set_core_state(CORE_WARMING))
+        self.core_loader.loaded.connect(self.handle_core_loaded)
+        self.core_loader.failed.connect(self.handle_core_failed)
+        self.set_core_state(CORE_LOADING)
+        self.core_loader.start()
+
+    def set_core_state(self, state, detail=""):
+        self.core_state = state
+        self.core_status.setText(CORE_STATE_LABELS[state])
+        self.core_status.setToolTip(detail)
+
+    def handle_core_loaded(self, health):
+        """
+        Log the health state reported by the core warm-up and start the messages sent while loading.
+        """
+        logging.info(f"CoderCore pronto: {health}")
+        detail = ""
+        if health.get("llm") is False or health.get("embeddings") is False:
+            detail = f"Falha ao inicializar o modelo: {health.get('erro')}"
+            self.add_notice(detail)
+        self.set_core_state(CORE_READY, detail)
+        self.run_next_queued()
+
+    def handle_core_failed(self, error):
+        """
+        Report a core that could not be created; the next message sent tries to load it again.
+        """
+        self.set_core_state(CORE_FAILED, error)
+        self.add_notice(f"Falha ao carregar os modelos: {error}")
+        self.drop_queued_messages(f"Erro ao processar a solicitação: {error}", STATUS_FAILED)
 
     def eventFilter(self, source, event):
         if source is self.user_input and event.type() == QEvent.KeyPress:
@@ -185,52 +392,243 @@ class ChatbotCanvas(QWidget):
         # Get the user's input text
         user_text = self.user_input.toPlainText().strip()
         if user_text:
+            # Limpar o campo de entrada
+            self.user_input.clear()
+
+            # Until the models are ready, and while earlier messages wait, new messages join the queue
+            if self.core_state != CORE_READY or self.queued_messages:
+                self.queue_message(user_text)
+                return
+
+            # A new message replaces the request in progress
+            self.stop_request()
+
+            # History sent to the core, without the message being asked now
+            chat_history = self.get_chat_history()
+
             # Display the user's message in the chat area
-            user_message_html = f"<b>User:</b> {markdown.markdown(user_text)}"
-            self.chat_area.append(user_message_html)
+            self.add_message(ROLE_USER, user_text)
+            self.start_request(user_text, chat_history, self.mode_selector.currentText())
 
-            # Mostrar o indicador de carregamento
-            self.loading_label.setVisible(True)
+    def start_request(self, user_text, chat_history, mode, pending_message=None):
+        """
+        Run a message through the pipeline in a Worker, answering in pending_message or in a new message.
+        """
+        # Mostrar o indicador de carregamento
+        self.loading_label.setVisible(True)
+
+        # Iniciar o worker para processar a consulta
+        self.worker = Worker(user_text, chat_history, self.code_area.toPlainText(), mode=mode)
+        self.worker.response_ready.connect(self.handle_response)
+        self.worker.code_ready.connect(self.handle_code_solution)
+        self.worker.stage.connect(self.handle_stage)
+        self.worker.token.connect(self.handle_answer_token)
+        self.worker.code_token.connect(self.handle_code_token)
+        self.worker.first_token.connect(self.handle_first_token)
+        self.worker.failed.connect(self.handle_failed)
+        self.worker.trace_ready.connect(self.handle_trace)
+        self.worker.finished.connect(self.run_next_queued)
+        self.code_streaming = False
+        self.worker.start()
+
+        if pending_message is None:
+            pending_message = self.add_message(ROLE_ASSISTANT, "Processando sua solicitação...", STATUS_PENDING)
+        else:
+            pending_message.set_content("Processando sua solicitação...", STATUS_PENDING)
+            self.chat_area.update_message(pending_message)
+        self.pending_message = pending_message
 
-            # Iniciar o worker para processar a consulta
-            self.worker = Worker(user_text, self.get_chat_history(), self.code_area.toPlainText())
-            self.worker.finished.connect(self.handle_response)
-            self.worker.start()
+    def queue_message(self, user_text):
+        """
+        Show a message at once and keep it until the core is ready and the messages before it are answered.
+        """
+        user_message = self.add_message(ROLE_USER, user_text)
+        waiting = "os modelos carregarem" if self.core_state != CORE_READY else "as mensagens anteriores"
+        pending_message = self.add_message(ROLE_ASSISTANT, f"Na fila: aguardando {waiting}...", STATUS_PENDING)
+        self.queued_messages.append((user_message, pending_message, self.mode_selector.currentText()))
+        if self.core_state == CORE_FAILED:
+            self.start_core_loader()
+
+    def run_next_queued(self):
+        """
+        Start the oldest queued message once the core is ready and no other request is running.
+        """
+        if not self.queued_messages or self.core_state != CORE_READY:
+            return
+        worker = self.worker
+        # The finished signal of the current worker may arrive before isRunning() turns false
+        if worker is not None and worker.isRunning() and worker is not self.sender():
+            return
+        user_message, pending_message, mode = self.queued_messages.pop(0)
+        # History up to the queued message, including the answers to the messages queued before it
+        chat_history = self.history.for_prompt(before=user_message)
+        self.start_request(user_message.content, chat_history, mode, pending_message)
+
+    def drop_queued_messages(self, content, status):
+        """
+        Close every queued message with content, without running it.
+        """
+        for _, pending_message, _ in self.queued_messages:
+            pending_message.set_content(content, status)
+            self.chat_area.update_message(pending_message)
+        if self.queued_messages:
+            self.queued_messages = []
+            self.autosave_session()
 
-            # Limpar o campo de entrada
-            self.user_input.clear()
-            self.chat_area.append("<b>Chatbot:</b> Processando sua solicitação...")
+    def add_message(self, role, content, status=STATUS_DONE):
+        return self.chat_area.add_message(role, content, status)
+
+    def add_notice(self, text):
+        """
+        Show a UI notice (session saved, errors) that is not part of the history sent to the model.
+        """
+        return self.add_message(ROLE_SYSTEM, text)
+
+    def stop_request(self):
+        """
+        Cancel the request in progress and the queued messages, if any.
+        """
+        self.drop_queued_messages("Solicitação cancelada.", STATUS_CANCELLED)
+        worker = self.worker
+        if worker is not None and worker.isRunning():
+            self.cancel_current_request()
+            self.finish_request()
+            self.restore_streamed_code(worker.existing_code)
+            self.finish_pending_message("Solicitação cancelada.", STATUS_CANCELLED)
+
+    def cancel_current_request(self):
+        """
+        Cancel the running worker and detach it from the UI without dropping its reference.
+        """
+        worker = self.worker
+        if worker is None or not worker.isRunning():
+            return
+        worker.cancel()
+        for signal in (worker.response_ready, worker.code_ready, worker.stage, worker.token,
+                       worker.code_token, worker.first_token, worker.failed, worker.trace_ready):
+            signal.disconnect()
+        # Keep the QThread alive until it notices the cancellation and returns
+        self.retired_workers.append(worker)
+        worker.finished.connect(lambda: self.retired_workers.remove(worker))
+        self.worker = None
+
+    def handle_stage(self, stage):
+        self.stage_label.setText(STAGE_LABELS.get(stage, stage))
+        self.stage_label.setVisible(True)
+
+    def handle_trace(self, summary):
+        """
+        Show the per-stage timings of the last request in the status bar.
+        """
+        self.status_bar.showMessage(format_summary(summary))
+        self.status_bar.setToolTip("\n".join(
+            f"{'  ' if span['parent'] else ''}{span['name']}: {span['seconds']:.3f}s, "
+            f"{span['prompt_tokens']}→{span['completion_tokens']} tokens, {span['llm_calls']} chamadas, "
+            f"{span['cache_hits']} do cache, {span['retries']} tentativas extras"
+            for span in summary["spans"]
+        ))
+
+    def handle_first_token(self, seconds):
+        logging.info(f"Tempo até o primeiro token da resposta: {seconds:.3f}s")
+
+    def handle_answer_token(self, token):
+        """
+        Append a streamed answer token to the pending message, replacing the loading text on the first one.
+        """
+        message = self.pending_message
+        if message is None:
+            return
+        if message.status == STATUS_PENDING:
+            message.set_content("", STATUS_STREAMING)
+        self.chat_area.append_text(message, token)
+
+    def finish_pending_message(self, content, status):
+        """
+        Replace the loading text or the streamed answer, in place, with the final content.
+        """
+        message = self.pending_message
+        if message is None:
+            return
+        message.set_content(content, status)
+        self.chat_area.update_message(message)
+        self.pending_message = None
+        self.autosave_session()
 
     def handle_response(self, response, steps):
+        # Exibir a resposta da IA, já processada, no lugar da versão transmitida
+        self.finish_pending_message(response, STATUS_DONE)
+
+    def handle_code_token(self, token):
+        """
+        Stream generated code into the editor as it arrives.
+        """
+        self.updating_code = True
+        self.code_area.blockSignals(True)  # Avoid triggering textChanged
+        if not self.code_streaming:
+            self.code_streaming = True
+            self.code_area.clear()
+        cursor = self.code_area.textCursor()
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(token)
+        self.code_area.blockSignals(False)
+        self.updating_code = False
+
+    def handle_code_solution(self, code_solution):
+        self.finish_request()
+        existing_code = self.worker.existing_code
+        self.updating_code = True
+        self.code_area.blockSignals(True)  # Avoid triggering textChanged
+        if code_solution:
+            if not self.code_streaming and self.code_area.toPlainText() == existing_code:
+                self.apply_code_edits(existing_code, code_solution)
+            else:
+                self.code_area.set_code(code_solution)
+        elif self.code_streaming:
+            self.code_area.set_code(existing_code)
+        self.code_streaming = False
+        self.code_area.blockSignals(False)
+        self.updating_code = False
+        if code_solution:
+            # The whole AI edit is a single labeled undo step
+            self.edit_history.record(code_solution, kind=KIND_AI, label=f"IA: {self.worker.user_query[:40]}")
+            self.update_undo_actions()
+
+    def apply_code_edits(self, old_code, new_code):
+        """
+        Update the editor with only the changed lines, keeping the scroll position and the cursor.
+        """
+        edits = compute_edits(old_code, new_code)
+        self.code_area.defer_highlight("".join(replacement for _, _, replacement in edits))
+        cursor = QTextCursor(self.code_area.document())
+        cursor.beginEditBlock()
+        # Apply from the end so earlier offsets stay valid
+        for start, end, replacement in reversed(edits):
+            cursor.setPosition(_qt_position(old_code, start))
+            cursor.setPosition(_qt_position(old_code, end), QTextCursor.KeepAnchor)
+            cursor.insertText(replacement)
+        cursor.endEditBlock()
+
+    def handle_failed(self, error):
+        self.finish_request()
+        self.restore_streamed_code(self.worker.existing_code)
+        self.finish_pending_message(f"Erro ao processar a solicitação: {error}", STATUS_FAILED)
+
+    def finish_request(self):
         # Ocultar o indicador de carregamento
         self.loading_label.setVisible(False)
+        self.stage_label.setVisible(False)
 
-        # Remover a mensagem de carregamento
-        chat_text = self.chat_area.toPlainText()
-        chat_lines = chat_text.split('\n')
-        if chat_lines and "Processando sua solicitação..." in chat_lines[-1]:
-            self.chat_area.clear()
-            for line in chat_lines[:-1]:
-                self.chat_area.append(line)
-
-        # Exibir a resposta da IA
-        chatbot_message_html = f"<b>Chatbot:</b> {markdown.markdown(response)}"
-        self.chat_area.append(chatbot_message_html)
-
-        # Gerar ou atualizar a solução de código
-        existing_code = self.code_area.toPlainText()
-        final_answer = response
-        code_solution = self.coder_core.create_code_solution_if_empty(
-            self.worker.user_query, "\n".join(steps), final_answer, existing_code
-        )
-        if code_solution:
-            self.undo_stack.append(existing_code)  # Save current state before updating
-            self.redo_stack.clear()  # Clear redo stack after new action
+    def restore_streamed_code(self, existing_code):
+        """
+        Put back the code that was in the editor before a cancelled or failed stream replaced it.
+        """
+        if self.code_streaming:
             self.updating_code = True
-            self.code_area.blockSignals(True)  # Avoid triggering textChanged
-            self.code_area.setPlainText(code_solution)
+            self.code_area.blockSignals(True)
+            self.code_area.set_code(existing_code)
             self.code_area.blockSignals(False)
             self.updating_code = False
+        self.code_streaming = False
 
     def track_code_changes(self):
         """
@@ -238,47 +636,63 @@ class ChatbotCanvas(QWidget):
         """
         if self.updating_code:
             return  # Ignore changes made by the AI
-        current_code = self.code_area.toPlainText()
-        if not self.undo_stack or self.undo_stack[-1] != current_code:
-            self.undo_stack.append(current_code)
-            # Limitar o tamanho da pilha para evitar consumo excessivo de memória
-            if len(self.undo_stack) > 50:
-                self.undo_stack.pop(0)
+        # Consecutive keystrokes are grouped into one undo step by the history
+        if self.edit_history.record(self.code_area.toPlainText()):
+            self.update_undo_actions()
 
-    def undo_action(self):
+    def undo_action(self, steps=1):
         """
-        Undo the last change made in the code area.
+        Undo the last steps changes made in the code area.
         """
-        if self.undo_stack:
-            current_state = self.code_area.toPlainText()
-            self.redo_stack.append(current_state)  # Save current state to redo stack
-            previous_state = self.undo_stack.pop()  # Get the previous state
-            self.updating_code = True
-            self.code_area.blockSignals(True)  # Block signals to avoid triggering textChanged
-            self.code_area.setPlainText(previous_state)
-            self.code_area.blockSignals(False)
-            self.updating_code = False
+        current_state = self.code_area.toPlainText()
+        previous_state = self.edit_history.undo(current_state, steps=steps)
+        if previous_state is not None:
+            self.set_code_text(current_state, previous_state)
+        self.update_undo_actions()
 
     def redo_action(self):
         """
         Redo the last undone change in the code area.
         """
-        if self.redo_stack:
-            current_state = self.code_area.toPlainText()
-            self.undo_stack.append(current_state)  # Save current state to undo stack
-            next_state = self.redo_stack.pop()  # Get the next state
-            self.updating_code = True
-            self.code_area.blockSignals(True)  # Block signals to avoid triggering textChanged
-            self.code_area.setPlainText(next_state)
-            self.code_area.blockSignals(False)
-            self.updating_code = False
+        current_state = self.code_area.toPlainText()
+        next_state = self.edit_history.redo(current_state)
+        if next_state is not None:
+            self.set_code_text(current_state, next_state)
+        self.update_undo_actions()
+
+    def set_code_text(self, old_code, new_code):
+        """
+        Replace the code area text without recording it as a user edit.
+        """
+        self.updating_code = True
+        self.code_area.blockSignals(True)  # Block signals to avoid triggering textChanged
+        self.apply_code_edits(old_code, new_code)
+        self.code_area.blockSignals(False)
+        self.updating_code = False
+
+    def populate_undo_menu(self):
+        """
+        List the most recent undo steps, newest first; choosing one undoes it and every step after it.
+        """
+        self.undo_menu.clear()
+        labels = self.edit_history.labels()
+        for steps, label in enumerate(reversed(labels[-UNDO_MENU_STEPS:]), start=1):
+            action = self.undo_menu.addAction(label)
+            action.triggered.connect(lambda _, steps=steps: self.undo_action(steps))
+
+    def update_undo_actions(self):
+        undo_label = self.edit_history.undo_label()
+        redo_label = self.edit_history.redo_label()
+        self.undo_button.setEnabled(self.edit_history.can_undo())
+        self.redo_button.setEnabled(self.edit_history.can_redo())
+        self.undo_button.setToolTip(f"Desfazer: {undo_label}" if undo_label else "Nada para desfazer")
+        self.redo_button.setToolTip(f"Refazer: {redo_label}" if redo_label else "Nada para refazer")
 
     def get_chat_history(self):
         """
-        Retrieve the chat history as a list of messages.
+        Retrieve the completed user and assistant messages to send to the core.
         """
-        chat_text = self.chat_area.toPlainText()
-        return chat_text.split('\n') if chat_text else []
+        return self.history.for_prompt()
 
     def applyTheme(self, theme):
         if theme == "dark":
@@ -295,38 +709,100 @@ class ChatbotCanvas(QWidget):
     def save_session(self):
         options = QFileDialog.Options()
         file_path, _ = QFileDialog.getSaveFileName(
-            self, "Salvar Sessão", "", "JSON Files (*.json)", options=options
+            self, "Salvar Sessão", "", "Sessões (*.jsonl)", options=options
         )
         if file_path:
-            session_data = {
-                "chat_history": self.chat_area.toPlainText(),
-                "code": self.code_area.toPlainText()
-            }
-            try:
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    json.dump(session_data, f, ensure_ascii=False, indent=4)
-                logging.info(f"Sessão salva em {file_path}")
-                self.chat_area.append("<b>Chatbot:</b> Sessão salva com sucesso.")
-            except Exception as e:
-                logging.error(f"Erro ao salvar sessão: {str(e)}")
-                self.chat_area.append("<b>Chatbot:</b> Erro ao salvar sessão.")
+            self.write_session(file_path, notify=True)
+
+    def autosave_session(self):
+        """
+        Write what changed since the last save, in the background, once the session has a file.
+        """
+        if self.session.path is not None and self.loading_session is None:
+            self.write_session()
+
+    def write_session(self, path=None, notify=False):
+        # A session still being loaded must be complete before it is written somewhere else
+        self.load_older_messages(everything=True)
+        try:
+            # The recorded code, not the editor text, which may be a stream in progress
+            future = self.session.save(self.history, self.edit_history.current, self.edit_history, path=path)
+        except Exception as e:
+            self.handle_session_saved(path or "", str(e), notify)
+            return
+        target = self.session.path
+        future.add_done_callback(
+            lambda f: self.session_saved.emit(target, str(f.exception() or ""), notify)
+        )
+
+    def handle_session_saved(self, path, error, notify):
+        if error:
+            logging.error(f"Erro ao salvar sessão em {path}: {error}")
+            self.add_notice("Erro ao salvar sessão.")
+        elif notify:
+            logging.info(f"Sessão salva em {path}")
+            self.add_notice("Sessão salva com sucesso.")
 
     def load_session(self):
         options = QFileDialog.Options()
         file_path, _ = QFileDialog.getOpenFileName(
-            self, "Carregar Sessão", "", "JSON Files (*.json)", options=options
+            self, "Carregar Sessão", "", "Sessões (*.jsonl *.json)", options=options
         )
         if file_path:
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    session_data = json.load(f)
-                self.chat_area.setPlainText(session_data.get("chat_history", ""))
-                self.code_area.setPlainText(session_data.get("code", ""))
-                logging.info(f"Sessão carregada de {file_path}")
-                self.chat_area.append("<b>Chatbot:</b> Sessão carregada com sucesso.")
+                session = self.session.open(file_path)
             except Exception as e:
                 logging.error(f"Erro ao carregar sessão: {str(e)}")
-                self.chat_area.append("<b>Chatbot:</b> Erro ao carregar sessão.")
+                self.add_notice("Erro ao carregar sessão.")
+                return
+            self.stop_request()
+            # The most recent messages are shown right away; older ones are decoded in the background
+            self.history = ChatHistory(session.messages)
+            self.pending_message = None
+            self.chat_area.set_history(self.history)
+            self.updating_code = True
+            self.code_area.set_code(session.code)
+            self.updating_code = False
+            try:
+                self.edit_history = EditHistory.from_dict(session.undo, session.code) if session.undo else None
+            except (ValueError, KeyError, TypeError) as e:
+                logging.warning(f"Histórico de desfazer descartado: {e}")
+                self.edit_history = None
+            if self.edit_history is None:
+                self.edit_history = EditHistory(session.code)
+            self.update_undo_actions()
+            self.loading_session = session
+            QTimer.singleShot(0, self.load_older_messages)
+            logging.info(f"Sessão carregada de {file_path}")
+            if session.version < SESSION_VERSION:
+                self.add_notice("Sessão carregada. Salve-a novamente para ativar o salvamento automático.")
+            else:
+                self.add_notice("Sessão carregada com sucesso.")
+
+    def load_older_messages(self, everything=False):
+        """
+        Decode the next chunk of older messages of the session being loaded (or all of them).
+        """
+        session = self.loading_session
+        if session is None:
+            return
+        while session.has_older:
+            self.chat_area.prepend_messages(session.load_older())
+            if not everything:
+                QTimer.singleShot(0, self.load_older_messages)
+                return
+        self.loading_session = None
+        if session.version == SESSION_VERSION:
+            self.session.mark_saved(self.history.messages[:session.total], self.edit_history)
+
+    def closeEvent(self, event):
+        if self.session.path is not None:
+            self.autosave_session()
+            try:
+                self.session.flush(timeout=10)
+            except Exception as e:
+                logging.error(f"Erro ao salvar sessão ao fechar: {str(e)}")
+        super().closeEvent(event)
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
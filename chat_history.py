@@ -0,0 +1,169 @@
+# chat_history.py
+
+import itertools
+import re
+import threading
+import time
+
+from context_builder import estimate_tokens
+
+ROLE_USER = "user"
+ROLE_ASSISTANT = "assistant"
+ROLE_SYSTEM = "system"  # Avisos da interface (sessão salva, erros), fora do histórico enviado ao LLM
+
+# Estados de uma mensagem do assistente
+STATUS_PENDING = "pending"
+STATUS_STREAMING = "streaming"
+STATUS_DONE = "done"
+STATUS_CANCELLED = "cancelled"
+STATUS_FAILED = "failed"
+
+# Rótulos usados no histórico enviado ao LLM
+PROMPT_LABELS = {ROLE_USER: "Usuário", ROLE_ASSISTANT: "Assistente"}
+
+_ids = itertools.count(1)
+_ids_lock = threading.Lock()
+
+
+def _next_id():
+    with _ids_lock:
+        return next(_ids)
+
+
+class ChatMessage:
+    """
+    Uma mensagem do chat.
+
+    Args:
+        role (str): ROLE_USER, ROLE_ASSISTANT ou ROLE_SYSTEM.
+        content (str): Texto da mensagem, em markdown.
+        status (str): Estado da mensagem; apenas mensagens STATUS_DONE entram no histórico do LLM.
+        created (float, opcional): Momento de criação (time.time()).
+        updated (float, opcional): Momento da última alteração do conteúdo.
+        tokens (int, opcional): Tokens estimados do conteúdo.
+    """
+    def __init__(self, role, content, status=STATUS_DONE, created=None, updated=None, tokens=None):
+        self.id = _next_id()
+        self.role = role
+        self.content = content
+        self.status = status
+        self.created = created if created is not None else time.time()
+        self.updated = updated if updated is not None else self.created
+        self.tokens = tokens if tokens is not None else estimate_tokens(content)
+        self.version = 0  # Incrementado a cada alteração, para invalidar a renderização em cache
+
+    def set_content(self, content, status=None):
+        self.content = content
+        self.tokens = estimate_tokens(content)
+        self.updated = time.time()
+        self.version += 1
+        if status is not None:
+            self.status = status
+
+    def append_content(self, text):
+        """
+        Acrescenta texto ao conteúdo, para tokens recebidos em streaming.
+        """
+        self.content += text
+        self.updated = time.time()
+        self.version += 1
+
+    def prompt_text(self):
+        return f"{PROMPT_LABELS.get(self.role, self.role)}: {self.content}"
+
+    def to_dict(self):
+        return {
+            "role": self.role,
+            "content": self.content,
+            "status": self.status,
+            "created": self.created,
+            "updated": self.updated,
+            "tokens": self.tokens,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            data["role"], data.get("content", ""), data.get("status", STATUS_DONE),
+            data.get("created"), data.get("updated"), data.get("tokens"),
+        )
+
+    def __repr__(self):
+        return f"ChatMessage({self.role!r}, {self.content[:30]!r}, status={self.status!r})"
+
+
+class ChatHistory:
+    """
+    Lista de mensagens do chat, fonte única do que é exibido e do histórico enviado ao CoderCore.
+    """
+    def __init__(self, messages=None):
+        self.messages = list(messages or [])
+
+    def __len__(self):
+        return len(self.messages)
+
+    def __iter__(self):
+        return iter(self.messages)
+
+    def add(self, role, content, status=STATUS_DONE):
+        message = ChatMessage(role, content, status)
+        self.messages.append(message)
+        return message
+
+    def prepend(self, messages):
+        """
+        Insere mensagens mais antigas no início, para sessões carregadas aos poucos.
+        """
+        self.messages[0:0] = messages
+
+    def clear(self):
+        self.messages.clear()
+
+    def for_prompt(self, before=None):
+        """
+        Cópia das mensagens concluídas de usuário e assistente, segura para ser lida por outra thread.
+
+        Args:
+            before (ChatMessage): Se informada, só as mensagens anteriores a ela (usado pelas mensagens
+                enviadas enquanto os modelos carregavam, que saem da fila depois de outras terem chegado).
+        """
+        messages = self.messages
+        if before is not None:
+            messages = itertools.takewhile(lambda m: m is not before, messages)
+        return [
+            ChatMessage(m.role, m.content, m.status, m.created, m.updated, m.tokens)
+            for m in messages
+            if m.role in PROMPT_LABELS and m.status == STATUS_DONE
+        ]
+
+    def to_list(self):
+        return [message.to_dict() for message in self.messages]
+
+    @classmethod
+    def from_list(cls, items):
+        return cls(ChatMessage.from_dict(item) for item in items)
+
+    @classmethod
+    def from_plain_text(cls, text):
+        """
+        Converte o histórico em texto das sessões antigas ("User: ..." / "Chatbot: ..." por linha).
+        """
+        history = cls()
+        for line in text.splitlines():
+            match = re.match(r"^(User|Chatbot):\s?(.*)$", line)
+            if match:
+                role = ROLE_USER if match.group(1) == "User" else ROLE_ASSISTANT
+                history.add(role, match.group(2))
+            elif history.messages:
+                last = history.messages[-1]
+                last.set_content(f"{last.content}\n{line}" if last.content else line)
+            elif line.strip():
+                history.add(ROLE_SYSTEM, line)
+        return history
+
+
+def format_history(messages):
+    """
+    Converte o histórico recebido pelo CoderCore em linhas de prompt. Aceita ChatMessage ou texto.
+    """
+    return [m.prompt_text() if isinstance(m, ChatMessage) else str(m) for m in messages]
@@ -0,0 +1,314 @@
+# chat_view.py
+
+import html
+import math
+from collections import OrderedDict
+
+import markdown
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, QPoint, QSize, Qt
+from PyQt5.QtGui import QAbstractTextDocumentLayout, QKeySequence, QPalette, QTextDocument
+from PyQt5.QtWidgets import QAbstractItemView, QApplication, QListView, QStyle, QStyledItemDelegate
+
+from chat_history import (
+    ChatHistory, ROLE_ASSISTANT, ROLE_SYSTEM, ROLE_USER, STATUS_DONE, STATUS_PENDING, STATUS_STREAMING,
+)
+
+MessageRole = Qt.UserRole + 1
+
+ROLE_LABELS = {ROLE_USER: "User", ROLE_ASSISTANT: "Chatbot", ROLE_SYSTEM: "Chatbot"}
+
+# Building a Markdown instance costs more than converting a message, so the GUI thread reuses one
+_markdown = markdown.Markdown()
+
+
+def message_html(message):
+    """
+    HTML of a message as shown in the chat. Messages still being generated are shown as plain text.
+    """
+    label = f"<b>{ROLE_LABELS.get(message.role, message.role)}:</b> "
+    if message.status in (STATUS_PENDING, STATUS_STREAMING):
+        return label + html.escape(message.content).replace("\n", "<br>")
+    return label + _markdown.reset().convert(message.content)
+
+
+class ChatModel(QAbstractListModel):
+    """
+    List model over a ChatHistory that exposes only a window of the most recent messages.
+
+    Older messages stay in the history but are paged out of the model once the window grows past
+    window + page rows, and are paged back in, a page at a time, with fetch_older().
+
+    Args:
+        history (ChatHistory): Messages shown by the model.
+        window (int): Rows kept loaded after paging out.
+        page (int): Rows paged in or out at once.
+    """
+    def __init__(self, history=None, window=60, page=60, parent=None):
+        super().__init__(parent)
+        self.window = window
+        self.page = page
+        self.history = ChatHistory()
+        self.first = 0  # Index in history.messages of the first loaded row
+        self._rows = 0  # Loaded rows; rowCount() is called for every row on each layout
+        self._index = {}  # message id -> index in history.messages
+        self.set_history(history if history is not None else ChatHistory())
+
+    def set_history(self, history):
+        self.beginResetModel()
+        self.history = history
+        self._index = {message.id: i for i, message in enumerate(history.messages)}
+        self.first = max(len(history) - self.window, 0)
+        self._rows = len(history) - self.first
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return self._rows
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        message = self.history.messages[self.first + index.row()]
+        if role == MessageRole:
+            return message
+        if role == Qt.DisplayRole:
+            return message.content
+        if role == Qt.ToolTipRole:
+            return f"{message.tokens} tokens"
+        return None
+
+    def add(self, role, content, status=STATUS_DONE):
+        row = self.rowCount()
+        self.beginInsertRows(QModelIndex(), row, row)
+        message = self.history.add(role, content, status)
+        self._index[message.id] = len(self.history) - 1
+        self._rows += 1
+        self.endInsertRows()
+        return message
+
+    def prepend(self, messages):
+        """
+        Add older messages before all the others. They start paged out, so the loaded rows do not change.
+        """
+        if not messages:
+            return
+        self.history.prepend(messages)
+        self.first += len(messages)
+        self._index = {message.id: i for i, message in enumerate(self.history.messages)}
+
+    def index_of(self, message):
+        """
+        Model index of a message, invalid if it is paged out.
+        """
+        row = self._index.get(message.id, -1) - self.first
+        if row < 0:
+            return QModelIndex()
+        return self.index(row)
+
+    def message_changed(self, message):
+        index = self.index_of(message)
+        if index.isValid():
+            self.dataChanged.emit(index, index)
+
+    def trim(self):
+        """
+        Page out the oldest rows when more than window + page messages are loaded.
+        """
+        excess = self.rowCount() - self.window
+        if excess < self.page:
+            return 0
+        self.beginRemoveRows(QModelIndex(), 0, excess - 1)
+        self.first += excess
+        self._rows -= excess
+        self.endRemoveRows()
+        return excess
+
+    def fetch_older(self):
+        """
+        Page in up to one page of older messages at the top. Returns the number of rows added.
+        """
+        count = min(self.page, self.first)
+        if count <= 0:
+            return 0
+        self.beginInsertRows(QModelIndex(), 0, count - 1)
+        self.first -= count
+        self._rows += count
+        self.endInsertRows()
+        return count
+
+
+class ChatDelegate(QStyledItemDelegate):
+    """
+    Paint messages as rich text, caching the HTML of each message and the laid-out documents of the rows
+    recently shown. Only visible rows are laid out and painted.
+
+    The caches are keyed by message id and store the version they were rendered from, so a message that
+    changes (every token while an answer streams) replaces its entry instead of adding one per version.
+
+    Args:
+        html_cache_size (int): Rendered HTML strings kept (markdown runs once per message version).
+        document_cache_size (int): Laid-out QTextDocuments kept, keyed by message and width.
+            Row heights are cached separately, so laying out the loaded rows does not keep documents alive.
+    """
+    MARGIN = 6
+
+    def __init__(self, view, html_cache_size=2000, document_cache_size=300):
+        super().__init__(view)
+        self.view = view
+        self.html_cache_size = html_cache_size
+        self.document_cache_size = document_cache_size
+        self._html = OrderedDict()  # id -> (version, html)
+        self._documents = OrderedDict()  # (id, width) -> (version, QTextDocument)
+        self._heights = OrderedDict()  # (id, width) -> (version, row height)
+
+    def html_for(self, message):
+        key = message.id
+        cached = self._html.get(key)
+        if cached is not None and cached[0] == message.version:
+            self._html.move_to_end(key)
+            return cached[1]
+        rendered = message_html(message)
+        self._html[key] = (message.version, rendered)
+        self._html.move_to_end(key)
+        if len(self._html) > self.html_cache_size:
+            self._html.popitem(last=False)
+        return rendered
+
+    def document_for(self, message, width):
+        key = (message.id, width)
+        cached = self._documents.get(key)
+        if cached is not None and cached[0] == message.version:
+            self._documents.move_to_end(key)
+            return cached[1]
+        document = QTextDocument()
+        document.setDefaultFont(self.view.font())
+        document.setDocumentMargin(self.MARGIN)
+        document.setHtml(self.html_for(message))
+        document.setTextWidth(width)
+        self._documents[key] = (message.version, document)
+        self._documents.move_to_end(key)
+        if len(self._documents) > self.document_cache_size:
+            self._documents.popitem(last=False)
+        return document
+
+    def sizeHint(self, option, index):
+        # Called for every loaded row on each layout, so it avoids index.data() and reuses cached heights
+        model = self.view.chat_model
+        message = model.history.messages[model.first + index.row()]
+        width = self.view.text_width
+        key = (message.id, width)
+        cached = self._heights.get(key)
+        if cached is not None and cached[0] == message.version:
+            height = cached[1]
+        else:
+            height = math.ceil(self.document_for(message, width).size().height())
+            self._heights[key] = (message.version, height)
+            if len(self._heights) > self.html_cache_size * 4:
+                self._heights.popitem(last=False)
+        return QSize(width, height)
+
+    def paint(self, painter, option, index):
+        message = index.data(MessageRole)
+        document = self.document_for(message, self.view.text_width)
+        painter.save()
+        context = QAbstractTextDocumentLayout.PaintContext()
+        if option.state & QStyle.State_Selected:
+            painter.fillRect(option.rect, option.palette.highlight())
+            context.palette.setColor(QPalette.Text, option.palette.color(QPalette.HighlightedText))
+        else:
+            context.palette.setColor(QPalette.Text, option.palette.color(QPalette.Text))
+        painter.translate(option.rect.topLeft())
+        painter.setClipRect(0, 0, option.rect.width(), option.rect.height())
+        document.documentLayout().draw(painter, context)
+        painter.restore()
+
+    def clear(self):
+        self._html.clear()
+        self._documents.clear()
+        self._heights.clear()
+
+
+class ChatView(QListView):
+    """
+    Chat view backed by ChatModel: appends and updates touch only the affected row, only visible rows
+    are rendered, and old messages are paged out while the view follows the newest ones.
+    """
+    def __init__(self, history=None, window=60, page=60, parent=None):
+        super().__init__(parent)
+        self.text_width = 50  # Viewport width used to lay out the messages
+        self.chat_model = ChatModel(history, window=window, page=page, parent=self)
+        self.delegate = ChatDelegate(self)
+        self.setModel(self.chat_model)
+        self.setItemDelegate(self.delegate)
+        self.setVerticalScrollMode(QAbstractItemView.ScrollPerPixel)
+        self.setHorizontalScrollBarPolicy(Qt.ScrollBarAlwaysOff)
+        self.setResizeMode(QListView.Adjust)
+        self.setSelectionMode(QAbstractItemView.ExtendedSelection)
+        self.setUniformItemSizes(False)
+        self.verticalScrollBar().valueChanged.connect(self._on_scroll)
+
+    @property
+    def history(self):
+        return self.chat_model.history
+
+    def set_history(self, history):
+        self.delegate.clear()
+        self.chat_model.set_history(history)
+        self.scrollToBottom()
+
+    def prepend_messages(self, messages):
+        """
+        Add messages older than the whole history, e.g. while a session is still being loaded.
+        """
+        self.chat_model.prepend(messages)
+
+    def add_message(self, role, content, status=STATUS_DONE):
+        follow = self._at_bottom()
+        message = self.chat_model.add(role, content, status)
+        if follow:
+            self.chat_model.trim()
+            self.scrollToBottom()
+        return message
+
+    def update_message(self, message):
+        """
+        Re-render a message whose content or status changed.
+        """
+        follow = self._at_bottom()
+        self.chat_model.message_changed(message)
+        index = self.chat_model.index_of(message)
+        if index.isValid():
+            # The row height depends on the content, so the view has to lay it out again
+            self.delegate.sizeHintChanged.emit(index)
+        if follow:
+            self.scrollToBottom()
+
+    def append_text(self, message, text):
+        message.append_content(text)
+        self.update_message(message)
+
+    def resizeEvent(self, event):
+        self.text_width = max(self.viewport().width(), 50)
+        super().resizeEvent(event)
+
+    def _at_bottom(self):
+        bar = self.verticalScrollBar()
+        return bar.value() >= bar.maximum() - 4
+
+    def _on_scroll(self, value):
+        if value != self.verticalScrollBar().minimum() or self.chat_model.first == 0:
+            return
+        # Page older messages back in while keeping the message at the top in place
+        top = self.indexAt(QPoint(0, 0))
+        added = self.chat_model.fetch_older()
+        if added and top.isValid():
+            self.scrollTo(self.chat_model.index(top.row() + added), QAbstractItemView.PositionAtTop)
+
+    def keyPressEvent(self, event):
+        if event.matches(QKeySequence.Copy):
+            rows = sorted(index.row() for index in self.selectedIndexes())
+            texts = [self.chat_model.index(row).data(Qt.DisplayRole) for row in rows]
+            QApplication.clipboard().setText("\n\n".join(texts))
+            return
+        super().keyPressEvent(event)
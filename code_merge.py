@@ -0,0 +1,189 @@
+# code_merge.py
+
+import ast
+import textwrap
+import threading
+from collections import OrderedDict
+
+_DEFINITIONS = (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+
+# Em algumas versões do CPython (como a 3.11), dois ast.parse simultâneos em threads diferentes podem levantar
+# SystemError ("AST constructor recursion depth mismatch"); as etapas do StageGraph e as requisições do
+# headless.py analisam código em paralelo
+_parse_lock = threading.Lock()
+
+
+def parse_python(source):
+    """
+    ast.parse seguro entre threads.
+    """
+    with _parse_lock:
+        return ast.parse(source)
+
+
+def _is_main_guard(node):
+    """
+    Verifica se o nó é um bloco if __name__ == "__main__".
+    """
+    if not isinstance(node, ast.If) or not isinstance(node.test, ast.Compare):
+        return False
+    test = node.test
+    return (
+        isinstance(test.left, ast.Name) and test.left.id == "__name__"
+        and len(test.comparators) == 1
+        and isinstance(test.comparators[0], ast.Constant) and test.comparators[0].value == "__main__"
+    )
+
+
+def _node_key(node):
+    """
+    Chave que identifica o mesmo elemento em blocos diferentes: o nome para definições e atribuições,
+    e a própria árvore para as demais instruções (que assim só são deduplicadas se forem idênticas).
+    """
+    if isinstance(node, _DEFINITIONS):
+        return ("def", node.name)
+    if isinstance(node, ast.Assign) and all(isinstance(t, ast.Name) for t in node.targets):
+        return ("assign", tuple(t.id for t in node.targets))
+    if isinstance(node, ast.AnnAssign) and isinstance(node.target, ast.Name):
+        return ("assign", (node.target.id,))
+    if _is_main_guard(node):
+        return ("main",)
+    return ("stmt", ast.dump(node))
+
+
+def _node_lines(node, lines, floor):
+    """
+    Linhas de código de um nó, incluindo decoradores e os comentários logo acima dele.
+
+    Args:
+        floor (int): Primeira linha (base 0) que ainda não pertence ao nó anterior.
+    """
+    start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])]) - 1
+    while start > floor and lines[start - 1].strip().startswith("#"):
+        start -= 1
+    return lines[start:node.end_lineno]
+
+
+class _Element:
+    def __init__(self, node, source):
+        self.node = node
+        self.source = source  # Texto do elemento, sem indentação externa
+
+
+def _merge_classes(old, new):
+    """
+    Mescla duas versões de uma classe: vale a nova, mas os métodos que só existem na antiga são mantidos
+    no final do corpo, pois respostas parciais costumam repetir a classe apenas com os métodos alterados.
+    """
+    old_node = parse_python(old.source).body[0]
+    new_node = parse_python(new.source).body[0]
+    new_names = {n.name for n in new_node.body if isinstance(n, _DEFINITIONS)}
+    old_lines = old.source.splitlines()
+    body_line = new.source.splitlines()[new_node.body[0].lineno - 1]
+    indent = body_line[:len(body_line) - len(body_line.lstrip())]
+    extra = []
+    floor = old_node.lineno
+    for member in old_node.body:
+        if isinstance(member, _DEFINITIONS) and member.name not in new_names:
+            trecho = "\n".join(_node_lines(member, old_lines, floor))
+            extra.append(textwrap.indent(textwrap.dedent(trecho), indent))
+        floor = member.end_lineno
+    if not extra:
+        return new
+    source = new.source.rstrip() + "\n\n" + "\n\n".join(extra)
+    return _Element(parse_python(source).body[0], source)
+
+
+def _render_imports(imports, from_imports):
+    linhas = []
+    # Imports de __future__ precisam vir antes de qualquer outro
+    futuros = from_imports.get(("__future__", 0))
+    if futuros:
+        linhas.append(f"from __future__ import {', '.join(_alias(n, a) for n, a in futuros.items())}")
+    for name, asname in imports:
+        linhas.append(f"import {_alias(name, asname)}")
+    for (module, level), names in from_imports.items():
+        if module == "__future__":
+            continue
+        origem = "." * level + (module or "")
+        if "*" in names:
+            linhas.append(f"from {origem} import *")
+            names = OrderedDict((n, a) for n, a in names.items() if n != "*")
+            if not names:
+                continue
+        linhas.append(f"from {origem} import {', '.join(_alias(n, a) for n, a in names.items())}")
+    return linhas
+
+
+def _alias(name, asname):
+    return f"{name} as {asname}" if asname else name
+
+
+def merge_code_blocks(blocks):
+    """
+    Mescla vários blocos de código Python em um único módulo, sem consultar o LLM.
+
+    Os imports são deduplicados e agrupados no topo. Funções, classes e atribuições de mesmo nome são
+    substituídas pela versão mais recente, na posição em que apareceram primeiro; classes repetidas
+    mantêm os métodos que só existiam na versão anterior. Instruções idênticas aparecem uma única vez
+    e o bloco if __name__ == "__main__" mais recente fica no final.
+
+    Returns:
+        str: O código mesclado, ou None se algum bloco (ou o resultado) não puder ser analisado.
+    """
+    imports = OrderedDict()  # (nome, apelido) -> None
+    from_imports = OrderedDict()  # (módulo, nível) -> {nome: apelido}
+    elements = OrderedDict()  # chave -> _Element
+    main_guard = None
+
+    for block in blocks:
+        block = textwrap.dedent(block).strip("\n")
+        if not block.strip():
+            continue
+        try:
+            tree = parse_python(block)
+        except (SyntaxError, ValueError):
+            return None
+        lines = block.splitlines()
+        floor = 0
+        for node in tree.body:
+            trecho = _node_lines(node, lines, floor)
+            floor = node.end_lineno
+            if isinstance(node, ast.Import):
+                for alias in node.names:
+                    imports[(alias.name, alias.asname)] = None
+                continue
+            if isinstance(node, ast.ImportFrom):
+                names = from_imports.setdefault((node.module, node.level), OrderedDict())
+                for alias in node.names:
+                    names[alias.name] = alias.asname
+                continue
+            element = _Element(node, "\n".join(trecho))
+            key = _node_key(node)
+            if key == ("main",):
+                main_guard = element
+                continue
+            previous = elements.get(key)
+            if previous is not None and isinstance(previous.node, ast.ClassDef) and isinstance(node, ast.ClassDef):
+                element = _merge_classes(previous, element)
+            elements[key] = element
+
+    partes = []
+    import_lines = _render_imports(imports, from_imports)
+    if import_lines:
+        partes.append("\n".join(import_lines))
+    anterior = None
+    for element in list(elements.values()) + ([main_guard] if main_guard else []):
+        # Instruções simples consecutivas ficam juntas; definições são separadas por duas linhas em branco
+        simples = not isinstance(element.node, _DEFINITIONS)
+        if anterior is not None and simples and not isinstance(anterior.node, _DEFINITIONS):
+            partes[-1] += "\n" + element.source
+        else:
+            partes.append(element.source)
+        anterior = element
+    merged = "\n\n\n".join(partes).strip() + "\n"
+    try:
+        parse_python(merged)
+    except (SyntaxError, ValueError):
+        return None
+    return merged
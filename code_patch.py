@@ -0,0 +1,222 @@
+# code_patch.py
+
+import difflib
+import re
+
+EDIT_BLOCK_RE = re.compile(
+    r"^<{5,9} ?SEARCH[^\n]*\n(.*?)^={5,9}[^\n]*\n(.*?)^>{5,9} ?REPLACE[^\n]*$",
+    re.DOTALL | re.MULTILINE,
+)
+
+HUNK_HEADER_RE = re.compile(r"^@@ .*@@")
+
+EDIT_FORMAT_INSTRUCTIONS = """Descreva as modificações apenas como blocos de edição, neste formato:
+<<<<<<< SEARCH
+linhas do código atual a substituir, copiadas exatamente
+=======
+novas linhas
+>>>>>>> REPLACE
+Use um bloco por alteração, com apenas as linhas necessárias para localizá-la sem ambiguidade.
+Para adicionar código ao final do arquivo, deixe a parte SEARCH vazia. Não reescreva o arquivo inteiro."""
+
+
+class PatchError(Exception):
+    """
+    Levantada quando um bloco de edição não pode ser localizado no código, ou aparece em mais de um lugar.
+    """
+
+
+def parse_edit_blocks(text):
+    """
+    Extrai os pares (busca, substituição) dos blocos SEARCH/REPLACE de uma resposta do LLM.
+    """
+    return [(search, replace) for search, replace in EDIT_BLOCK_RE.findall(text)]
+
+
+def parse_unified_diff(text):
+    """
+    Converte os hunks de um diff unificado em pares (busca, substituição): as linhas de contexto e
+    removidas formam a busca; as de contexto e adicionadas, a substituição.
+    """
+    edits = []
+    search, replace = [], []
+    in_hunk = False
+    for line in text.splitlines():
+        if HUNK_HEADER_RE.match(line):
+            if in_hunk and (search or replace):
+                edits.append(("".join(search), "".join(replace)))
+            search, replace = [], []
+            in_hunk = True
+            continue
+        if not in_hunk or line.startswith(("---", "+++")):
+            continue
+        if line.startswith("```"):
+            if in_hunk and (search or replace):
+                edits.append(("".join(search), "".join(replace)))
+            search, replace = [], []
+            in_hunk = False
+            continue
+        if line.startswith("-"):
+            search.append(line[1:] + "\n")
+        elif line.startswith("+"):
+            replace.append(line[1:] + "\n")
+        elif line.startswith(" ") or line == "":
+            search.append(line[1:] + "\n")
+            replace.append(line[1:] + "\n")
+        elif line.startswith("\\"):
+            continue
+    if in_hunk and (search or replace):
+        edits.append(("".join(search), "".join(replace)))
+    return edits
+
+
+def extract_edits(text):
+    """
+    Extrai as edições de uma resposta em blocos SEARCH/REPLACE ou em diff unificado.
+
+    Returns:
+        list: Pares (busca, substituição); vazia se a resposta não contiver edições.
+    """
+    edits = parse_edit_blocks(text)
+    if edits:
+        return edits
+    if re.search(r"^@@ .*@@", text, re.MULTILINE):
+        return parse_unified_diff(text)
+    return []
+
+
+def _line_offsets(lines):
+    offsets = [0]
+    for line in lines:
+        offsets.append(offsets[-1] + len(line))
+    return offsets
+
+
+def find_block(code, search, threshold=0.85):
+    """
+    Localiza o trecho search em code: primeiro por correspondência exata, depois ignorando espaços nas
+    pontas das linhas e, por fim, pela janela de linhas mais parecida (razão de similaridade >= threshold).
+    Um trecho que corresponde a mais de um lugar levanta PatchError, em vez de alterar o primeiro deles,
+    que pode não ser o que o modelo quis dizer.
+
+    Returns:
+        tuple: (início, fim) em caracteres de code, ou None se não houver correspondência aceitável.
+    """
+    start = code.find(search)
+    if start >= 0:
+        if code.find(search, start + 1) >= 0:
+            raise PatchError(f"O trecho aparece {code.count(search)} vezes no código")
+        return start, start + len(search)
+
+    code_lines = code.splitlines(keepends=True)
+    search_lines = search.splitlines(keepends=True)
+    while search_lines and not search_lines[-1].strip():
+        search_lines.pop()
+    while search_lines and not search_lines[0].strip():
+        search_lines.pop(0)
+    if not search_lines:
+        return None
+    offsets = _line_offsets(code_lines)
+    n = len(search_lines)
+
+    stripped_search = [line.strip() for line in search_lines]
+    stripped_code = [line.strip() for line in code_lines]
+    iguais = [i for i in range(len(code_lines) - n + 1) if stripped_code[i:i + n] == stripped_search]
+    if len(iguais) > 1:
+        raise PatchError(f"O trecho aparece {len(iguais)} vezes no código")
+    if iguais:
+        return offsets[iguais[0]], offsets[iguais[0] + n]
+
+    target = "".join(stripped_search)
+    matcher = difflib.SequenceMatcher(autojunk=False)
+    matcher.set_seq2(target)
+    best, best_ratio = None, 0.0
+    empates = []  # Outras janelas com a mesma razão da melhor
+    # Janelas do mesmo tamanho primeiro: em caso de empate, não engolir linhas vizinhas
+    for size in dict.fromkeys([n, max(n - 1, 1), n + 1]):
+        for i in range(len(code_lines) - size + 1):
+            minimo = max(best_ratio, threshold)
+            matcher.set_seq1("".join(stripped_code[i:i + size]))
+            if matcher.real_quick_ratio() < minimo or matcher.quick_ratio() < minimo:
+                continue
+            ratio = matcher.ratio()
+            if ratio > best_ratio and ratio >= threshold:
+                best, best_ratio = (offsets[i], offsets[i + size]), ratio
+                empates = []
+            elif best is not None and ratio == best_ratio:
+                empates.append((offsets[i], offsets[i + size]))
+    # Empates que se sobrepõem à melhor janela (a mesma região com uma linha a mais ou a menos) não contam
+    if any(fim <= best[0] or inicio >= best[1] for inicio, fim in empates):
+        raise PatchError("O trecho corresponde a mais de um lugar do código")
+    return best
+
+
+def apply_edits(code, edits, threshold=0.85):
+    """
+    Aplica as edições ao código, todas ou nenhuma.
+
+    Buscas vazias acrescentam a substituição ao final do código. A indentação da substituição é
+    reajustada quando a correspondência foi encontrada com indentação diferente.
+
+    Returns:
+        str: O código modificado. Levanta PatchError se alguma edição não puder ser localizada ou for
+        ambígua.
+    """
+    for i, (search, replace) in enumerate(edits, 1):
+        if not search.strip():
+            separador = "" if not code or code.endswith("\n") else "\n"
+            code = code + separador + replace
+            continue
+        try:
+            span = find_block(code, search, threshold)
+        except PatchError as e:
+            raise PatchError(f"Bloco de edição {i} ambíguo ({str(e)}); inclua mais linhas de contexto:\n{search}")
+        if span is None:
+            raise PatchError(f"Bloco de edição {i} não encontrado no código:\n{search}")
+        start, end = span
+        original = code[start:end]
+        replace = _reindent(replace, search, original)
+        if original.endswith("\n") and replace and not replace.endswith("\n"):
+            replace += "\n"
+        code = code[:start] + replace + code[end:]
+    return code
+
+
+def _indent_of(text):
+    for line in text.splitlines():
+        if line.strip():
+            return line[:len(line) - len(line.lstrip())]
+    return ""
+
+
+def _reindent(replace, search, original):
+    """
+    Se o modelo copiou o trecho com outra indentação, aplica à substituição a mesma diferença.
+    """
+    de, para = _indent_of(search), _indent_of(original)
+    if de == para:
+        return replace
+    linhas = []
+    for line in replace.splitlines(keepends=True):
+        if line.strip() and line.startswith(de):
+            line = para + line[len(de):]
+        linhas.append(line)
+    return "".join(linhas)
+
+
+def compute_edits(old, new):
+    """
+    Calcula as edições mínimas, por linha, que transformam old em new.
+
+    Returns:
+        list: Tuplas (início, fim, substituição) com posições em caracteres de old, em ordem crescente.
+    """
+    old_lines = old.splitlines(keepends=True)
+    new_lines = new.splitlines(keepends=True)
+    offsets = _line_offsets(old_lines)
+    matcher = difflib.SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    edits = []
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag != "equal":
+            edits.append((offsets[i1], offsets[i2], "".join(new_lines[j1:j2])))
+    return edits
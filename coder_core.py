@@ -1,27 +1,309 @@
 # coder_core.py
 
-from langchain_community.llms import Ollama
-from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import TextLoader
-# coder_core.py
-
+import contextlib
+import contextvars
 import logging
 import os
+import threading
 import time
 import re
+import textwrap
+from collections import OrderedDict
+from llm_cache import get_llm_cache
+from model_routes import DEFAULT_STAGE_ROUTES, load_routes, resolve_routes
+from ollama_pool import OllamaError, OllamaHTTPError, OllamaPool
+from stage_graph import StageGraph, check_task, current_task, task_cancelled, task_speculated
+from telemetry import Trace, format_summary, get_telemetry
+from chat_history import format_history
+from code_merge import merge_code_blocks, parse_python
+from code_patch import EDIT_FORMAT_INSTRUCTIONS, PatchError, apply_edits, extract_edits
+from complexity import ComplexityClassifier, parse_llm_decision
+from context_builder import (
+    DEFAULT_STAGE_BUDGETS, ContextBuilder, dedupe_documents, estimate_tokens, fit_documents, fit_history,
+    select_code_regions,
+)
 # ... outros imports
 
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 
+EMBEDDING_MODEL = "sentence-transformers/all-mpnet-base-v2"
+
+# Servidores Ollama usados pelo LLM, separados por vírgula; None usa http://localhost:11434
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL")
+
+# Modos de resposta do pipeline:
+#   "chain": uma cadeia de pensamento serial seguida da resposta;
+#   "decompose": perguntas complexas são divididas em subconsultas respondidas em paralelo e sintetizadas;
+#   "single": uma única chamada devolve raciocínio, resposta e código, com retorno ao modo padrão se a
+#             saída não puder ser interpretada.
+PIPELINE_MODES = ("chain", "decompose", "single")
+
+# Um bloco de código devolvido no lugar de edições só substitui o arquivo inteiro se o modelo viu o arquivo
+# completo e o bloco tem ao menos esta fração das linhas dele
+_WHOLE_FILE_MIN_RATIO = 0.5
+
+
+class RequestCancelled(Exception):
+    """
+    Levantada dentro do pipeline quando a requisição em andamento é cancelada.
+    """
+
+
+class BudgetExceeded(Exception):
+    """
+    Levantada quando a requisição esgota seu orçamento de chamadas ao LLM ou de tempo.
+    """
+
+
+class DeadlineExceeded(BudgetExceeded):
+    """
+    O tempo máximo da requisição foi esgotado.
+    """
+
+
+class CallLimitExceeded(BudgetExceeded):
+    """
+    A requisição atingiu o limite de chamadas ao LLM.
+    """
+
+
+class RequestContext:
+    """
+    Estado de uma requisição em andamento, compartilhado por todas as etapas do pipeline.
+
+    Args:
+        on_stage (callable, opcional): Recebe o nome de cada etapa quando ela começa.
+        max_llm_calls (int, opcional): Máximo de chamadas ao LLM (incluindo novas tentativas) da requisição.
+        max_seconds (float, opcional): Tempo máximo da requisição, contado a partir de set_budget().
+    """
+    def __init__(self, on_stage=None, max_llm_calls=None, max_seconds=None):
+        self.on_stage = on_stage
+        self.cancel_event = threading.Event()
+        self.timings = {}  # categoria ("llm", "retrieval") -> segundos acumulados
+        self.counters = {"llm_calls": 0, "cache_hits": 0, "prompt_tokens": 0, "completion_tokens": 0, "retries": 0}
+        self.trace = Trace()  # Spans por etapa: tempo, tokens, chamadas, acertos do cache e novas tentativas
+        self._lock = threading.Lock()
+        self.max_llm_calls = None
+        self.deadline = None
+        self._reserved_calls = 0
+        self.set_budget(max_llm_calls, max_seconds)
+
+    def set_budget(self, max_llm_calls=None, max_seconds=None):
+        self.max_llm_calls = max_llm_calls
+        self.deadline = time.monotonic() + max_seconds if max_seconds is not None else None
+
+    def has_budget(self):
+        return self.max_llm_calls is not None or self.deadline is not None
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def is_cancelled(self):
+        return self.cancel_event.is_set()
+
+    def check(self):
+        """
+        Levanta RequestCancelled se a requisição foi cancelada.
+        """
+        if self.cancel_event.is_set():
+            raise RequestCancelled()
+        if self.deadline is not None and time.monotonic() > self.deadline:
+            raise DeadlineExceeded("Tempo máximo da requisição esgotado.")
+
+    def can_call_llm(self):
+        """
+        Indica se ainda há orçamento para uma chamada ao LLM, sem reservá-la.
+        """
+        with self._lock:
+            if self.max_llm_calls is not None and self._reserved_calls >= self.max_llm_calls:
+                return False
+        return self.deadline is None or time.monotonic() <= self.deadline
+
+    def reserve_llm_call(self):
+        """
+        Reserva uma chamada ao LLM no orçamento da requisição, levantando CallLimitExceeded (ou DeadlineExceeded) se ele acabou.
+        """
+        self.check()
+        with self._lock:
+            if self.max_llm_calls is not None and self._reserved_calls >= self.max_llm_calls:
+                raise CallLimitExceeded(f"Limite de {self.max_llm_calls} chamadas ao LLM por mensagem atingido.")
+            self._reserved_calls += 1
+
+    def record_time(self, category, seconds):
+        with self._lock:
+            self.timings[category] = self.timings.get(category, 0.0) + seconds
+
+    def record_call(self, prompt, completion, cached=False, model=None, stage=None, seconds=None):
+        """
+        Contabiliza uma chamada ao LLM (ou um acerto do cache) e seus tokens estimados.
+        model, stage (a rota usada) e seconds ficam registrados no trace para ajustar o roteamento.
+        """
+        prompt_tokens = 0 if cached else estimate_tokens(prompt)
+        completion_tokens = 0 if cached else estimate_tokens(completion)
+        with self._lock:
+            self.counters["cache_hits" if cached else "llm_calls"] += 1
+            self.counters["prompt_tokens"] += prompt_tokens
+            self.counters["completion_tokens"] += completion_tokens
+        self.trace.record_call(prompt_tokens, completion_tokens, cached, model, stage, seconds)
+
+    def record_retry(self):
+        with self._lock:
+            self.counters["retries"] += 1
+        self.trace.record_retry()
+
+    def span(self, name, top_level=False):
+        """
+        Mede uma operação dentro da etapa atual (ver telemetry.Trace.span).
+        """
+        return self.trace.span(name, top_level)
+
+    def stage(self, name):
+        """
+        Marca o início de uma etapa: verifica o cancelamento e notifica on_stage.
+        Dentro de um StageGraph as etapas se sobrepõem e cada tarefa já tem o seu span, então a etapa só
+        é notificada.
+        """
+        self.check()
+        if current_task() is None:
+            self.trace.enter_stage(name)
+        if self.on_stage is not None:
+            self.on_stage(name)
+
+
+# Requisição em andamento na thread (ou tarefa) atual
+_current_request = contextvars.ContextVar("current_request", default=None)
+
+
+def current_request():
+    """
+    Retorna o RequestContext da requisição em andamento, ou None fora de um pipeline.
+    """
+    return _current_request.get()
+
+
+def _check_cancelled():
+    context = _current_request.get()
+    if context is not None:
+        context.check()
+    # Etapa especulativa descartada pelo StageGraph
+    check_task()
+
+
+def _enter_stage(name):
+    if task_speculated():
+        # O caminho especulativo não aparece no status: quem o confirma anuncia a etapa dele
+        _check_cancelled()
+        return
+    context = _current_request.get()
+    if context is not None:
+        context.stage(name)
+
+
+def _live_request():
+    # Uma etapa descartada pelo StageGraph pode continuar rodando depois de run(), com o trace já resumido:
+    # o que ela medir fica de fora
+    if task_cancelled():
+        return None
+    return _current_request.get()
+
+
+def _reserve_llm_call():
+    # Uma etapa descartada não gasta o orçamento de chamadas da requisição
+    check_task()
+    context = _current_request.get()
+    if context is not None:
+        context.reserve_llm_call()
+
+
+def _can_call_llm():
+    context = _current_request.get()
+    return context is None or context.can_call_llm()
+
+
+def _record_time(category, seconds):
+    context = _live_request()
+    if context is not None:
+        context.record_time(category, seconds)
+
+
+def _record_call(prompt, completion, cached=False, model=None, stage=None, seconds=None):
+    context = _live_request()
+    if context is not None:
+        context.record_call(prompt, completion, cached, model, stage, seconds)
+
+
+def _record_retry():
+    context = _live_request()
+    if context is not None:
+        context.record_retry()
+
+
+def _before_retry():
+    # Cada nova tentativa do backend respeita o cancelamento e conta no orçamento da requisição
+    _check_cancelled()
+    _reserve_llm_call()
+    _record_retry()
+
+
+def _end_stage():
+    context = _current_request.get()
+    if context is not None:
+        context.trace.end_stage()
+
+
+def _record_schedule(report):
+    context = _current_request.get()
+    if context is not None:
+        context.trace.record_schedule(report)
+
+
+def _span(name, top_level=False):
+    context = _live_request()
+    return context.span(name, top_level) if context is not None else contextlib.nullcontext()
+
+
+def _discard(_):
+    # Destino das etapas especulativas, geradas em streaming só para que o cancelamento encerre a conexão
+    pass
+
 class ModeloLLM:
-    def __init__(self, nome_modelo="llama3.2"):
-        self.modelo = Ollama(model=nome_modelo)
-    
-    def gerar(self, prompt, max_tokens, temperatura):
+    def __init__(self, nome_modelo="llama3.2", base_url=None, cliente=None, rotas=None):
+        """
+        Args:
+            nome_modelo (str): Modelo padrão, usado pelas etapas cuja rota não define outro.
+            base_url (str ou list, opcional): Servidor Ollama, ou vários (lista ou texto separado por vírgulas)
+                que dividem as requisições; o padrão é OLLAMA_BASE_URL.
+            cliente (opcional): Cliente já construído com a interface do Ollama do LangChain (model, generate,
+                stream, invoke), por exemplo um substituto roteirizado nos benchmarks.
+            rotas (dict, opcional): Modelo e opções de geração de cada etapa (ver model_routes); o padrão é
+                DEFAULT_STAGE_ROUTES. Só se aplicam a clientes com variant(), como o OllamaPool.
+        """
+        self.nome_modelo = nome_modelo
+        if cliente is None:
+            cliente = OllamaPool(base_url or OLLAMA_BASE_URL, model=nome_modelo, on_retry=_before_retry)
+        self.modelo = cliente
+        self.rotas = resolve_routes(rotas if rotas is not None else DEFAULT_STAGE_ROUTES, nome_modelo)
+        # Um cliente por combinação de modelo, opções e keep_alive, compartilhado pelas etapas iguais
+        self._clientes = {}
+        if hasattr(cliente, "variant"):
+            variantes = {}
+            for etapa, rota in self.rotas.items():
+                chave = (rota["model"], tuple(sorted(rota["options"].items())), rota["keep_alive"])
+                if chave not in variantes:
+                    variantes[chave] = cliente.variant(rota["model"], rota["options"], rota["keep_alive"])
+                self._clientes[etapa] = variantes[chave]
+        for etapa, rota in sorted(self.rotas.items()):
+            logging.debug(f"Rota da etapa {etapa}: {rota['model']} {rota['options']} keep_alive={rota['keep_alive']}")
+
+    def cliente(self, etapa=None):
+        """
+        Cliente do Ollama da etapa, com o modelo e as opções da rota; sem rota, o cliente padrão.
+        """
+        return self._clientes.get(etapa, self.modelo)
+
+    def gerar(self, prompt, max_tokens, temperatura, on_token=None, processar=True, etapa=None):
         """
         Gera uma resposta do modelo LLM com base no prompt fornecido.
         
@@ -29,115 +311,755 @@ class ModeloLLM:
             prompt (str): O texto de entrada para o modelo.
             max_tokens (int): O número máximo de tokens na resposta.
             temperatura (float): A temperatura para amostragem.
+            on_token (callable, opcional): Recebe cada pedaço de texto assim que chega do modelo.
+                Quando fornecido, a resposta é gerada em streaming.
+            processar (bool): Aplica process_llm_response ao texto gerado.
+            etapa (str, opcional): Etapa do pipeline, que escolhe o modelo e as opções pela tabela de rotas.
+                Se o modelo da rota não existir no servidor, a etapa passa a usar o modelo padrão.
         
         Returns:
             str: A resposta gerada pelo modelo após processamento.
         """
-        return make_api_call(self.modelo, prompt, max_tokens, temperatura)
+        rota = self.rotas.get(etapa, {})
+        if rota.get("max_tokens") is not None:
+            max_tokens = rota["max_tokens"]
+        if rota.get("temperature") is not None:
+            temperatura = rota["temperature"]
+        try:
+            return self._gerar(prompt, max_tokens, temperatura, on_token, processar, etapa)
+        except OllamaHTTPError as e:
+            if not self._modelo_ausente(self.cliente(etapa), e):
+                raise
+            return self._gerar(prompt, max_tokens, temperatura, on_token, processar, etapa)
+
+    def _gerar(self, prompt, max_tokens, temperatura, on_token, processar, etapa):
+        if on_token is not None:
+            return make_streaming_api_call(
+                self, prompt, max_tokens, temperatura, on_token, process=processar, stage=etapa
+            )
+        return make_api_call(self.cliente(etapa), prompt, max_tokens, temperatura, process=processar, stage=etapa)
+
+    def _modelo_ausente(self, cliente, erro):
+        """
+        Se erro indica que o modelo de uma rota não existe no servidor, passa as etapas que o usam para o
+        modelo padrão e retorna True.
+        """
+        if erro.status != 404 or cliente.model == self.nome_modelo:
+            return False
+        # Opções de uma etapa que já usa o modelo padrão, para não recarregá-lo com outro num_ctx
+        opcoes = next((r["options"] for r in self.rotas.values() if r["model"] == self.nome_modelo), {})
+        padrao = cliente.variant(self.nome_modelo, opcoes)
+        etapas = [etapa for etapa, outro in self._clientes.items() if outro.model == cliente.model]
+        for etapa in etapas:
+            self._clientes[etapa] = padrao
+        logging.warning(
+            f"Modelo {cliente.model} indisponível ({str(erro)}); as etapas {', '.join(sorted(etapas))} "
+            f"passam a usar {self.nome_modelo}."
+        )
+        return True
+
+    def gerar_stream(self, prompt, max_tokens, temperatura, etapa=None):
+        """
+        Gera a resposta em streaming, produzindo os pedaços de texto conforme chegam do Ollama.
+
+        Yields:
+            str: O próximo pedaço de texto gerado (sem pós-processamento).
+        """
+        inicio = time.perf_counter()
+        primeiro = True
+        for pedaco in self.cliente(etapa).stream(prompt, num_predict=max_tokens, temperature=temperatura):
+            if primeiro:
+                primeiro = False
+                logging.info(f"Tempo até o primeiro token: {time.perf_counter() - inicio:.3f}s")
+            yield pedaco
+
+    def aquecer(self):
+        """
+        Força o carregamento, nos servidores Ollama, de cada modelo da tabela de rotas (com o num_ctx e o
+        keep_alive da rota) com uma geração de um único token, para que nenhuma etapa espere o carregamento.
+        """
+        if not self._clientes:
+            self.modelo.invoke("ok", num_predict=1)
+            return
+        aquecidos = set()
+        for cliente in list(self._clientes.values()):
+            if cliente.model in aquecidos:
+                continue
+            aquecidos.add(cliente.model)
+            inicio = time.perf_counter()
+            try:
+                cliente.warm_up()
+            except OllamaHTTPError as e:
+                if not self._modelo_ausente(cliente, e):
+                    raise
+                continue
+            logging.info(f"Modelo {cliente.model} carregado em {time.perf_counter() - inicio:.2f}s.")
+
+
+def make_api_call(model, prompt, max_tokens, temperature, process=True, stage=None):
+    """
+    Gera a resposta (consultando o cache) e, se process, a pós-processa com process_llm_response.
+    As novas tentativas e a escolha do servidor ficam com o backend (ver ollama_pool.OllamaPool); uma
+    falha definitiva chega como OllamaError. stage é a rota usada, registrada com a chamada.
+    """
+    _check_cancelled()
+    generated_text = generate_cached(model, prompt, max_tokens, temperature, stage)
+    logging.debug("Resposta bruta gerada pelo modelo: %s", generated_text)
+
+    if not process:
+        return generated_text
 
+    # Processar a resposta para garantir apenas um bloco de código com comentários multilinha
+    processed_text = process_llm_response(generated_text, model, max_tokens, temperature)
+    logging.debug("Resposta processada pelo modelo: %s", processed_text)
 
-def make_api_call(model, prompt, max_tokens, temperature):
-    for attempt in range(3):
+    return processed_text
+
+
+def generate_cached(model, prompt, max_tokens, temperature, stage=None):
+    """
+    Gera o texto bruto do modelo, consultando antes o cache de respostas compartilhado.
+    """
+    cache = get_llm_cache()
+    # As opções da rota (num_ctx, top_p, ...) mudam a geração e entram na chave do cache
+    options = getattr(model, "options", None)
+    cached = cache.lookup(model.model, prompt, max_tokens, temperature, options)
+    if cached is not None:
+        logging.info("Resposta obtida do cache.")
+        _record_call(prompt, cached, cached=True, model=model.model, stage=stage)
+        return cached
+    _reserve_llm_call()
+    inicio = time.perf_counter()
+    try:
+        response = model.generate([prompt], model_kwargs={"max_tokens": max_tokens, "temperature": temperature})
+    finally:
+        segundos = time.perf_counter() - inicio
+        _record_time("llm", segundos)
+    generated_text = response.generations[0][0].text.strip()
+    _record_call(prompt, generated_text, model=model.model, stage=stage, seconds=segundos)
+    cache.store(model.model, prompt, max_tokens, temperature, generated_text, options)
+    return generated_text
+
+
+def make_streaming_api_call(modelo_llm, prompt, max_tokens, temperature, on_token, process=True, stage=None):
+    """
+    Versão em streaming de make_api_call: repassa cada pedaço para on_token e retorna o texto processado.
+    O backend só repete a abertura da requisição, antes do primeiro pedaço, para não duplicar texto já exibido.
+    """
+    cache = get_llm_cache()
+    cliente = modelo_llm.cliente(stage)
+    model_name = cliente.model
+    options = getattr(cliente, "options", None)
+    _check_cancelled()
+    cached = cache.lookup(model_name, prompt, max_tokens, temperature, options)
+    if cached is not None:
+        logging.info("Resposta obtida do cache.")
+        _record_call(prompt, cached, cached=True, model=model_name, stage=stage)
+        on_token(cached)
+        generated_text = cached
+    else:
+        _reserve_llm_call()
+        chunks = []
+        inicio = time.perf_counter()
         try:
-            logging.info(f"Tentativa {attempt + 1} de 3 para gerar resposta.")
-            response = model.generate([prompt], model_kwargs={"max_tokens": max_tokens, "temperature": temperature})
-            generated_text = response.generations[0][0].text.strip()
+            for chunk in modelo_llm.gerar_stream(prompt, max_tokens, temperature, stage):
+                # Interromper o streaming encerra a conexão com o Ollama
+                _check_cancelled()
+                chunks.append(chunk)
+                on_token(chunk)
+        finally:
+            segundos = time.perf_counter() - inicio
+            _record_time("llm", segundos)
+        generated_text = "".join(chunks).strip()
+        _record_call(prompt, generated_text, model=model_name, stage=stage, seconds=segundos)
+        cache.store(model_name, prompt, max_tokens, temperature, generated_text, options)
 
-            logging.info("Resposta bruta gerada pelo modelo:")
-            logging.info(generated_text)
+    logging.debug("Resposta bruta gerada pelo modelo: %s", generated_text)
 
-            # Processar a resposta para garantir apenas um bloco de código com comentários multilinha
-            processed_text = process_llm_response(generated_text, model, max_tokens, temperature)
+    if not process:
+        return generated_text
 
-            logging.info("Resposta processada pelo modelo:")
-            logging.info(processed_text)
+    processed_text = process_llm_response(generated_text, cliente, max_tokens, temperature)
+    logging.debug("Resposta processada pelo modelo: %s", processed_text)
 
-            return processed_text
-        except Exception as e:
-            logging.error(f"Exception: {str(e)}")
-            if attempt == 2:
-                return f"Falha ao gerar resposta após 3 tentativas. Erro: {str(e)}"
-            time.sleep(0.3)
+    return processed_text
 
 
 
 class VectorStoreManager:
-    def __init__(self, vectorstore_path="vectorstore"):
-        self.embeddings = HuggingFaceEmbeddings(model_name="sentence-transformers/all-mpnet-base-v2")
+    def __init__(self, vectorstore_path="vectorstore", query_cache_size=256, embeddings=None, vectorstore=None):
+        # embeddings e vectorstore permitem substituir o modelo e o Chroma (por exemplo, nos benchmarks)
+        if embeddings is None:
+            # Importado só aqui: langchain_huggingface carrega o torch e o sentence-transformers, que levam segundos
+            from langchain_huggingface import HuggingFaceEmbeddings
+            embeddings = HuggingFaceEmbeddings(model_name=EMBEDDING_MODEL)
+        self.embeddings = embeddings
         self.vectorstore_path = vectorstore_path
-        self.vectorstore = self.initialize_vectorstore()
+        self.vectorstore = vectorstore if vectorstore is not None else self.initialize_vectorstore()
+        # O modelo de embeddings é compartilhado entre as threads dos workers
+        self._lock = threading.Lock()
+        # LRU dos embeddings de consultas: cada consulta passa pelo modelo uma única vez
+        self.query_cache_size = query_cache_size
+        self._query_cache = OrderedDict()
 
     def initialize_vectorstore(self):
         if not os.path.exists(self.vectorstore_path):
             os.makedirs(self.vectorstore_path)
+        from langchain_community.vectorstores import Chroma
         return Chroma(persist_directory=self.vectorstore_path, embedding_function=self.embeddings)
 
+    def warm_up(self):
+        """
+        Executa uma passagem do modelo de embeddings para carregar os pesos em memória.
+        """
+        with self._lock:
+            self.embeddings.embed_query("aquecimento")
+
+    def embed_queries(self, queries):
+        """
+        Retorna os embeddings das consultas, calculando as que não estão no cache em uma única passagem do modelo.
+        """
+        with self._lock:
+            missing = list(dict.fromkeys(q for q in queries if q not in self._query_cache))
+            if missing:
+                for query, vector in zip(missing, self.embeddings.embed_documents(missing)):
+                    self._query_cache[query] = vector
+            vectors = []
+            for query in queries:
+                self._query_cache.move_to_end(query)
+                vectors.append(self._query_cache[query])
+            while len(self._query_cache) > self.query_cache_size:
+                self._query_cache.popitem(last=False)
+            return vectors
+
+    def embed_query(self, query):
+        return self.embed_queries([query])[0]
+
     def search_documents(self, query, k=3):
-        return self.vectorstore.similarity_search(query, k=k)
+        return self.search_documents_batch([query], k=k)[0]
+
+    def search_documents_batch(self, queries, k=3):
+        """
+        Busca documentos para várias consultas, embutindo todas em uma única passagem do modelo.
+
+        Returns:
+            list: Uma lista de documentos para cada consulta, na mesma ordem.
+        """
+        inicio = time.perf_counter()
+        try:
+            with _span("retrieval"):
+                vectors = self.embed_queries(queries)
+                return [self.vectorstore.similarity_search_by_vector(vector, k=k) for vector in vectors]
+        finally:
+            _record_time("retrieval", time.perf_counter() - inicio)
+
+    def embed_documents(self, texts):
+        """
+        Calcula os embeddings de uma lista de textos em uma única passagem do modelo.
+        """
+        with self._lock:
+            return self.embeddings.embed_documents(texts)
+
+    def upsert_embedded(self, ids, texts, embeddings, metadatas):
+        """
+        Insere ou substitui trechos cujos embeddings já foram calculados, sem recalculá-los.
+        """
+        with self._lock:
+            self.vectorstore._collection.upsert(
+                ids=ids, documents=texts, embeddings=embeddings, metadatas=metadatas
+            )
+
+    def delete_ids(self, ids):
+        if ids:
+            with self._lock:
+                self.vectorstore.delete(ids=ids)
 
 class CoderCore:
-    def __init__(self):
-        self.model = ModeloLLM()
-        self.vectorstore_manager = VectorStoreManager()
+    def __init__(self, default_mode="decompose", max_concurrency=4, max_subqueries=4, max_llm_calls=12,
+                 max_seconds=300.0, model=None, vectorstore_manager=None, complexity_classifier=None,
+                 speculative=True):
+        self.default_mode = default_mode
+        self.max_concurrency = max_concurrency  # Etapas simultâneas do grafo do pipeline (chamadas ao Ollama)
+        self.max_subqueries = max_subqueries
+        # Se o classificador local não decidir, começa os caminhos simples e complexo junto com a classificação
+        self.speculative = speculative
+        # Orçamento de cada mensagem, aplicado às requisições que não definem o seu
+        self.max_llm_calls = max_llm_calls
+        self.max_seconds = max_seconds
+        self.stage_budgets = dict(DEFAULT_STAGE_BUDGETS)  # Tokens de contexto por etapa
+        # model, vectorstore_manager e complexity_classifier substituem os componentes padrão
+        self.model = model if model is not None else ModeloLLM(rotas=load_routes("model_routes.json"))
+        self.vectorstore_manager = vectorstore_manager if vectorstore_manager is not None else VectorStoreManager()
+        self.complexity_classifier = complexity_classifier if complexity_classifier is not None else (
+            ComplexityClassifier.load("complexity_weights.json", log_path="complexity_decisions.jsonl")
+        )
+        self._saude = {"embeddings": None, "llm": None, "aquecido_em": None, "erro": None}
+
+    def warm_up(self):
+        """
+        Aquece o modelo de embeddings e o modelo LLM para que a primeira consulta não pague o custo de carregamento.
 
-    def generate_subqueries(self, prompt):
+        Returns:
+            dict: O estado de saúde após o aquecimento (ver health_check).
+        """
+        inicio = time.perf_counter()
+        try:
+            self.vectorstore_manager.warm_up()
+            self._saude["embeddings"] = True
+        except Exception as e:
+            logging.error(f"Falha ao aquecer o modelo de embeddings: {str(e)}")
+            self._saude["embeddings"] = False
+            self._saude["erro"] = str(e)
+        try:
+            self.model.aquecer()
+            self._saude["llm"] = True
+        except Exception as e:
+            logging.error(f"Falha ao aquecer o modelo LLM: {str(e)}")
+            self._saude["llm"] = False
+            self._saude["erro"] = str(e)
+        self._saude["aquecido_em"] = time.time()
+        logging.info(f"CoderCore aquecido em {time.perf_counter() - inicio:.2f}s.")
+        return self.health_check()
+
+    def health_check(self):
+        """
+        Retorna o estado de saúde do núcleo: True/False para cada componente, ou None se ainda não foi verificado.
+        Inclui os contadores do cache de respostas do LLM e o estado de cada servidor Ollama.
+        """
+        saude = dict(self._saude)
+        saude["cache"] = get_llm_cache().stats()
+        if hasattr(self.model.modelo, "stats"):
+            saude["ollama"] = self.model.modelo.stats()
+        return saude
+
+    def build_context(self, stage, pergunta, existing_code="", chat_history=None, documentos=None, extras=None):
+        """
+        Monta o contexto de uma etapa dentro do orçamento de tokens dela, por prioridade: extras, código
+        relevante para a pergunta, histórico recente e documentos recuperados sem repetição.
+
+        Args:
+            stage (str): Etapa do pipeline (chave de self.stage_budgets).
+            chat_history (list, opcional): Mensagens anteriores (ChatMessage ou texto).
+            extras (dict, opcional): Seções de texto adicionais, com prioridade sobre as demais.
+
+        Returns:
+            dict: Texto de cada seção: "codigo", "historico", "documentos" e as chaves de extras.
+        """
+        budget = self.stage_budgets[stage]
+        builder = ContextBuilder(budget)
+        outras = chat_history is not None or documentos is not None
+        for name, text in (extras or {}).items():
+            builder.add(name, 0, text=text, max_tokens=budget // 2 if existing_code or outras else None)
+        builder.add(
+            "codigo", 1, fit=lambda disponivel: select_code_regions(existing_code, pergunta, disponivel),
+            min_tokens=0, max_tokens=int(budget * 0.7) if outras else None
+        )
+        if chat_history is not None:
+            linhas = format_history(chat_history)
+            builder.add("historico", 2, fit=lambda disponivel: fit_history(linhas, disponivel))
+        if documentos is not None:
+            textos = dedupe_documents(documentos, exclude_text=existing_code)
+            builder.add("documentos", 3, fit=lambda disponivel: fit_documents(textos, disponivel))
+        return builder.build()
+
+    def generate_subqueries(self, prompt, on_token=None):
         """
         Descompor o prompt principal em subconsultas resolvíveis usando cadeia de pensamento.
         """
         subquery_prompt = f"Descomponha a seguinte consulta em uma série de subconsultas menores e gerenciáveis: \n{prompt}"
-        response = self.model.gerar(subquery_prompt, max_tokens=200, temperatura=0.5)
+        response = self.model.gerar(
+            subquery_prompt, max_tokens=200, temperatura=0.5, on_token=on_token, etapa="decompose"
+        )
         # Utilizar expressões regulares para uma divisão mais robusta
         subqueries = re.split(r'\n|- ', response)
-        return [subquery.strip() for subquery in subqueries if subquery.strip()]
+        # Remover numeração ("1.", "2)") e linhas de introdução como "Subconsultas:"
+        subqueries = [re.sub(r'^\s*\d+[.)]\s*', '', subquery).strip() for subquery in subqueries]
+        return [subquery for subquery in subqueries if subquery and not subquery.endswith(':')]
 
-    def generate_code_solution(self, user_query, chain_of_thought, final_answer):
+    def generate_code_solution(self, user_query, chain_of_thought, final_answer, on_token=None):
         """
         Gerar uma solução de código para abordar a consulta com base na cadeia de pensamento e na resposta final.
         """
         if not chain_of_thought or not final_answer:
             return ""
+        contexto = self.build_context(
+            "code", user_query, extras={"resposta": final_answer, "cadeia": chain_of_thought}
+        )
         code_prompt = f"""Com base na cadeia de pensamento e na resposta final fornecidas, gere um código que resolva o problema descrito na consulta do usuário:
 
 Consulta do Usuário: {user_query}
 
-Cadeia de Pensamento: {chain_of_thought}
+Cadeia de Pensamento: {contexto['cadeia']}
 
-Resposta Final: {final_answer}
+Resposta Final: {contexto['resposta']}
 
 Solução de Código:"""
-        generated_code = self.model.gerar(code_prompt, max_tokens=500, temperatura=0.7)
+        generated_code = self.model.gerar(
+            code_prompt, max_tokens=500, temperatura=0.7, on_token=on_token, etapa="code"
+        )
         return generated_code.strip()
 
-    def process_query(self, user_query, chat_history, existing_code=None):
+    def run_pipeline(self, user_query, chat_history, existing_code=None, context=None,
+                     on_token=None, on_code_token=None, on_answer=None, mode=None):
+        """
+        Executa o pipeline completo de uma mensagem: classificação, cadeia de pensamento, resposta e
+        geração ou modificação de código.
+
+        Args:
+            context (RequestContext, opcional): Permite acompanhar as etapas e cancelar a requisição.
+            on_token (callable, opcional): Recebe os tokens da resposta em streaming.
+            on_code_token (callable, opcional): Recebe os tokens do código em streaming.
+            on_answer (callable, opcional): Recebe (resposta, passos) assim que a resposta fica pronta, antes
+                do fim da etapa de código (que, ao modificar código existente, já pode estar em andamento).
+                Nos modos de múltiplas chamadas, os callbacks são chamados das threads do grafo de etapas.
+            mode (str, opcional): Um de PIPELINE_MODES; o padrão é self.default_mode.
+
+        Returns:
+            tuple: (resposta, passos, código). Levanta RequestCancelled se a requisição for cancelada,
+            BudgetExceeded se ela esgotar o orçamento de chamadas ao LLM ou de tempo e OllamaError se o
+            Ollama falhar mesmo após as novas tentativas.
+        """
+        context = context if context is not None else RequestContext()
+        if not context.has_budget():
+            context.set_budget(self.max_llm_calls, self.max_seconds)
+        token = _current_request.set(context)
+        mode = mode or self.default_mode
+        status = "error"
+        try:
+            existing_code = existing_code if existing_code is not None else ""
+            if mode == "single":
+                context.stage("single")
+                result = self.responde_passo_unico(user_query, chat_history, existing_code, on_token=on_token)
+                if result is not None:
+                    response, steps, code_solution = result
+                    if on_answer is not None:
+                        on_answer(response, steps)
+                    status = "ok"
+                    return response, steps, code_solution
+                logging.info("Saída estruturada não interpretável; usando o pipeline de múltiplas chamadas.")
+                mode = None
+            response, steps, code_solution = self.executa_grafo(
+                user_query, chat_history, existing_code, mode, on_token=on_token, on_answer=on_answer,
+                on_code_token=on_code_token, com_codigo=True
+            )
+            status = "ok"
+            return response, steps, code_solution
+        except RequestCancelled:
+            status = "cancelled"
+            raise
+        except BudgetExceeded:
+            status = "budget"
+            raise
+        finally:
+            _current_request.reset(token)
+            context.trace.finish(status)
+            summary = get_telemetry().record(context.trace)
+            logging.info(f"Modo {mode or self.default_mode} ({status}): {format_summary(summary)}")
+
+    def process_query(self, user_query, chat_history, existing_code=None, on_token=None, mode=None):
         """
         Processar a consulta do usuário, gerar subconsultas e implementar estratégias de cadeia de pensamento.
+        Se on_token for fornecido, a resposta final é transmitida em streaming para ele.
         """
-        # Determinar a complexidade
-        existing_code = existing_code if existing_code is not None else ""
-        is_complex = self.decide_complexidade_pergunta(user_query, chat_history, existing_code)
-        response, steps = self.responde_chain_of_thought(user_query, chat_history, existing_code, is_complex)
+        response, steps, _ = self.executa_grafo(user_query, chat_history, existing_code, mode, on_token=on_token)
         return response, steps
 
+    def executa_grafo(self, pergunta, chat_history, existing_code=None, mode=None, on_token=None, on_answer=None,
+                      on_code_token=None, com_codigo=False):
+        """
+        Executa o pipeline de múltiplas chamadas como um grafo de etapas (ver stage_graph.StageGraph), com
+        no máximo self.max_concurrency etapas simultâneas, sobrepondo o que não depende entre si:
+
+        - se o classificador local não decidir a complexidade, a classificação pelo LLM (com a sua busca de
+          documentos) roda junto com o início especulativo dos dois caminhos, e o perdedor é cancelado
+          assim que ela termina;
+        - no modo "decompose", as subconsultas de uma pergunta complexa são respondidas em paralelo;
+        - as modificações do código existente começam assim que a cadeia de pensamento (ou as respostas
+          parciais) fica pronta, junto com a resposta; o código novo, que também usa a resposta, logo depois dela.
+
+        O caminho crítico e o tempo total do grafo ficam no trace da requisição (Trace.schedule).
+
+        Args:
+            on_answer (callable, opcional): Recebe (resposta, passos) assim que a resposta fica pronta.
+            on_code_token (callable, opcional): Recebe os tokens do código novo em streaming.
+            com_codigo (bool): Inclui a geração ou modificação de código.
+
+        Returns:
+            tuple: (resposta, passos, código); o código é "" sem com_codigo.
+        """
+        mode = mode or self.default_mode
+        if mode not in PIPELINE_MODES:
+            raise ValueError(f"Modo de pipeline desconhecido: {mode}")
+        # O modo de passagem única é resolvido em run_pipeline; aqui resta o caminho de múltiplas chamadas
+        decompor = mode in ("decompose", "single")
+        existing_code = existing_code if existing_code is not None else ""
+        grafo = StageGraph(self.max_concurrency)
+
+        def etapa(nome, executa, deps=(), especulativa=False):
+            # Cada etapa do grafo tem o seu span de primeiro nível no trace, pois elas se sobrepõem; o das
+            # especulativas é marcado, para não se misturar ao das etapas que começaram confirmadas
+            rotulo = f"{nome} (especulativa)" if especulativa else nome
+
+            def com_span(resultados):
+                with _span(rotulo, top_level=True):
+                    return executa(resultados)
+            return grafo.add(nome, com_span, deps, speculative=especulativa)
+
+        def raciocinio(is_complex, especulativa=False):
+            # A etapa especulativa é gerada em streaming para que o cancelamento interrompa a geração
+            destino = _discard if especulativa else None
+            nome = "reason:complex" if is_complex else "reason:simple"
+            return etapa(nome, lambda _: self.gera_cadeia(pergunta, existing_code, is_complex, on_token=destino),
+                         especulativa=especulativa)
+
+        def inicio(is_complex, especulativa=False):
+            # Primeira etapa do caminho
+            if not (is_complex and decompor):
+                return raciocinio(is_complex, especulativa)
+
+            def decompoe(_):
+                destino = _discard if especulativa else None
+                _enter_stage("decompose")
+                return self.generate_subqueries(pergunta, on_token=destino)[:self.max_subqueries]
+            return etapa("decompose", decompoe, especulativa=especulativa)
+
+        def resposta_pronta(resposta, passos):
+            if on_answer is not None:
+                on_answer(resposta, passos)
+            return resposta, passos
+
+        def segue_codigo(deps_cadeia, cadeia_de, dep_resposta):
+            if not com_codigo:
+                return
+            if existing_code.strip():
+                # As modificações só usam a cadeia de pensamento: rodam junto com a resposta
+                etapa("modify", lambda resultados: self.suggest_code_modification(
+                    pergunta, cadeia_de(resultados), None, existing_code
+                ), deps=deps_cadeia)
+            else:
+                def gera(resultados):
+                    _enter_stage("code")
+                    resposta, passos = resultados[dep_resposta]
+                    return self.generate_code_solution(pergunta, "\n".join(passos), resposta, on_token=on_code_token)
+                etapa("code", gera, deps=[dep_resposta])
+
+        def segue_cadeia(nome_cadeia):
+            def responde(resultados):
+                cadeia = resultados[nome_cadeia]
+                return resposta_pronta(self.responde_com_cadeia(pergunta, cadeia, on_token=on_token), [cadeia])
+            etapa("answer", responde, deps=[nome_cadeia])
+            segue_codigo([nome_cadeia], lambda resultados: resultados[nome_cadeia], "answer")
+
+        def segue_decomposicao(resultados):
+            subqueries = resultados["decompose"]
+            if len(subqueries) < 2:
+                # Nada a paralelizar: seguir com a cadeia de pensamento complexa
+                segue_cadeia(raciocinio(True))
+                return
+            # Recuperar o contexto de todas as subconsultas em uma única passagem do modelo de embeddings
+            busca = etapa("retrieve", lambda _: self.vectorstore_manager.search_documents_batch(subqueries, k=2))
+            parciais = []
+            for i, subquery in enumerate(subqueries):
+                def responde(resultados, i=i, subquery=subquery):
+                    _enter_stage("subqueries")
+                    documentos = resultados["retrieve"][i]
+                    return self.responde_subconsulta(pergunta, subquery, documentos, existing_code)
+                parciais.append(etapa(f"subquery:{i + 1}", responde, deps=[busca]))
+
+            def passos_de(resultados):
+                return [
+                    f"Subconsulta: {subquery}\nResposta: {resultados[nome]}"
+                    for subquery, nome in zip(subqueries, parciais)
+                ]
+
+            def sintetiza(resultados):
+                passos = passos_de(resultados)
+                return resposta_pronta(self.sintetiza_respostas(pergunta, passos, on_token=on_token), passos)
+            etapa("synthesize", sintetiza, deps=parciais)
+            segue_codigo(parciais, lambda resultados: "\n".join(passos_de(resultados)), "synthesize")
+
+        def segue(is_complex):
+            # Etapas seguintes ao início do caminho escolhido
+            if is_complex and decompor:
+                etapa("plan", segue_decomposicao, deps=["decompose"])
+            else:
+                segue_cadeia("reason:complex" if is_complex else "reason:simple")
+
+        _enter_stage("classify")
+        decisao, probabilidade, features, code_lines = self._classifica_localmente(pergunta, existing_code)
+        # Daqui em diante as etapas se sobrepõem e cada uma é medida pelo seu span
+        _end_stage()
+        if decisao is not None:
+            inicio(decisao)
+            segue(decisao)
+        else:
+            especular = self.speculative and self.max_concurrency > 1
+            if especular:
+                caminhos = {is_complex: inicio(is_complex, especulativa=True) for is_complex in (False, True)}
+
+            def classifica(_):
+                is_complex = self._classifica_com_llm(
+                    pergunta, chat_history, existing_code, probabilidade, features, code_lines
+                )
+                if especular:
+                    grafo.cancel(caminhos[not is_complex])
+                    grafo.confirm(caminhos[is_complex])
+                    # Só agora o início do caminho escolhido aparece no status
+                    _enter_stage("decompose" if is_complex and decompor else "reason")
+                else:
+                    inicio(is_complex)
+                segue(is_complex)
+                return is_complex
+            etapa("classify:llm", classifica)
+
+        try:
+            resultados = grafo.run()
+        finally:
+            relatorio = grafo.report()
+            _record_schedule(relatorio)
+            logging.info(
+                f"Grafo do pipeline: {relatorio['total_seconds']:.2f}s, caminho crítico "
+                f"{relatorio['critical_path_seconds']:.2f}s ({' → '.join(relatorio['critical_path'])}), "
+                f"{relatorio['cancelled_seconds']:.2f}s em etapas canceladas"
+            )
+        resposta, passos = resultados["synthesize"] if "synthesize" in resultados else resultados["answer"]
+        codigo = resultados.get("modify", resultados.get("code", ""))
+        return resposta.strip(), passos, codigo
+
+    def sintetiza_respostas(self, pergunta, passos, on_token=None):
+        """
+        Combina as respostas parciais das subconsultas (passos) em uma resposta para a pergunta original.
+        """
+        partes = "\n\n".join(f"{i}. {passo}" for i, passo in enumerate(passos, 1))
+        partes = self.build_context("synthesize", pergunta, extras={"partes": partes})["partes"]
+        prompt_sintese = f"""
+Pergunta: {pergunta}
+
+A pergunta foi dividida em subconsultas, respondidas abaixo:
+
+{partes}
+
+Combine as respostas parciais em uma resposta direta e concisa para a pergunta original.
+"""
+        _enter_stage("synthesize")
+        resposta = self.model.gerar(
+            prompt_sintese, max_tokens=300, temperatura=0.5, on_token=on_token, etapa="synthesize"
+        )
+        return resposta.strip()
+
+    def responde_passo_unico(self, pergunta, chat_history, existing_code="", on_token=None):
+        """
+        Obtém raciocínio, resposta e código em uma única chamada ao LLM, com saída em seções marcadas.
+        Apenas a seção de resposta é transmitida para on_token. Se a saída não puder ser interpretada mas
+        parte da resposta já tiver sido transmitida, ela é usada como resposta (sem código), para que o
+        pipeline de múltiplas chamadas não transmita uma segunda resposta na mesma mensagem.
+
+        Returns:
+            tuple: (resposta, passos, código), ou None se a saída não puder ser interpretada e nada tiver
+            sido transmitido.
+        """
+        contexto = self.build_context("single", pergunta, existing_code, chat_history=chat_history)
+        if existing_code.strip():
+            instrucao_codigo = (
+                "os blocos de edição SEARCH/REPLACE que modificam o código atual para atender à pergunta "
+                "(copie as linhas de SEARCH exatamente)"
+            )
+        else:
+            instrucao_codigo = "um único bloco ```python com o código que resolve o problema descrito na pergunta"
+        prompt = f"""
+Considere as últimas mensagens:
+{contexto['historico']}
+
+O código atual é:
+{contexto['codigo']}
+
+Pergunta: {pergunta}
+
+Responda usando exatamente as três seções abaixo, nesta ordem, sem texto fora delas:
+<raciocinio>uma cadeia de pensamento concisa: compreensão da pergunta, dados relevantes, análise e verificação</raciocinio>
+<resposta>uma resposta direta e concisa para a pergunta</resposta>
+<codigo>{instrucao_codigo}; deixe vazio se nenhum código for necessário</codigo>
+"""
+        stream = _SectionStream("resposta", on_token) if on_token is not None else None
+        texto = self.model.gerar(
+            prompt, max_tokens=1000, temperatura=0.5,
+            on_token=stream.feed if stream is not None else None, processar=False, etapa="single"
+        )
+        secoes = parse_structured_response(texto)
+        if secoes is None and stream is not None and stream.sent.strip():
+            logging.info("Saída estruturada não interpretável; usando a resposta já transmitida.")
+            secoes = {"raciocinio": "", "resposta": stream.sent.strip(), "codigo": ""}
+        if secoes is None:
+            return None
+        codigo = secoes["codigo"]
+        if codigo and existing_code.strip():
+            codigo = self.apply_code_edits(existing_code, codigo, contexto["codigo"])
+        elif codigo:
+            codigo = process_llm_response(codigo, self.model.cliente("single"), 500, 0.7)
+        return secoes["resposta"], [secoes["raciocinio"]], codigo
+
+    def responde_subconsulta(self, pergunta, subconsulta, documentos, existing_code=""):
+        """
+        Responde a uma única subconsulta usando os documentos recuperados para ela.
+        """
+        contexto = self.build_context("subquery", subconsulta, existing_code, documentos=documentos)
+        prompt = f"""
+Pergunta original: {pergunta}
+Subconsulta: {subconsulta}
+
+Documentos relevantes:
+{contexto['documentos']}
+
+O código atual é:
+{contexto['codigo']}
+
+Responda de forma concisa apenas à subconsulta.
+"""
+        return self.model.gerar(prompt, max_tokens=200, temperatura=0.5, etapa="subquery").strip()
+
     def decide_complexidade_pergunta(self, pergunta, chat_history, existing_code=""):
         """
         Determina se a pergunta requer uma resposta simples ou complexa com base no contexto das últimas mensagens e no código existente.
+        O classificador local decide sozinho quando está confiante; o LLM só é consultado nos casos incertos.
+        """
+        decisao, probabilidade, features, code_lines = self._classifica_localmente(pergunta, existing_code)
+        if decisao is not None:
+            return decisao
+        return self._classifica_com_llm(pergunta, chat_history, existing_code, probabilidade, features, code_lines)
+
+    def _classifica_localmente(self, pergunta, existing_code=""):
+        """
+        Returns:
+            tuple: (decisão ou None se o classificador local não estiver confiante, probabilidade, features,
+            linhas de código).
+        """
+        code_lines = existing_code.count("\n") + 1 if existing_code.strip() else 0
+        decisao, probabilidade, features = self.complexity_classifier.classify(pergunta, code_lines)
+        if decisao is not None:
+            logging.info(f"Complexidade decidida localmente: {'Complexa' if decisao else 'Simples'} (p={probabilidade:.2f})")
+        return decisao, probabilidade, features, code_lines
+
+    def _classifica_com_llm(self, pergunta, chat_history, existing_code, probabilidade, features, code_lines):
+        """
+        Decide a complexidade pelo LLM, com os documentos similares à pergunta, nos casos incertos.
         """
-        last_messages = "\n".join(chat_history[-5:])
         similar_docs = self.vectorstore_manager.search_documents(pergunta, k=3)
-        similar_texts = "\n".join([doc.page_content for doc in similar_docs])
+        contexto = self.build_context(
+            "classify", pergunta, existing_code, chat_history=chat_history, documentos=similar_docs
+        )
 
         prompt = f"""
-Considere o contexto das últimas 5 mensagens abaixo:
+Considere o contexto das últimas mensagens abaixo:
 
-{last_messages}
+{contexto['historico']}
 
 Além disso, considere os seguintes documentos similares:
 
-{similar_texts}
+{contexto['documentos']}
 
 E considere o código atual:
 
-{existing_code}
+{contexto['codigo']}
 
 Com base nesse contexto e na pergunta a seguir:
 
@@ -147,12 +1069,20 @@ Determine se a pergunta requer uma resposta simples ou complexa.
 Responda apenas com "Simples" ou "Complexa".
 """
 
-        resposta = self.model.gerar(prompt, max_tokens=10, temperatura=0.3)
-        return resposta.strip().lower() == "complexa"
+        inicio = time.perf_counter()
+        resposta = self.model.gerar(prompt, max_tokens=10, temperatura=0.3, etapa="classify")
+        decisao = parse_llm_decision(resposta)
+        if decisao is None:
+            # Resposta ininteligível: seguir a inclinação do classificador local
+            return probabilidade >= 0.5
+        self.complexity_classifier.log_decision(
+            pergunta, code_lines, features, decisao, time.perf_counter() - inicio
+        )
+        return decisao
 
-    def responde_chain_of_thought(self, pergunta, chat_history, existing_code="", is_complex=False):
+    def gera_cadeia(self, pergunta, existing_code="", is_complex=False, on_token=None):
         """
-        Responde a uma pergunta utilizando uma cadeia de pensamento simples ou complexa dependendo da complexidade.
+        Gera uma cadeia de pensamento simples ou complexa dependendo da complexidade.
         """
         lista_passos = [
             "Compreensão da pergunta",
@@ -164,7 +1094,8 @@ Responda apenas com "Simples" ou "Complexa".
             "Revisão e refinamento"
         ]
 
-        prompt_contexto_codigo = f"O código atual é:\n{existing_code}\n\n"
+        contexto = self.build_context("reason", pergunta, existing_code)
+        prompt_contexto_codigo = f"O código atual é:\n{contexto['codigo']}\n\n"
 
         if is_complex:
             prompt_cadeia = f"""
@@ -183,52 +1114,230 @@ Gere uma cadeia de pensamento simples para responder à pergunta acima, usando o
 Forneça uma resposta concisa para cada passo.
 """
         
-        cadeia = self.model.gerar(prompt_cadeia, max_tokens=500, temperatura=0.7)
-        
+        _enter_stage("reason")
+        return self.model.gerar(prompt_cadeia, max_tokens=500, temperatura=0.7, on_token=on_token, etapa="reason")
+
+    def responde_com_cadeia(self, pergunta, cadeia, on_token=None):
+        """
+        Responde à pergunta com base na cadeia de pensamento gerada por gera_cadeia.
+        """
+        contexto_resposta = self.build_context("answer", pergunta, extras={"cadeia": cadeia})
         prompt_resposta = f"""
 Com base na seguinte cadeia de pensamento:
-{cadeia}
+{contexto_resposta['cadeia']}
 Forneça uma resposta direta e concisa para a pergunta original: {pergunta}
 """
-        resposta = self.model.gerar(prompt_resposta, max_tokens=200, temperatura=0.5)
+        _enter_stage("answer")
+        resposta = self.model.gerar(
+            prompt_resposta, max_tokens=200, temperatura=0.5, on_token=on_token, etapa="answer"
+        )
         
-        return resposta.strip(), [cadeia]
+        return resposta.strip()
 
-    def create_code_solution_if_empty(self, user_query, chain_of_thought, final_answer, existing_code):
-        """
-        Cria uma nova solução de código apenas se o editor de código estiver vazio ou sugere modificações no código existente.
-        """
-        if not existing_code.strip():
-            return self.generate_code_solution(user_query, chain_of_thought, final_answer)
-        else:
-            return self.suggest_code_modification(user_query, chain_of_thought, final_answer, existing_code)
-
-    def suggest_code_modification(self, user_query, chain_of_thought, final_answer, existing_code):
+    def suggest_code_modification(self, user_query, chain_of_thought, final_answer, existing_code, on_token=None):
         """
         Sugere modificações no código existente com base na nova consulta e na cadeia de pensamento.
+
+        O modelo devolve apenas blocos de edição, aplicados localmente sobre o código atual, de modo que o
+        tamanho da saída acompanha o tamanho da mudança e não o do arquivo. Como os blocos não são código
+        exibível, on_token não é usado.
+
+        Returns:
+            str: O código modificado, ou "" se nenhuma modificação puder ser aplicada.
         """
+        contexto = self.build_context(
+            "modify", user_query, existing_code, extras={"cadeia": chain_of_thought}
+        )
         modification_prompt = f"""
-O código atual é:
-{existing_code}
+O código atual (trechos relevantes) é:
+{contexto['codigo']}
 
 Com base na consulta do usuário: {user_query}
-E na cadeia de pensamento: {chain_of_thought}
+E na cadeia de pensamento: {contexto['cadeia']}
 Sugira modificações ou melhorias no código existente para atender à consulta.
+
+{EDIT_FORMAT_INSTRUCTIONS}
 """
-        suggested_code = self.model.gerar(modification_prompt, max_tokens=300, temperatura=0.7)
-        return suggested_code.strip()
+        _enter_stage("modify")
+        resposta = self.model.gerar(
+            modification_prompt, max_tokens=800, temperatura=0.7, processar=False, etapa="modify"
+        )
+        return self.apply_code_edits(existing_code, resposta, contexto["codigo"])
+
+    def apply_code_edits(self, existing_code, resposta, codigo_enviado=None):
+        """
+        Aplica ao código atual as edições (SEARCH/REPLACE ou diff unificado) contidas na resposta do modelo.
+
+        Se a resposta trouxer um bloco de código em vez de edições, ele só substitui o código inteiro quando
+        o modelo viu o arquivo completo e o bloco tem um tamanho próximo ao dele; caso contrário, o bloco é
+        mesclado ao código atual pelos nomes das definições (ver merge_code_blocks), para que uma resposta
+        com apenas a função alterada não apague o resto do arquivo.
+
+        Args:
+            codigo_enviado (str, opcional): O código incluído no prompt (o arquivo inteiro ou só trechos).
+
+        Returns:
+            str: O código resultante, ou "" se as edições não puderem ser aplicadas.
+        """
+        edits = extract_edits(resposta)
+        if not edits:
+            blocos = re.findall(r'```(?:python)?\n(.*?)```', resposta, re.DOTALL)
+            if not blocos:
+                logging.warning("Nenhum bloco de edição encontrado na resposta do modelo.")
+                return ""
+            bloco = blocos[0].strip()
+            if not existing_code.strip():
+                return bloco
+            arquivo_inteiro = codigo_enviado is not None and codigo_enviado.strip() == existing_code.strip()
+            linhas = len(existing_code.strip().splitlines())
+            if arquivo_inteiro and len(bloco.splitlines()) >= linhas * _WHOLE_FILE_MIN_RATIO:
+                logging.info("O modelo devolveu o código completo em vez de edições.")
+                return bloco
+            code = merge_code_blocks([existing_code, bloco])
+            if code is None:
+                logging.warning("Bloco de código descartado: o modelo viu só trechos do arquivo e a mesclagem falhou.")
+                return ""
+            logging.info("O modelo devolveu um bloco de código em vez de edições; mesclado ao código atual.")
+            return code
+        try:
+            code = apply_edits(existing_code, edits)
+        except PatchError as e:
+            logging.warning(f"Edições descartadas: {str(e)}")
+            return ""
+        logging.info(f"{len(edits)} edições aplicadas ao código atual.")
+        return code
+
+
+_SECTION_TAGS = {
+    "raciocinio": r"racioc[ií]nio",
+    "resposta": r"resposta",
+    "codigo": r"c[óo]digo",
+}
+
+
+def parse_structured_response(text):
+    """
+    Extrai as seções raciocinio, resposta e codigo de uma saída estruturada do LLM.
+
+    Aceita as marcações <secao>...</secao> (mesmo sem a marcação de fechamento) e, como alternativa,
+    títulos como "Resposta:" ou "## Código". Retorna None se não houver uma resposta.
+    """
+    secoes = {}
+    nomes = "|".join(_SECTION_TAGS.values())
+    for nome, padrao in _SECTION_TAGS.items():
+        match = re.search(
+            rf"<{padrao}>(.*?)(?:</{padrao}>|(?=<(?:{nomes})>)|\Z)", text, re.DOTALL | re.IGNORECASE
+        )
+        if match:
+            secoes[nome] = match.group(1).strip()
+    if not secoes.get("resposta"):
+        # Títulos no início da linha: "Resposta:", "**Resposta**:", "## Resposta"
+        partes = re.split(
+            rf"^\s*(?:#+\s*|\*\*)?({nomes})(?:\*\*)?\s*:?\s*(?:\*\*)?\s*$|^\s*(?:\*\*)?({nomes})(?:\*\*)?\s*:(?:\*\*)?",
+            text, flags=re.MULTILINE | re.IGNORECASE
+        )
+        secoes = {}
+        for i in range(1, len(partes) - 2, 3):
+            titulo = (partes[i] or partes[i + 1]).lower()
+            for nome, padrao in _SECTION_TAGS.items():
+                if re.fullmatch(padrao, titulo):
+                    secoes[nome] = partes[i + 2].strip()
+    if not secoes.get("resposta"):
+        return None
+    return {
+        "raciocinio": secoes.get("raciocinio", ""),
+        "resposta": secoes["resposta"],
+        "codigo": secoes.get("codigo", ""),
+    }
 
 
-def process_llm_response(text, model, max_tokens, temperature, recursion_depth=0, max_recursion=5):
+class _SectionStream:
+    """
+    Repassa para on_token apenas o texto transmitido dentro de <tag>...</tag>; sent guarda o que já foi
+    repassado.
+    """
+    def __init__(self, tag, on_token):
+        self.open_tag = f"<{tag}>"
+        self.close_tag = f"</{tag}>"
+        self.on_token = on_token
+        self.buffer = ""
+        self.sent = ""
+        self.state = "before"
+
+    def _send(self, text):
+        self.sent += text
+        self.on_token(text)
+
+    def feed(self, chunk):
+        if self.state == "after":
+            return
+        self.buffer += chunk
+        if self.state == "before":
+            inicio = self.buffer.lower().find(self.open_tag)
+            if inicio < 0:
+                # Guardar o final, que pode ser o começo da marcação de abertura
+                self.buffer = self.buffer[-len(self.open_tag):]
+                return
+            self.buffer = self.buffer[inicio + len(self.open_tag):].lstrip()
+            self.state = "inside"
+        fim = self.buffer.lower().find(self.close_tag)
+        if fim >= 0:
+            if self.buffer[:fim]:
+                self._send(self.buffer[:fim])
+            self.buffer = ""
+            self.state = "after"
+            return
+        seguro = len(self.buffer) - len(self.close_tag) + 1
+        if seguro > 0:
+            self._send(self.buffer[:seguro])
+            self.buffer = self.buffer[seguro:]
+
+
+_core_instance = None
+_core_lock = threading.Lock()
+
+
+def get_coder_core():
+    """
+    Retorna a instância de CoderCore compartilhada pelo processo, criando-a na primeira chamada.
+
+    A criação carrega o modelo de embeddings e abre o Chroma, por isso deve ser feita fora da thread da interface.
+    Chamadas concorrentes durante o carregamento aguardam a mesma instância.
+    """
+    global _core_instance
+    if _core_instance is None:
+        with _core_lock:
+            if _core_instance is None:
+                _core_instance = CoderCore()
+    return _core_instance
+
+
+def core_is_loaded():
+    """
+    Indica se a instância compartilhada de CoderCore já foi criada.
+    """
+    return _core_instance is not None
+
+
+def process_llm_response(text, model, max_tokens, temperature, recursion_depth=0, max_recursion=1):
     """
     Processa a resposta do LLM para garantir que haja apenas um bloco de código.
     Adiciona comentários multilinha para descrição e observação.
+
+    Vários blocos são mesclados localmente (ver merge_code_blocks); o LLM só é chamado para sintetizá-los
+    se a mesclagem falhar e o orçamento da requisição permitir. Sem síntese, vale o último bloco válido.
     """
     # Encontrar todos os blocos de código Python
     code_blocks = re.findall(r'```python(.*?)```', text, re.DOTALL)
 
-    if len(code_blocks) > 1 and recursion_depth < max_recursion:
-        logging.info(f"{len(code_blocks)} blocos de código encontrados. Solicitando síntese ao LLM.")
+    if len(code_blocks) > 1:
+        merged = merge_code_blocks(code_blocks)
+        if merged is not None:
+            logging.info(f"{len(code_blocks)} blocos de código mesclados localmente.")
+            code_blocks = [merged]
+
+    if len(code_blocks) > 1 and recursion_depth < max_recursion and _can_call_llm():
+        logging.info(f"{len(code_blocks)} blocos de código não puderam ser mesclados. Solicitando síntese ao LLM.")
         synthesis_prompt = f"""
 A resposta fornecida contém múltiplos blocos de código. Por favor, sintetize todos os blocos de código abaixo em um único bloco de código funcional.
 
@@ -241,9 +1350,23 @@ python
 # Código sintetizado
 ```
 """
-        synthesized_response = make_api_call(model, synthesis_prompt, max_tokens, temperature)
-        return process_llm_response(synthesized_response, model, max_tokens, temperature, recursion_depth + 1, max_recursion)
-    elif len(code_blocks) == 1:
+        try:
+            with _span("merge"):
+                synthesized_response = make_api_call(
+                    model, synthesis_prompt, max_tokens, temperature, process=False, stage="merge"
+                )
+        except OllamaError as e:
+            logging.warning(f"Síntese dos blocos falhou ({str(e)}); usando o último bloco de código válido.")
+            code_blocks = [_last_valid_block(code_blocks)]
+        else:
+            return process_llm_response(
+                synthesized_response, model, max_tokens, temperature, recursion_depth + 1, max_recursion
+            )
+    elif len(code_blocks) > 1:
+        logging.info("Síntese indisponível; usando o último bloco de código válido.")
+        code_blocks = [_last_valid_block(code_blocks)]
+
+    if len(code_blocks) == 1:
         logging.info("Apenas um bloco de código encontrado. Adicionando comentários multilinha.")
         # Extrair o bloco de código
         code = code_blocks[0].strip()
@@ -271,6 +1394,15 @@ Nenhuma observação adicional.
         logging.info("Nenhum bloco de código encontrado na resposta.")
         return text
 
+def _last_valid_block(code_blocks):
+    for block in reversed(code_blocks):
+        try:
+            parse_python(textwrap.dedent(block))
+            return block
+        except (SyntaxError, ValueError):
+            continue
+    return code_blocks[-1]
+
 def extract_description(text):
     """
     Extrai a descrição do texto fornecido.
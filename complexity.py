@@ -0,0 +1,219 @@
+# complexity.py
+
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import threading
+
+# Termos que costumam indicar perguntas que exigem uma cadeia de pensamento longa. Cada termo é um trecho
+# de expressão regular casado como palavra inteira; radicais trazem o sufixo explícito (\w*), para que
+# "api" não case com "capital" nem "integr" com "integral".
+COMPLEX_KEYWORDS = [
+    r"arquitetura", r"refator\w*", r"otimiz\w*", r"desempenho", r"performance", r"algoritmos?", r"concorr\w*",
+    r"paralel\w*", r"threads?", r"assíncron\w*", r"async", r"banco de dados", r"integraç(?:ão|ões)",
+    r"integr(?:ar|e|a)", r"sistemas?", r"projete", r"implemente", r"implementar", r"crie uma classe",
+    r"múltipl\w*", r"escalab\w*", r"segurança", r"por que", r"porque", r"compare", r"explique como",
+    r"passo a passo", r"testes", r"apis?", r"design",
+]
+
+# Termos que costumam indicar perguntas pontuais, no mesmo formato
+SIMPLE_KEYWORDS = [
+    r"o que é", r"qual", r"quais", r"renomei\w*", r"renomear", r"mostre", r"imprima", r"print", r"olá", r"oi",
+    r"obrigad[oa]", r"corrija o erro de digitação", r"typo", r"adicione um comentário", r"formate", r"traduza",
+]
+
+
+def _keyword_re(keywords):
+    return re.compile(r"\b(?:" + "|".join(keywords) + r")\b")
+
+
+_COMPLEX_RE = _keyword_re(COMPLEX_KEYWORDS)
+_SIMPLE_RE = _keyword_re(SIMPLE_KEYWORDS)
+_CLAUSE_RE = re.compile(r",|;|\be\b|\band\b|\bdepois\b|\btambém\b")
+_CODE_RE = re.compile(r"```|\bdef |\bclass |\(\)")
+
+DEFAULT_WEIGHTS = {
+    "bias": -0.6,
+    "query_words": 1.2,
+    "code_lines": 0.5,
+    "complex_keywords": 1.1,
+    "simple_keywords": -1.3,
+    "questions": 0.3,
+    "clauses": 0.5,
+    "has_code": 0.4,
+}
+
+
+def _sigmoid(x):
+    if x < -60:
+        return 0.0
+    return 1.0 / (1.0 + math.exp(-x))
+
+
+def parse_llm_decision(resposta):
+    """
+    Interpreta a resposta do LLM ("Simples"/"Complexa"), tolerando pontuação, aspas e texto extra.
+
+    Returns:
+        bool: True para complexa, False para simples, None se não for possível decidir.
+    """
+    texto = resposta.strip().lower()
+    complexa = re.search(r"complex", texto)
+    simples = re.search(r"simple", texto)
+    if complexa and (not simples or complexa.start() < simples.start()):
+        return True
+    if simples:
+        return False
+    return None
+
+
+class ComplexityClassifier:
+    """
+    Classificador local da complexidade de uma pergunta, usado antes de recorrer ao LLM.
+
+    Calcula algumas características baratas da pergunta e do código atual e aplica uma regressão logística.
+    Os pesos padrão são ajustados à mão; fit() os reajusta a partir das decisões do LLM registradas em
+    log_path. Perguntas cuja probabilidade fica entre low e high são consideradas incertas.
+
+    Args:
+        weights (dict, opcional): Pesos por característica, incluindo "bias".
+        low (float): Abaixo desta probabilidade a pergunta é considerada simples com confiança.
+        high (float): Acima desta probabilidade a pergunta é considerada complexa com confiança.
+        log_path (str, opcional): Arquivo JSONL onde as decisões do LLM são registradas para treino.
+    """
+    def __init__(self, weights=None, low=0.25, high=0.75, log_path=None):
+        self.weights = dict(weights or DEFAULT_WEIGHTS)
+        self.low = low
+        self.high = high
+        self.log_path = log_path
+        self._log_lock = threading.Lock()
+
+    @staticmethod
+    def extract_features(pergunta, code_lines):
+        """
+        Extrai as características usadas pelo classificador.
+
+        Args:
+            pergunta (str): A pergunta do usuário.
+            code_lines (int): Número de linhas do código atual no editor.
+        """
+        texto = pergunta.lower()
+        palavras = texto.split()
+        return {
+            "query_words": min(len(palavras), 120) / 30.0,
+            "code_lines": math.log1p(code_lines) / 5.0,
+            "complex_keywords": float(len(set(_COMPLEX_RE.findall(texto)))),
+            "simple_keywords": float(len(_SIMPLE_RE.findall(texto))),
+            "questions": float(texto.count("?")),
+            "clauses": float(len(_CLAUSE_RE.findall(texto))) / 3.0,
+            "has_code": 1.0 if _CODE_RE.search(pergunta) else 0.0,
+        }
+
+    def predict_proba(self, features):
+        score = self.weights.get("bias", 0.0)
+        for name, value in features.items():
+            score += self.weights.get(name, 0.0) * value
+        return _sigmoid(score)
+
+    def classify(self, pergunta, code_lines):
+        """
+        Returns:
+            tuple: (decisão, probabilidade, características), onde decisão é True (complexa), False (simples)
+            ou None quando a confiança é baixa e o LLM deve ser consultado.
+        """
+        features = self.extract_features(pergunta, code_lines)
+        probabilidade = self.predict_proba(features)
+        if probabilidade >= self.high:
+            return True, probabilidade, features
+        if probabilidade <= self.low:
+            return False, probabilidade, features
+        return None, probabilidade, features
+
+    def log_decision(self, pergunta, code_lines, features, label, llm_seconds):
+        """
+        Registra uma decisão do LLM para treinar o classificador e para o benchmark.
+        """
+        if not self.log_path:
+            return
+        record = {
+            "pergunta": pergunta,
+            "code_lines": code_lines,
+            "features": features,
+            "label": label,
+            "llm_seconds": llm_seconds,
+        }
+        with self._log_lock:
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def fit(self, records, epochs=300, learning_rate=0.1, l2=0.001):
+        """
+        Ajusta os pesos por descida de gradiente sobre registros {"features": ..., "label": bool}.
+        """
+        records = [r for r in records if r.get("label") is not None]
+        if not records:
+            return self
+        names = sorted(records[0]["features"])
+        weights = {name: self.weights.get(name, 0.0) for name in names}
+        bias = self.weights.get("bias", 0.0)
+        for _ in range(epochs):
+            grad = {name: 0.0 for name in names}
+            grad_bias = 0.0
+            for record in records:
+                features = record["features"]
+                score = bias + sum(weights[name] * features.get(name, 0.0) for name in names)
+                erro = _sigmoid(score) - (1.0 if record["label"] else 0.0)
+                for name in names:
+                    grad[name] += erro * features.get(name, 0.0)
+                grad_bias += erro
+            for name in names:
+                weights[name] -= learning_rate * (grad[name] / len(records) + l2 * weights[name])
+            bias -= learning_rate * grad_bias / len(records)
+        self.weights = dict(weights, bias=bias)
+        return self
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"weights": self.weights, "low": self.low, "high": self.high}, f, indent=4)
+
+    @classmethod
+    def load(cls, path, log_path=None):
+        """
+        Carrega os pesos salvos em path, ou usa os pesos padrão se o arquivo não existir.
+        """
+        if not os.path.exists(path):
+            return cls(log_path=log_path)
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        logging.info(f"Pesos do classificador de complexidade carregados de {path}")
+        return cls(data["weights"], data.get("low", 0.25), data.get("high", 0.75), log_path=log_path)
+
+
+def load_records(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Treina o classificador de complexidade com decisões registradas.")
+    parser.add_argument("decisions", help="Arquivo JSONL com as decisões do LLM.")
+    parser.add_argument("--out", default="complexity_weights.json", help="Arquivo de saída dos pesos.")
+    parser.add_argument("--epochs", type=int, default=300)
+    args = parser.parse_args()
+
+    records = load_records(args.decisions)
+    classifier = ComplexityClassifier().fit(records, epochs=args.epochs)
+    classifier.save(args.out)
+    acertos = sum(
+        1 for r in records
+        if r.get("label") is not None and (classifier.predict_proba(r["features"]) >= 0.5) == r["label"]
+    )
+    print(f"{len(records)} decisões, concordância no treino: {acertos / max(len(records), 1):.1%}")
+    print(f"Pesos salvos em {args.out}")
+
+
+if __name__ == "__main__":
+    main()
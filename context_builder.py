@@ -0,0 +1,279 @@
+# context_builder.py
+
+import ast
+import hashlib
+import math
+import re
+
+from code_merge import parse_python
+
+# Orçamento de tokens do contexto (código, histórico, documentos) de cada etapa do pipeline,
+# sem contar a pergunta e as instruções fixas do prompt
+DEFAULT_STAGE_BUDGETS = {
+    "classify": 600,
+    "reason": 2000,
+    "answer": 1200,
+    "subquery": 1200,
+    "synthesize": 2000,
+    "single": 3000,
+    "code": 2000,
+    "modify": 3000,
+}
+
+_WORD_RE = re.compile(r"[A-Za-z_À-ú][A-Za-z0-9_À-ú]{2,}")
+
+# Palavras frequentes nas perguntas que não ajudam a localizar trechos de código
+_STOPWORDS = {
+    "que", "para", "com", "uma", "por", "como", "não", "mais", "the", "and", "for", "this", "that",
+    "código", "codigo", "função", "funcao", "classe", "método", "metodo", "arquivo", "fazer", "faça",
+    "quero", "preciso", "pode", "você", "esse", "essa", "este", "esta", "isso", "def", "class",
+}
+
+
+def estimate_tokens(text):
+    """
+    Estima o número de tokens de um texto (cerca de 4 caracteres por token nos modelos llama).
+    """
+    return (len(text) + 3) // 4
+
+
+def truncate_to_tokens(text, budget, keep="head"):
+    """
+    Corta o texto para caber em budget tokens, mantendo o início (keep="head") ou o fim (keep="tail").
+    """
+    if estimate_tokens(text) <= budget:
+        return text
+    limite = max(budget * 4 - 20, 0)
+    if keep == "tail":
+        return "[...]\n" + text[len(text) - limite:]
+    return text[:limite] + "\n[...]"
+
+
+def query_terms(query):
+    return {w.lower() for w in _WORD_RE.findall(query)} - _STOPWORDS
+
+
+def split_code_regions(code):
+    """
+    Divide código Python em regiões de nível superior (imports, funções, classes e demais instruções).
+    Classes grandes são divididas em cabeçalho e métodos.
+
+    Returns:
+        list: Tuplas (linha_inicial, linha_final, nome, é_cabeçalho) com índices base 0 e fim exclusivo,
+        ou None se o código não puder ser analisado.
+    """
+    try:
+        tree = parse_python(code)
+    except (SyntaxError, ValueError):
+        return None
+    lines = code.splitlines()
+    regions = []
+    for node in tree.body:
+        start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])]) - 1
+        end = node.end_lineno
+        is_header = isinstance(node, (ast.Import, ast.ImportFrom))
+        name = getattr(node, "name", "")
+        if isinstance(node, ast.ClassDef) and end - start > 60:
+            methods = [n for n in node.body if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))]
+            if methods:
+                first = min([methods[0].lineno] + [d.lineno for d in methods[0].decorator_list]) - 1
+                regions.append((start, first, name, True))
+                cursor = first
+                for method in methods:
+                    m_start = min([method.lineno] + [d.lineno for d in method.decorator_list]) - 1
+                    if any(line.strip() for line in lines[cursor:m_start]):
+                        regions.append((cursor, m_start, name, False))
+                    else:
+                        # Linhas em branco entre métodos acompanham o método seguinte
+                        m_start = cursor
+                    regions.append((m_start, method.end_lineno, f"{name}.{method.name}", False))
+                    cursor = method.end_lineno
+                if end > cursor:
+                    regions.append((cursor, end, name, False))
+                continue
+        regions.append((start, end, name, is_header))
+    return regions
+
+
+def select_code_regions(code, query, budget):
+    """
+    Seleciona as partes do código mais relevantes para a pergunta dentro de budget tokens.
+
+    O código inteiro é devolvido se couber. Caso contrário, as regiões são ranqueadas pela presença dos
+    termos da pergunta (com peso maior para o nome da função ou classe), os imports são sempre mantidos,
+    e as regiões escolhidas aparecem na ordem original com marcadores das linhas omitidas.
+    """
+    if estimate_tokens(code) <= budget:
+        return code
+    lines = code.splitlines()
+    regions = split_code_regions(code)
+    terms = query_terms(query)
+    if regions is None:
+        return _select_line_windows(lines, terms, budget)
+
+    def score(region):
+        start, end, name, _ = region
+        texto = "\n".join(lines[start:end]).lower()
+        nome = name.lower()
+        hits = sum(1 for t in terms if t in texto)
+        name_hits = sum(1 for t in terms if nome and t in nome)
+        # Citar a função ou o método pelo nome exato é o sinal mais forte de relevância
+        exact = 1 if nome and nome.split(".")[-1] in terms else 0
+        return hits / math.sqrt(max(end - start, 1)) + name_hits + 5 * exact
+
+    chosen = set()
+    remaining = int(budget * 0.9)  # Reserva para os marcadores de linhas omitidas
+    headers = [r for r in regions if r[3]]
+    ranked = sorted((r for r in regions if not r[3]), key=score, reverse=True)
+    for region in headers + ranked:
+        custo = estimate_tokens("\n".join(lines[region[0]:region[1]])) + 1
+        if custo <= remaining:
+            chosen.add(region)
+            remaining -= custo
+    if not chosen:
+        return truncate_to_tokens(code, budget)
+
+    partes = []
+    ultima = 0
+    for start, end, _, _ in sorted(chosen):
+        if start > ultima and any(line.strip() for line in lines[ultima:start]):
+            partes.append(f"# ... (linhas {ultima + 1}-{start} omitidas)")
+        elif start > ultima:
+            partes.extend(lines[ultima:start])
+        partes.extend(lines[start:end])
+        ultima = end
+    if ultima < len(lines):
+        partes.append(f"# ... (linhas {ultima + 1}-{len(lines)} omitidas)")
+    return "\n".join(partes)
+
+
+def _select_line_windows(lines, terms, budget, radius=8):
+    """
+    Alternativa para código que não pode ser analisado: janelas de linhas em torno das ocorrências dos termos.
+    """
+    hits = [i for i, line in enumerate(lines) if any(t in line.lower() for t in terms)]
+    if not hits:
+        return truncate_to_tokens("\n".join(lines), budget)
+    keep = set()
+    remaining = budget
+    for i in hits:
+        janela = [j for j in range(max(i - radius, 0), min(i + radius + 1, len(lines))) if j not in keep]
+        custo = sum(estimate_tokens(lines[j]) + 1 for j in janela)
+        if custo > remaining:
+            break
+        keep.update(janela)
+        remaining -= custo
+    partes = []
+    anterior = -1
+    for j in sorted(keep):
+        if j > anterior + 1:
+            partes.append("# ...")
+        partes.append(lines[j])
+        anterior = j
+    if anterior < len(lines) - 1:
+        partes.append("# ...")
+    return "\n".join(partes)
+
+
+def fit_history(messages, budget):
+    """
+    Mantém as mensagens mais recentes que cabem em budget tokens e indica quantas foram omitidas.
+    Uma mensagem recente grande demais é truncada em vez de descartada.
+    """
+    selecionadas = []
+    remaining = budget
+    for message in reversed(messages):
+        custo = estimate_tokens(message) + 1
+        if custo > remaining:
+            if not selecionadas and remaining > 20:
+                selecionadas.append(truncate_to_tokens(message, remaining - 1, keep="tail"))
+            break
+        selecionadas.append(message)
+        remaining -= custo
+    selecionadas.reverse()
+    omitidas = len(messages) - len(selecionadas)
+    if omitidas > 0:
+        selecionadas.insert(0, f"[{omitidas} mensagens anteriores omitidas]")
+    return "\n".join(selecionadas)
+
+
+def fit_documents(texts, budget, separator="\n---\n"):
+    """
+    Inclui documentos inteiros, na ordem de relevância, enquanto couberem em budget tokens.
+    """
+    selecionados = []
+    remaining = budget
+    for texto in texts:
+        custo = estimate_tokens(texto) + estimate_tokens(separator)
+        if custo > remaining:
+            continue
+        selecionados.append(texto)
+        remaining -= custo
+    return separator.join(selecionados)
+
+
+def dedupe_documents(documents, exclude_text=""):
+    """
+    Remove trechos recuperados repetidos (mesmo conteúdo normalizado) ou já presentes em exclude_text.
+    """
+    vistos = set()
+    unicos = []
+    for document in documents:
+        texto = getattr(document, "page_content", document).strip()
+        chave = hashlib.sha1(" ".join(texto.split()).encode("utf-8")).hexdigest()
+        if not texto or chave in vistos or (exclude_text and texto in exclude_text):
+            continue
+        vistos.add(chave)
+        unicos.append(texto)
+    return unicos
+
+
+class ContextBuilder:
+    """
+    Monta as seções de contexto de um prompt dentro de um orçamento de tokens, por ordem de prioridade.
+
+    Cada seção recebe o que sobra do orçamento depois das seções de prioridade maior (número menor);
+    seções que não cabem são ajustadas pelo seu próprio redutor ou omitidas.
+
+    Args:
+        budget (int): Orçamento total de tokens das seções.
+    """
+    def __init__(self, budget):
+        self.budget = budget
+        self._sections = []
+
+    def add(self, name, priority, text=None, fit=None, min_tokens=30, max_tokens=None):
+        """
+        Adiciona uma seção.
+
+        Args:
+            name (str): Nome da seção no resultado de build().
+            priority (int): Prioridade; números menores são preenchidos primeiro.
+            text (str, opcional): Texto da seção, truncado pelo fim se não couber.
+            fit (callable, opcional): Recebe o orçamento restante e devolve o texto ajustado a ele;
+                usado no lugar de text para seções com redução específica (código, histórico).
+            min_tokens (int): Abaixo deste orçamento restante a seção é omitida.
+            max_tokens (int, opcional): Limite da seção, para deixar espaço às de prioridade menor.
+        """
+        self._sections.append((priority, len(self._sections), name, text, fit, min_tokens, max_tokens))
+        return self
+
+    def build(self):
+        """
+        Returns:
+            dict: Nome da seção -> texto ajustado ("" para seções omitidas).
+        """
+        resultado = {}
+        remaining = self.budget
+        for _, _, name, text, fit, min_tokens, max_tokens in sorted(self._sections, key=lambda s: s[:2]):
+            disponivel = remaining if max_tokens is None else min(remaining, max_tokens)
+            if disponivel < min_tokens:
+                resultado[name] = ""
+                continue
+            if fit is not None:
+                ajustado = fit(disponivel)
+            else:
+                ajustado = truncate_to_tokens(text or "", disponivel)
+            resultado[name] = ajustado
+            remaining -= estimate_tokens(ajustado)
+        return resultado
@@ -0,0 +1,383 @@
+# edit_history.py
+
+import base64
+import time
+import zlib
+from collections import deque
+
+from code_patch import compute_edits
+
+KIND_TYPING = "typing"
+KIND_AI = "ai"
+KIND_OTHER = "other"
+
+_STEP_OVERHEAD = 120  # Bytes estimados por passo além dos textos (objeto, tuplas, rótulo)
+
+
+def _common_prefix(a, b):
+    """
+    Comprimento do prefixo comum, comparando blocos inteiros antes de procurar o caractere divergente.
+    """
+    n = min(len(a), len(b))
+    i = 0
+    step = 4096
+    while i < n and a[i:i + step] == b[i:i + step]:
+        i += step
+    if i >= n:
+        return n
+    lo, hi = i, min(i + step, n)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[i:mid] == b[i:mid]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def _common_suffix(a, b, limit):
+    """
+    Comprimento do sufixo comum, sem invadir os primeiros limit caracteres de nenhum dos textos.
+    """
+    n = min(len(a), len(b)) - limit
+    i = 0
+    step = 4096
+    while i < n and a[len(a) - min(i + step, n):len(a) - i] == b[len(b) - min(i + step, n):len(b) - i]:
+        i = min(i + step, n)
+    if i >= n:
+        return n
+    lo, hi = i, min(i + step, n)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if a[len(a) - mid:len(a) - i] == b[len(b) - mid:len(b) - i]:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def diff_span(old, new):
+    """
+    Menor trecho contíguo que transforma old em new.
+
+    Returns:
+        tuple: (início, fim em old, fim em new).
+    """
+    prefix = _common_prefix(old, new)
+    suffix = _common_suffix(old, new, prefix)
+    return prefix, len(old) - suffix, len(new) - suffix
+
+
+def apply_delta(text, delta):
+    """
+    Aplica uma lista de edições (início, fim, substituição), em ordem crescente de posição, a text.
+    """
+    partes = []
+    cursor = 0
+    for start, end, replacement in delta:
+        partes.append(text[cursor:start])
+        partes.append(replacement)
+        cursor = end
+    partes.append(text[cursor:])
+    return "".join(partes)
+
+
+def _delta_size(delta):
+    return sum(len(replacement) + 16 for _, _, replacement in delta)
+
+
+class EditStep:
+    """
+    Um passo do histórico: as edições que levam ao estado seguinte (forward) e de volta (backward).
+    """
+    __slots__ = ("kind", "label", "forward", "backward", "created", "updated", "keyframe", "size")
+
+    def __init__(self, kind, label, forward, backward):
+        self.kind = kind
+        self.label = label
+        self.forward = forward
+        self.backward = backward
+        self.created = self.updated = time.monotonic()
+        self.keyframe = None  # Texto completo, comprimido, do estado após este passo
+        self.size = 0
+        self.resize()
+
+    def resize(self):
+        self.size = _STEP_OVERHEAD + _delta_size(self.forward) + _delta_size(self.backward)
+        if self.keyframe is not None:
+            self.size += len(self.keyframe)
+
+    def to_dict(self):
+        return {
+            "kind": self.kind,
+            "label": self.label,
+            "forward": self.forward,
+            "backward": self.backward,
+            "keyframe": base64.b64encode(self.keyframe).decode("ascii") if self.keyframe is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        step = cls(
+            data["kind"], data["label"],
+            [tuple(edit) for edit in data["forward"]], [tuple(edit) for edit in data["backward"]],
+        )
+        # Passos restaurados nunca se fundem com a próxima tecla
+        step.created = step.updated = 0.0
+        if data.get("keyframe"):
+            step.keyframe = base64.b64decode(data["keyframe"])
+            step.resize()
+        return step
+
+
+class EditHistory:
+    """
+    Histórico de desfazer/refazer do editor de código baseado em diferenças.
+
+    Cada passo guarda só as edições entre um estado e o seguinte. Teclas digitadas em sequência, em posições
+    adjacentes, são agrupadas em um único passo; edições da IA são sempre passos próprios e rotulados.
+    A cada keyframe_interval passos o estado completo é guardado comprimido, para reconstruir estados
+    distantes sem reaplicar todo o histórico. Os passos mais antigos são descartados quando o total
+    estimado ultrapassa byte_budget.
+
+    Args:
+        text (str): Texto inicial do editor.
+        byte_budget (int): Memória máxima estimada do histórico, em bytes.
+        keyframe_interval (int): Passos entre estados completos guardados.
+        coalesce_seconds (float): Intervalo máximo entre teclas agrupadas no mesmo passo.
+    """
+    def __init__(self, text="", byte_budget=4 * 1024 * 1024, keyframe_interval=200, coalesce_seconds=1.0):
+        self.byte_budget = byte_budget
+        self.keyframe_interval = keyframe_interval
+        self.coalesce_seconds = coalesce_seconds
+        self.revision = 0  # Muda a cada alteração, para a sessão só salvar o histórico quando preciso
+        self.reset(text)
+
+    def reset(self, text=""):
+        self.revision += 1
+        self.current = text
+        self._undo = deque()
+        self._redo = []
+        self._bytes = 0
+        self._since_keyframe = 0
+        self._group_open = False
+
+    @property
+    def bytes_used(self):
+        return self._bytes
+
+    def can_undo(self):
+        return bool(self._undo)
+
+    def can_redo(self):
+        return bool(self._redo)
+
+    def undo_label(self):
+        return self._undo[-1].label if self._undo else None
+
+    def redo_label(self):
+        return self._redo[-1].label if self._redo else None
+
+    def labels(self):
+        """
+        Rótulos dos passos que podem ser desfeitos, do mais antigo ao mais recente.
+        """
+        return [step.label for step in self._undo]
+
+    def record(self, text, kind=KIND_TYPING, label=None):
+        """
+        Registra o novo texto do editor como um passo (ou o acrescenta ao grupo de digitação aberto).
+
+        Returns:
+            bool: False se o texto não mudou.
+        """
+        old = self.current
+        if text == old:
+            return False
+        if kind == KIND_TYPING:
+            start, old_end, new_end = diff_span(old, text)
+            forward = [(start, old_end, text[start:new_end])]
+            backward = [(start, new_end, old[start:old_end])]
+        else:
+            # Edições da IA costumam tocar várias regiões; diferenças por linha mantêm o passo pequeno
+            forward = compute_edits(old, text)
+            backward = compute_edits(text, old)
+        # Os passos desfeitos continuam contados em _bytes até serem descartados
+        self._bytes -= sum(step.size for step in self._redo)
+        self._redo.clear()
+        self.current = text
+        self.revision += 1
+
+        last = self._undo[-1] if self._undo else None
+        if kind == KIND_TYPING and self._group_open and last is not None and self._coalesce(last, forward, old):
+            return True
+
+        step = EditStep(kind, label or self._default_label(kind), forward, backward)
+        self._push(step)
+        # Edições da IA e de outras origens são atômicas: a próxima tecla começa um novo grupo
+        self._group_open = kind == KIND_TYPING
+        return True
+
+    def break_group(self):
+        """
+        Fecha o grupo de digitação atual, por exemplo ao mover o cursor para outro lugar.
+        """
+        self._group_open = False
+
+    def _default_label(self, kind):
+        return {KIND_TYPING: "Digitação", KIND_AI: "Edição da IA"}.get(kind, "Edição")
+
+    def _coalesce(self, last, forward, before):
+        """
+        Funde uma edição de digitação ao último passo se ela for contígua e vier logo em seguida.
+
+        Args:
+            before (str): Texto anterior à nova edição (posterior ao último passo).
+        """
+        if last.kind != KIND_TYPING or len(last.forward) != 1:
+            return False
+        agora = time.monotonic()
+        if agora - last.updated > self.coalesce_seconds:
+            return False
+        s1, e1, t1 = last.forward[0]
+        _, _, bt1 = last.backward[0]
+        s2, e2, t2 = forward[0]
+        fim1 = s1 + len(t1)  # Fim do trecho do último passo no texto intermediário
+        if s2 > fim1 or e2 < s1:
+            return False
+        lo = min(s1, s2)
+        hi_b = max(fim1, e2)  # Fim da região combinada no texto intermediário
+        hi_a = hi_b - (len(t1) - (e1 - s1))  # ...no texto anterior ao último passo
+        hi_c = hi_b + (len(t2) - (e2 - s2))  # ...no texto atual
+        antes = before[lo:s1] + bt1 + before[fim1:hi_b]
+        depois = self.current[lo:hi_c]
+        self._bytes -= last.size
+        last.forward = [(lo, hi_a, depois)]
+        last.backward = [(lo, lo + len(depois), antes)]
+        last.updated = agora
+        if last.keyframe is not None:
+            # Recomprimir a cada tecla sairia caro; o keyframe passa para o próximo passo
+            last.keyframe = None
+            self._since_keyframe = self.keyframe_interval - 1
+        last.resize()
+        self._bytes += last.size
+        self._trim()
+        return True
+
+    def _push(self, step):
+        self._since_keyframe += 1
+        if self._since_keyframe >= self.keyframe_interval:
+            step.keyframe = zlib.compress(self.current.encode("utf-8"))
+            step.resize()
+            self._since_keyframe = 0
+        self._undo.append(step)
+        self._bytes += step.size
+        self._trim()
+
+    def _trim(self):
+        # Sempre mantém o último passo, mesmo que sozinho ultrapasse o orçamento
+        while self._bytes > self.byte_budget and len(self._undo) > 1:
+            self._bytes -= self._undo.popleft().size
+        while self._bytes > self.byte_budget and self._redo:
+            self._bytes -= self._redo.pop(0).size
+
+    def sync(self, text):
+        """
+        Registra como edição alterações do editor que não passaram por record().
+        """
+        if text != self.current:
+            self.record(text, kind=KIND_OTHER)
+
+    def undo(self, text=None, steps=1):
+        """
+        Desfaz até steps passos.
+
+        Args:
+            text (str, opcional): Texto atual do editor, registrado antes se tiver mudado sem record().
+
+        Returns:
+            str: O texto resultante, ou None se não houver o que desfazer.
+        """
+        if text is not None:
+            self.sync(text)
+        if not self._undo:
+            return None
+        steps = min(steps, len(self._undo))
+        target = self.text_at(len(self._undo) - 1 - steps) if steps > 1 else None
+        for _ in range(steps):
+            step = self._undo.pop()
+            if target is None:
+                self.current = apply_delta(self.current, step.backward)
+            self._redo.append(step)
+        if target is not None:
+            self.current = target
+        self._group_open = False
+        self.revision += 1
+        return self.current
+
+    def redo(self, text=None):
+        """
+        Refaz o último passo desfeito.
+
+        Returns:
+            str: O texto resultante, ou None se não houver o que refazer.
+        """
+        if text is not None and text != self.current:
+            # O editor mudou depois do desfazer; os passos desfeitos não se aplicam mais
+            self.record(text, kind=KIND_OTHER)
+            return None
+        if not self._redo:
+            return None
+        step = self._redo.pop()
+        self.current = apply_delta(self.current, step.forward)
+        self._undo.append(step)
+        self._group_open = False
+        self.revision += 1
+        return self.current
+
+    def text_at(self, index):
+        """
+        Reconstrói o texto após o passo index da pilha de desfazer (-1 para o estado anterior a todos),
+        partindo do keyframe mais próximo à frente ou do estado atual.
+        """
+        top = len(self._undo) - 1
+        if not -1 <= index <= top:
+            raise IndexError(index)
+        origem, texto = top, self.current
+        for i in range(index + 1, top + 1):
+            if self._undo[i].keyframe is not None:
+                origem, texto = i, zlib.decompress(self._undo[i].keyframe).decode("utf-8")
+                break
+        for i in range(origem, index, -1):
+            texto = apply_delta(texto, self._undo[i].backward)
+        return texto
+
+    def to_dict(self):
+        """
+        Estado serializável do histórico. O texto atual não é incluído, apenas sua soma de verificação,
+        pois a sessão já o guarda.
+        """
+        return {
+            "checksum": zlib.crc32(self.current.encode("utf-8")),
+            "since_keyframe": self._since_keyframe,
+            "undo": [step.to_dict() for step in self._undo],
+            "redo": [step.to_dict() for step in self._redo],
+        }
+
+    @classmethod
+    def from_dict(cls, data, text, **kwargs):
+        """
+        Restaura um histórico salvo com to_dict() sobre o texto atual do editor.
+
+        Raises:
+            ValueError: Se o texto não for o mesmo de quando o histórico foi salvo.
+        """
+        if zlib.crc32(text.encode("utf-8")) != data.get("checksum"):
+            raise ValueError("O histórico de edições não corresponde ao código salvo.")
+        history = cls(text, **kwargs)
+        history._undo = deque(EditStep.from_dict(step) for step in data.get("undo", []))
+        history._redo = [EditStep.from_dict(step) for step in data.get("redo", [])]
+        history._bytes = sum(step.size for step in history._undo) + sum(step.size for step in history._redo)
+        history._since_keyframe = data.get("since_keyframe", 0)
+        history._trim()
+        return history
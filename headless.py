@@ -0,0 +1,386 @@
+# headless.py
+#
+# Executa o CoderCore sem a interface gráfica, em lote ou como servidor HTTP local.
+#
+#   python headless.py batch perguntas.jsonl --out respostas.jsonl --concurrency 4
+#   python headless.py serve --port 8765 --workers 4 --queue 32
+#
+# Cada linha do lote (e o corpo de POST /v1/query) é um objeto JSON com "query" e, opcionalmente,
+# "id", "history" (textos ou {"role", "content"}), "code", "mode" e "timeout" (segundos).
+# Com --ollama-url, o LLM usa outro servidor Ollama, como o falso de benchmarks/fake_ollama.py.
+
+import argparse
+import json
+import logging
+import os
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+STATUS_OK = "ok"
+STATUS_ERROR = "error"
+STATUS_TIMEOUT = "timeout"
+STATUS_BUDGET = "budget"
+STATUS_CANCELLED = "cancelled"
+
+
+class RequestError(ValueError):
+    """
+    Requisição malformada (campo ausente ou de tipo errado).
+    """
+
+
+def parse_request(data):
+    """
+    Valida uma requisição do lote ou do servidor e preenche os campos opcionais.
+    """
+    if not isinstance(data, dict):
+        raise RequestError("A requisição deve ser um objeto JSON.")
+    query = data.get("query")
+    if not isinstance(query, str) or not query.strip():
+        raise RequestError('O campo "query" é obrigatório.')
+    history = data.get("history") or []
+    code = data.get("code") or ""
+    if not isinstance(history, list) or not isinstance(code, str):
+        raise RequestError('"history" deve ser uma lista e "code", um texto.')
+    for i, item in enumerate(history):
+        if isinstance(item, str):
+            continue
+        if not isinstance(item, dict) or not all(isinstance(item.get(key), str) for key in ("role", "content")):
+            raise RequestError(f'O item {i} de "history" deve ser um texto ou um objeto com "role" e "content".')
+    timeout = data.get("timeout")
+    if timeout is not None and (not isinstance(timeout, (int, float)) or timeout <= 0):
+        raise RequestError('"timeout" deve ser um número positivo de segundos.')
+    return {
+        "id": data.get("id"),
+        "query": query,
+        "history": history,
+        "code": code,
+        "mode": data.get("mode"),
+        "timeout": timeout,
+    }
+
+
+class HeadlessEngine:
+    """
+    Executa consultas no CoderCore compartilhado do processo, uma por thread, cada uma com seu próprio
+    RequestContext (orçamento, tempo máximo e cancelamento).
+
+    Args:
+        core (CoderCore, opcional): Núcleo a usar; o padrão é get_coder_core().
+        timeout (float): Tempo máximo padrão de cada requisição, em segundos.
+    """
+    def __init__(self, core=None, timeout=300.0):
+        if core is None:
+            from coder_core import get_coder_core
+            core = get_coder_core()
+        self.core = core
+        self.timeout = timeout
+
+    def warm_up(self):
+        health = self.core.warm_up()
+        logging.info(f"CoderCore pronto: {health}")
+        return health
+
+    def new_context(self, request):
+        from coder_core import RequestContext
+
+        return RequestContext(
+            max_llm_calls=self.core.max_llm_calls, max_seconds=request.get("timeout") or self.timeout
+        )
+
+    def run(self, request, context=None):
+        """
+        Executa uma requisição já validada por parse_request.
+
+        Returns:
+            dict: "id", "status" (ok, error, timeout, budget ou cancelled), "answer", "steps", "code", "error",
+            "seconds", os contadores de chamadas ao LLM, os spans por etapa, as chamadas ao LLM com a rota
+            e o modelo usados e o relatório do grafo de etapas ("schedule", com o caminho crítico). Falhas do
+            Ollama trazem também "error_type" (o nome da subclasse de OllamaError).
+        """
+        from chat_history import ChatMessage
+        from coder_core import CallLimitExceeded, DeadlineExceeded, RequestCancelled
+        from ollama_pool import OllamaError
+
+        context = context if context is not None else self.new_context(request)
+        result = {"id": request.get("id"), "status": STATUS_OK, "answer": None, "steps": [], "code": None,
+                  "error": None}
+        inicio = time.perf_counter()
+        try:
+            history = [ChatMessage.from_dict(m) if isinstance(m, dict) else str(m) for m in request["history"]]
+            answer, steps, code = self.core.run_pipeline(
+                request["query"], history, request["code"], context=context, mode=request.get("mode")
+            )
+            result.update(answer=answer, steps=steps, code=code)
+        except DeadlineExceeded as e:
+            result.update(status=STATUS_TIMEOUT, error=str(e))
+        except CallLimitExceeded as e:
+            result.update(status=STATUS_BUDGET, error=str(e))
+        except RequestCancelled:
+            result.update(status=STATUS_CANCELLED, error="Requisição cancelada.")
+        except OllamaError as e:
+            logging.error(f"Falha no Ollama: {str(e)}")
+            result.update(status=STATUS_ERROR, error=str(e), error_type=type(e).__name__)
+        except Exception as e:
+            logging.error(f"Erro no pipeline: {str(e)}")
+            result.update(status=STATUS_ERROR, error=str(e))
+        result["seconds"] = time.perf_counter() - inicio
+        result["counters"] = dict(context.counters)
+        summary = context.trace.summary()
+        result["spans"] = summary["spans"]
+        result["calls"] = summary["calls"]
+        result["schedule"] = summary["schedule"]
+        return result
+
+
+def run_batch(engine, lines, out, concurrency=4):
+    """
+    Processa as requisições de lines (texto JSONL) com até concurrency em paralelo, gravando cada
+    resultado em out assim que fica pronto (fora da ordem de entrada; "line" indica a linha de origem).
+
+    Returns:
+        dict: Totais por estado, tempo total e vazão em requisições por segundo.
+    """
+    totals = {STATUS_OK: 0, STATUS_ERROR: 0, STATUS_TIMEOUT: 0, STATUS_BUDGET: 0, STATUS_CANCELLED: 0}
+    inicio = time.perf_counter()
+
+    def write(result):
+        totals[result["status"]] += 1
+        out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        out.flush()
+
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch") as executor:
+        running = {}
+        for number, line in enumerate(lines, start=1):
+            if not line.strip():
+                continue
+            try:
+                request = parse_request(json.loads(line))
+            except ValueError as e:
+                write({"id": None, "line": number, "status": STATUS_ERROR, "error": str(e)})
+                continue
+            # Só lê a próxima linha quando há vaga, para não carregar o arquivo inteiro em memória
+            while len(running) >= concurrency:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(dict(future.result(), line=running.pop(future)))
+            running[executor.submit(engine.run, request)] = number
+        for future in list(running):
+            write(dict(future.result(), line=running.pop(future)))
+
+    total = sum(totals.values())
+    seconds = time.perf_counter() - inicio
+    return dict(totals, total=total, seconds=seconds, per_second=total / seconds if seconds else 0.0)
+
+
+class _Job:
+    def __init__(self, request, context):
+        self.request = request
+        self.context = context
+        self.result = None
+        self.done = threading.Event()
+
+
+class QueryServer(ThreadingHTTPServer):
+    """
+    Servidor HTTP/JSON local sobre um HeadlessEngine.
+
+    As requisições entram em uma fila limitada atendida por workers threads. Com a fila cheia, a resposta
+    é 503 com Retry-After (contrapressão) em vez de acumular conexões. Cada requisição tem um tempo
+    máximo: ao esgotá-lo a resposta é 504 e o pipeline é cancelado na próxima verificação. O limite de
+    chamadas ao LLM esgotado responde 429. Falhas do Ollama respondem 502, ou 503 quando todos os
+    servidores estão com o circuito aberto.
+
+    Rotas:
+        POST /v1/query: executa uma consulta (ver parse_request).
+        GET /health: saúde do núcleo e contadores da fila.
+        GET /metrics: métricas por etapa no formato de texto do Prometheus.
+
+    Args:
+        address (tuple): (host, porta).
+        engine (HeadlessEngine): Motor compartilhado pelas requisições.
+        workers (int): Consultas executadas ao mesmo tempo.
+        queue_size (int): Consultas que podem aguardar na fila.
+    """
+    daemon_threads = True
+
+    def __init__(self, address, engine, workers=4, queue_size=32):
+        super().__init__(address, _QueryHandler)
+        self.engine = engine
+        self.jobs = queue.Queue(maxsize=queue_size)
+        self.stats = {"accepted": 0, "rejected": 0, "completed": 0, "timeouts": 0, "running": 0}
+        self._stats_lock = threading.Lock()
+        self._workers = [
+            threading.Thread(target=self._work, name=f"query-{i}", daemon=True) for i in range(workers)
+        ]
+        for worker in self._workers:
+            worker.start()
+
+    def count(self, name, delta=1):
+        with self._stats_lock:
+            self.stats[name] += delta
+
+    def _work(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            self.count("running")
+            try:
+                if job.context.is_cancelled():
+                    # O cliente já recebeu 504 enquanto a consulta esperava na fila
+                    continue
+                job.result = self.engine.run(job.request, job.context)
+                self.count("completed")
+            except Exception as e:
+                # Uma falha fora do pipeline não pode derrubar o worker
+                logging.error(f"Erro ao executar a consulta: {str(e)}")
+                job.result = {"id": job.request.get("id"), "status": STATUS_ERROR, "error": str(e)}
+            finally:
+                self.count("running", -1)
+                job.done.set()
+
+    def submit(self, request):
+        """
+        Enfileira uma requisição e espera seu resultado até o tempo máximo dela.
+
+        Returns:
+            tuple: (código HTTP, corpo da resposta).
+        """
+        job = _Job(request, self.engine.new_context(request))
+        try:
+            self.jobs.put_nowait(job)
+        except queue.Full:
+            self.count("rejected")
+            return 503, {"error": "Fila cheia; tente novamente em instantes."}
+        self.count("accepted")
+        timeout = request.get("timeout") or self.engine.timeout
+        if not job.done.wait(timeout):
+            job.context.cancel()
+            self.count("timeouts")
+            return 504, {"id": request.get("id"), "error": f"Tempo máximo de {timeout}s esgotado."}
+        if job.result is None:
+            # O worker terminou sem resultado (por exemplo, a consulta foi cancelada ainda na fila)
+            return 500, {"id": request.get("id"), "error": "A consulta terminou sem resultado."}
+        status = {STATUS_OK: 200, STATUS_TIMEOUT: 504, STATUS_BUDGET: 429, STATUS_CANCELLED: 504}.get(
+            job.result["status"], 500
+        )
+        if "error_type" in job.result:
+            status = 503 if job.result["error_type"] == "OllamaUnavailable" else 502
+        return status, job.result
+
+    def health(self):
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["queued"] = self.jobs.qsize()
+        return {"core": self.engine.core.health_check(), "queue": stats}
+
+    def server_close(self):
+        for _ in self._workers:
+            self.jobs.put(None)
+        super().server_close()
+
+
+class _QueryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body, headers=None, content_type="application/json; charset=utf-8"):
+        data = body.encode("utf-8") if isinstance(body, str) else json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send(200, self.server.health())
+        elif self.path == "/metrics":
+            from telemetry import get_telemetry
+
+            self._send(200, get_telemetry().render_prometheus(), content_type="text/plain; version=0.0.4")
+        else:
+            self._send(404, {"error": "Rota não encontrada."})
+
+    def do_POST(self):
+        if self.path != "/v1/query":
+            self._send(404, {"error": "Rota não encontrada."})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = parse_request(json.loads(self.rfile.read(length) or b"null"))
+        except ValueError as e:
+            self._send(400, {"error": str(e)})
+            return
+        status, body = self.server.submit(request)
+        self._send(status, body, {"Retry-After": "1"} if status == 503 else None)
+
+    def log_message(self, format, *args):
+        logging.info(f"{self.address_string()} {format % args}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Executa o CoderCore sem a interface gráfica.")
+    parser.add_argument(
+        "--ollama-url", help="Servidor(es) Ollama a usar, separados por vírgula (por exemplo, falsos para testes)."
+    )
+    parser.add_argument("--timeout", type=float, default=300.0, help="Tempo máximo padrão por requisição.")
+    parser.add_argument("--no-warm-up", action="store_true", help="Não aquece os modelos antes de começar.")
+    parser.add_argument("--telemetry", help="Arquivo JSONL que recebe os spans de cada requisição.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    batch = commands.add_parser("batch", help="Processa um arquivo JSONL de perguntas.")
+    batch.add_argument("input", help="Arquivo JSONL de entrada ('-' para a entrada padrão).")
+    batch.add_argument("--out", help="Arquivo JSONL de saída (padrão: saída padrão).")
+    batch.add_argument("--concurrency", type=int, default=4, help="Requisições simultâneas.")
+
+    serve = commands.add_parser("serve", help="Servidor HTTP/JSON local.")
+    serve.add_argument("--host", default="127.0.0.1")
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("--workers", type=int, default=4, help="Consultas executadas ao mesmo tempo.")
+    serve.add_argument("--queue", type=int, default=32, help="Consultas que podem aguardar na fila.")
+    args = parser.parse_args(argv)
+
+    if args.ollama_url:
+        # Lido por coder_core ao ser importado
+        os.environ["OLLAMA_BASE_URL"] = args.ollama_url
+    if args.telemetry:
+        from telemetry import Telemetry, set_telemetry
+
+        set_telemetry(Telemetry(args.telemetry))
+    engine = HeadlessEngine(timeout=args.timeout)
+    if not args.no_warm_up:
+        engine.warm_up()
+
+    if args.command == "batch":
+        source = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+        out = open(args.out, "w", encoding="utf-8") if args.out else sys.stdout
+        try:
+            summary = run_batch(engine, source, out, concurrency=args.concurrency)
+        finally:
+            if source is not sys.stdin:
+                source.close()
+            if out is not sys.stdout:
+                out.close()
+        print(json.dumps(summary), file=sys.stderr)
+        return 0 if summary[STATUS_OK] == summary["total"] else 1
+
+    server = QueryServer((args.host, args.port), engine, workers=args.workers, queue_size=args.queue)
+    logging.info(f"Servidor em http://{args.host}:{server.server_address[1]} ({args.workers} workers)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
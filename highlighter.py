@@ -0,0 +1,161 @@
+# highlighter.py
+
+import keyword
+import re
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtGui import QColor, QFont, QSyntaxHighlighter, QTextCharFormat
+
+# Estado de cada bloco (linha): os 2 bits baixos indicam a string de três aspas aberta no fim da linha,
+# os demais a profundidade de parênteses, colchetes e chaves ainda abertos (zerada a cada instrução de nível
+# superior, ver _TOP_LEVEL_RE).
+STATE_NORMAL = 0
+STATE_TRIPLE_DOUBLE = 1
+STATE_TRIPLE_SINGLE = 2
+STATE_PENDING = -2  # Bloco ainda não destacado (ver PythonHighlighter.defer)
+_MAX_DEPTH = 1 << 20
+
+# Início de uma instrução de nível superior (sem indentação), que não pode estar dentro de um parêntese aberto
+_TOP_LEVEL_RE = re.compile(r"@|(?:def|class|async|import|from|if|elif|else|for|while|with|try|except|finally)\b")
+
+_TRIPLE_STATES = {'"""': STATE_TRIPLE_DOUBLE, "'''": STATE_TRIPLE_SINGLE}
+
+# Fim de uma string de três aspas, ignorando aspas escapadas
+_TRIPLE_END = {
+    STATE_TRIPLE_DOUBLE: re.compile(r'(?:[^"\\]|\\.|"(?!""))*"""'),
+    STATE_TRIPLE_SINGLE: re.compile(r"(?:[^'\\]|\\.|'(?!''))*'''"),
+}
+
+KEYWORDS = sorted(set(keyword.kwlist) - {"True", "False", "None"})
+CONSTANTS = ["True", "False", "None"]
+
+# Um único padrão com todos os tokens de interesse; a ordem das alternativas resolve as ambiguidades
+TOKEN_RE = re.compile(
+    r"(?P<comment>#.*)"
+    r"|(?P<triple>(?:\b[rRbBuUfF]{1,2})?(?:\"\"\"|'''))"
+    r"|(?P<string>(?:\b[rRbBuUfF]{1,2})?(?:\"(?:[^\"\\]|\\.)*\"?|'(?:[^'\\]|\\.)*'?))"
+    r"|(?P<keyword>\b(?:" + "|".join(KEYWORDS) + r")\b)"
+    r"|(?P<constant>\b(?:" + "|".join(CONSTANTS) + r")\b)"
+    r"|(?P<decorator>^\s*@[\w.]+)"
+    r"|(?P<number>\b(?:0[xXoObB][\da-fA-F_]+|\d[\d_]*\.?[\d_]*(?:[eE][+-]?\d+)?j?)\b)"
+    r"|(?P<open>[(\[{])"
+    r"|(?P<close>[)\]}])"
+)
+
+
+def _format(color, bold=False, italic=False):
+    fmt = QTextCharFormat()
+    fmt.setForeground(QColor(color))
+    if bold:
+        fmt.setFontWeight(QFont.Bold)
+    if italic:
+        fmt.setFontItalic(True)
+    return fmt
+
+
+class PythonHighlighter(QSyntaxHighlighter):
+    """
+    Destaque de sintaxe Python em uma única passada por linha.
+
+    Um padrão combinado reconhece comentários, strings, palavras-chave, constantes, decoradores e números.
+    Strings de três aspas e a profundidade de parênteses passam de uma linha para a seguinte pelo estado
+    do bloco, então o Qt só destaca de novo as linhas alteradas e as seguintes cujo estado mudou.
+    Fechamentos sem abertura correspondente são marcados como erro. A profundidade volta a zero em cada
+    instrução de nível superior (def, class, import, ...), de modo que um parêntese aberto no topo do
+    arquivo só destaca de novo as linhas até a próxima delas, e não o arquivo inteiro.
+
+    Para trocas de texto muito grandes (colar ou substituir um arquivo inteiro), defer() destaca as
+    primeiras linhas na hora e o restante em lotes, entre eventos da interface.
+    """
+    CHUNK_LINES = 1500
+
+    def __init__(self, document):
+        super().__init__(document)
+        self.formats = {
+            "comment": _format("#6A9955", italic=True),
+            "triple": _format("#D69D85"),
+            "string": _format("#D69D85"),
+            "keyword": _format("#569CD6", bold=True),
+            "constant": _format("#569CD6"),
+            "decorator": _format("#DCDCAA"),
+            "number": _format("#B5CEA8"),
+            "error": _format("#F44747", bold=True),
+        }
+        self._limit = None  # Linhas a partir desta ficam pendentes enquanto o destaque é adiado
+        self._timer = QTimer(self)
+        self._timer.setInterval(0)
+        self._timer.timeout.connect(self._highlight_next_chunk)
+
+    def defer(self):
+        """
+        Adia o destaque das linhas além do primeiro lote. Chame antes de uma troca grande de texto.
+        """
+        self._limit = self.CHUNK_LINES
+        self._timer.start()
+
+    def _highlight_next_chunk(self):
+        document = self.document()
+        if self._limit is None or document is None or self._limit >= document.blockCount():
+            self._limit = None
+            self._timer.stop()
+            return
+        start = document.findBlockByNumber(self._limit)
+        self._limit += self.CHUNK_LINES
+        # O estado do bloco deixa de ser STATE_PENDING, então o Qt segue destacando até o novo limite
+        self.rehighlightBlock(start)
+
+    def highlightBlock(self, text):
+        if self._limit is not None and self.currentBlock().blockNumber() >= self._limit:
+            self.setCurrentBlockState(STATE_PENDING)
+            return
+
+        previous = self.previousBlockState()
+        if previous < 0:
+            previous = STATE_NORMAL
+        string_state = previous & 3
+        depth = previous >> 2
+        pos = 0
+        length = len(text)
+
+        if string_state:
+            match = _TRIPLE_END[string_state].match(text)
+            if match is None:
+                self.setFormat(0, length, self.formats["triple"])
+                self.setCurrentBlockState(previous)
+                return
+            pos = match.end()
+            self.setFormat(0, pos, self.formats["triple"])
+            string_state = STATE_NORMAL
+        elif depth and _TOP_LEVEL_RE.match(text):
+            depth = 0
+
+        formats = self.formats
+        while pos < length:
+            match = TOKEN_RE.search(text, pos)
+            if match is None:
+                break
+            kind = match.lastgroup
+            start, end = match.span()
+            pos = end
+            if kind == "open":
+                depth += 1
+            elif kind == "close":
+                if depth > 0:
+                    depth -= 1
+                else:
+                    self.setFormat(start, 1, formats["error"])
+            elif kind == "triple":
+                state = _TRIPLE_STATES[match.group()[-3:]]
+                closing = _TRIPLE_END[state].match(text, end)
+                if closing is None:
+                    self.setFormat(start, length - start, formats["triple"])
+                    string_state = state
+                    break
+                pos = closing.end()
+                self.setFormat(start, pos - start, formats["triple"])
+            else:
+                self.setFormat(start, end - start, formats[kind])
+                if kind == "comment":
+                    break
+
+        self.setCurrentBlockState(string_state | (min(depth, _MAX_DEPTH) << 2))
@@ -0,0 +1,284 @@
+# ingest.py
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from langchain.text_splitter import Language, RecursiveCharacterTextSplitter
+
+from coder_core import EMBEDDING_MODEL, VectorStoreManager
+
+# Extensões com separadores específicos da linguagem
+LANGUAGE_BY_EXTENSION = {
+    ".py": Language.PYTHON,
+    ".js": Language.JS,
+    ".jsx": Language.JS,
+    ".ts": Language.TS,
+    ".tsx": Language.TS,
+    ".java": Language.JAVA,
+    ".go": Language.GO,
+    ".rs": Language.RUST,
+    ".c": Language.CPP,
+    ".h": Language.CPP,
+    ".cpp": Language.CPP,
+    ".hpp": Language.CPP,
+    ".cc": Language.CPP,
+    ".rb": Language.RUBY,
+    ".php": Language.PHP,
+    ".md": Language.MARKDOWN,
+    ".html": Language.HTML,
+}
+
+# Extensões indexadas com o divisor de texto genérico
+TEXT_EXTENSIONS = {
+    ".txt", ".rst", ".json", ".yaml", ".yml", ".toml", ".cfg", ".ini", ".sh", ".sql", ".css",
+}
+
+IGNORED_DIRS = {
+    ".git", ".hg", ".svn", "__pycache__", "node_modules", ".venv", "venv", ".tox", ".nox",
+    ".mypy_cache", ".pytest_cache", ".ruff_cache", "build", "dist", "vectorstore",
+}
+
+MANIFEST_NAME = "ingest_manifest.json"
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+_pool_embeddings = None
+
+
+def _init_pool_worker(model_name):
+    global _pool_embeddings
+    from langchain_huggingface import HuggingFaceEmbeddings
+    _pool_embeddings = HuggingFaceEmbeddings(model_name=model_name)
+
+
+def _embed_in_pool_worker(texts):
+    return _pool_embeddings.embed_documents(texts)
+
+
+class CodebaseIndexer:
+    """
+    Indexa uma árvore de projeto no Chroma de um VectorStoreManager de forma incremental.
+
+    Cada arquivo é registrado em um manifesto com seu hash de conteúdo e os ids dos seus trechos.
+    Ao reindexar, apenas arquivos novos ou alterados são divididos e embutidos novamente, e os trechos
+    de arquivos removidos são apagados. Os embeddings são calculados em lotes grandes, opcionalmente
+    em um pool de processos.
+
+    Args:
+        vectorstore_manager (VectorStoreManager): Destino dos trechos indexados.
+        chunk_size (int): Tamanho máximo de cada trecho, em caracteres.
+        chunk_overlap (int): Sobreposição entre trechos consecutivos.
+        batch_size (int): Número de trechos por passagem do modelo de embeddings.
+        workers (int): Processos para o cálculo dos embeddings; 0 usa o modelo já carregado no processo atual.
+        max_file_bytes (int): Arquivos maiores que isso são ignorados.
+    """
+    def __init__(self, vectorstore_manager, chunk_size=1500, chunk_overlap=150, batch_size=256, workers=0,
+                 max_file_bytes=1_000_000):
+        self.vectorstore_manager = vectorstore_manager
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.batch_size = batch_size
+        self.workers = workers
+        self.max_file_bytes = max_file_bytes
+        self.manifest_path = os.path.join(vectorstore_manager.vectorstore_path, MANIFEST_NAME)
+        self._splitters = {}
+
+    def load_manifest(self):
+        if not os.path.exists(self.manifest_path):
+            return {}
+        with open(self.manifest_path, "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def save_manifest(self, manifest):
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(temp_path, self.manifest_path)
+
+    def splitter_for(self, path):
+        extension = os.path.splitext(path)[1].lower()
+        language = LANGUAGE_BY_EXTENSION.get(extension)
+        if language not in self._splitters:
+            if language is None:
+                splitter = RecursiveCharacterTextSplitter(
+                    chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
+                )
+            else:
+                splitter = RecursiveCharacterTextSplitter.from_language(
+                    language, chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap
+                )
+            self._splitters[language] = splitter
+        return self._splitters[language]
+
+    def iter_files(self, root):
+        """
+        Percorre a árvore do projeto produzindo os caminhos absolutos dos arquivos indexáveis.
+        """
+        for directory, subdirs, files in os.walk(root):
+            subdirs[:] = [d for d in subdirs if d not in IGNORED_DIRS and not d.startswith(".")]
+            for name in files:
+                extension = os.path.splitext(name)[1].lower()
+                if extension in LANGUAGE_BY_EXTENSION or extension in TEXT_EXTENSIONS:
+                    yield os.path.abspath(os.path.join(directory, name))
+
+    def index(self, root):
+        """
+        Sincroniza o índice com a árvore em root.
+
+        Returns:
+            dict: Contagens de arquivos adicionados, atualizados, removidos, inalterados e ignorados,
+            trechos embutidos e o tempo total em segundos.
+        """
+        inicio = time.perf_counter()
+        root = os.path.abspath(root)
+        manifest = self.load_manifest()
+        stats = {"added": 0, "updated": 0, "removed": 0, "unchanged": 0, "skipped": 0, "chunks": 0}
+        seen = set()
+        pending = []  # (caminho, entrada do manifesto, trechos)
+        pending_chunks = 0
+
+        pool = None
+        if self.workers > 0:
+            pool = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_pool_worker, initargs=(EMBEDDING_MODEL,)
+            )
+        try:
+            for path in self.iter_files(root):
+                seen.add(path)
+                try:
+                    file_stat = os.stat(path)
+                except OSError:
+                    continue
+                previous = manifest.get(path)
+                if file_stat.st_size > self.max_file_bytes:
+                    self.forget(manifest, path)
+                    stats["skipped"] += 1
+                    continue
+                # mtime e tamanho iguais dispensam reler o arquivo
+                if previous and previous["mtime"] == file_stat.st_mtime and previous["size"] == file_stat.st_size:
+                    stats["unchanged"] += 1
+                    continue
+                digest = file_hash(path)
+                if previous and previous["hash"] == digest:
+                    previous["mtime"] = file_stat.st_mtime
+                    previous["size"] = file_stat.st_size
+                    stats["unchanged"] += 1
+                    continue
+                chunks = self.split_file(path)
+                if chunks is None:
+                    self.forget(manifest, path)
+                    stats["skipped"] += 1
+                    continue
+                entry = {"hash": digest, "mtime": file_stat.st_mtime, "size": file_stat.st_size}
+                stats["updated" if previous else "added"] += 1
+                pending.append((path, entry, chunks))
+                pending_chunks += len(chunks)
+                if pending_chunks >= self.batch_size * max(self.workers, 1):
+                    stats["chunks"] += self.flush(pending, manifest, root, pool)
+                    pending, pending_chunks = [], 0
+            stats["chunks"] += self.flush(pending, manifest, root, pool)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+        # Apagar os trechos de arquivos que não existem mais sob root
+        prefix = root + os.sep
+        removed = [path for path in manifest if path.startswith(prefix) and path not in seen]
+        for path in removed:
+            self.forget(manifest, path)
+        stats["removed"] = len(removed)
+
+        self.save_manifest(manifest)
+        stats["seconds"] = round(time.perf_counter() - inicio, 3)
+        logging.info(f"Indexação de {root} concluída: {stats}")
+        return stats
+
+    def forget(self, manifest, path):
+        """
+        Apaga do índice os trechos de um arquivo e o remove do manifesto.
+        """
+        entry = manifest.pop(path, None)
+        if entry:
+            self.vectorstore_manager.delete_ids(entry["ids"])
+
+    def split_file(self, path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+        except (UnicodeDecodeError, OSError):
+            return None
+        if "\0" in text:
+            return None
+        return [chunk for chunk in self.splitter_for(path).split_text(text) if chunk.strip()]
+
+    def flush(self, pending, manifest, root, pool):
+        """
+        Embute e grava os trechos pendentes, atualizando o manifesto dos arquivos correspondentes.
+
+        Returns:
+            int: Número de trechos gravados.
+        """
+        if not pending:
+            return 0
+        ids, texts, metadatas = [], [], []
+        for path, entry, chunks in pending:
+            path_id = hashlib.sha1(path.encode("utf-8")).hexdigest()[:16]
+            entry["ids"] = [f"{path_id}:{entry['hash'][:16]}:{i}" for i in range(len(chunks))]
+            ids.extend(entry["ids"])
+            texts.extend(chunks)
+            source = os.path.relpath(path, root)
+            metadatas.extend(
+                {"source": source, "path": path, "file_hash": entry["hash"], "chunk": i}
+                for i in range(len(chunks))
+            )
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if pool is not None:
+            embedded = pool.map(_embed_in_pool_worker, batches)
+        else:
+            embedded = (self.vectorstore_manager.embed_documents(batch) for batch in batches)
+        embeddings = [vector for batch in embedded for vector in batch]
+
+        self.vectorstore_manager.upsert_embedded(ids, texts, embeddings, metadatas)
+        for path, entry, _ in pending:
+            previous = manifest.get(path)
+            # Os ids incluem o hash do conteúdo, então os trechos antigos só saem depois dos novos gravados
+            if previous:
+                current_ids = set(entry["ids"])
+                self.vectorstore_manager.delete_ids([i for i in previous["ids"] if i not in current_ids])
+            manifest[path] = entry
+        return len(texts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indexa um projeto no vectorstore usado pelo CoderCore.")
+    parser.add_argument("root", help="Diretório raiz do projeto a indexar.")
+    parser.add_argument("--vectorstore", default="vectorstore", help="Diretório do Chroma.")
+    parser.add_argument("--workers", type=int, default=0, help="Processos para calcular embeddings.")
+    parser.add_argument("--batch-size", type=int, default=256, help="Trechos por lote de embeddings.")
+    parser.add_argument("--chunk-size", type=int, default=1500, help="Tamanho máximo de cada trecho.")
+    args = parser.parse_args()
+
+    indexer = CodebaseIndexer(
+        VectorStoreManager(args.vectorstore),
+        chunk_size=args.chunk_size,
+        batch_size=args.batch_size,
+        workers=args.workers,
+    )
+    print(json.dumps(indexer.index(args.root), indent=4))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+# llm_cache.py
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class LLMCache:
+    """
+    Cache de respostas do LLM endereçado pelo conteúdo da requisição.
+
+    A chave é um hash de (modelo, prompt, max_tokens, temperatura, opções do Ollama), com as opções da rota
+    da etapa (num_ctx, top_p, ...) serializadas em ordem canônica. Há uma frente LRU em memória e um
+    armazenamento persistente em SQLite com expiração por tempo de vida e limite de tamanho total.
+    Requisições com temperatura > 0 não são consultadas nem armazenadas, a menos que cache_sampled seja True.
+
+    Args:
+        path (str): Arquivo SQLite da camada persistente; None mantém apenas a camada em memória.
+        memory_entries (int): Número máximo de entradas na frente LRU em memória.
+        max_bytes (int): Tamanho máximo total, em bytes, das respostas guardadas em disco.
+        ttl (float): Tempo de vida das entradas, em segundos; None para nunca expirar.
+        cache_sampled (bool): Também armazena respostas geradas com temperatura > 0.
+    """
+    def __init__(self, path="llm_cache.sqlite3", memory_entries=256, max_bytes=64 * 1024 * 1024,
+                 ttl=7 * 24 * 3600, cache_sampled=False):
+        self.path = path
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.cache_sampled = cache_sampled
+        self._memory = OrderedDict()  # chave -> (texto, criado_em)
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "evictions": 0}
+        self._db = self._open_db() if path else None
+
+    def _open_db(self):
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        db = sqlite3.connect(self.path, check_same_thread=False)
+        db.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, model TEXT, value TEXT, size INTEGER, created REAL, last_access REAL)"
+        )
+        db.execute("CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)")
+        db.commit()
+        return db
+
+    @staticmethod
+    def make_key(model, prompt, max_tokens, temperature, options=None):
+        payload = json.dumps([model, prompt, max_tokens, temperature, options or {}], ensure_ascii=False,
+                             sort_keys=True)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _bypass(self, temperature):
+        return temperature > 0 and not self.cache_sampled
+
+    def _expired(self, created, now):
+        return self.ttl is not None and now - created > self.ttl
+
+    def lookup(self, model, prompt, max_tokens, temperature, options=None):
+        """
+        Retorna a resposta armazenada para a requisição, ou None se não houver (ou se o cache for ignorado).
+        """
+        with self._lock:
+            if self._bypass(temperature):
+                self._stats["bypassed"] += 1
+                return None
+            key = self.make_key(model, prompt, max_tokens, temperature, options)
+            now = time.time()
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[1], now):
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return entry[0]
+                del self._memory[key]
+            if self._db is not None:
+                row = self._db.execute("SELECT value, created FROM entries WHERE key = ?", (key,)).fetchone()
+                if row is not None and not self._expired(row[1], now):
+                    self._db.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, row[0], row[1])
+                    self._stats["disk_hits"] += 1
+                    return row[0]
+            self._stats["misses"] += 1
+            return None
+
+    def store(self, model, prompt, max_tokens, temperature, text, options=None):
+        """
+        Armazena a resposta gerada para a requisição nas duas camadas.
+        """
+        with self._lock:
+            if self._bypass(temperature):
+                return
+            key = self.make_key(model, prompt, max_tokens, temperature, options)
+            now = time.time()
+            self._remember(key, text, now)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (key, model, value, size, created, last_access) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (key, model, text, len(text.encode("utf-8")), now, now)
+                )
+                self._evict(now)
+                self._db.commit()
+            self._stats["stores"] += 1
+
+    def _remember(self, key, text, created):
+        self._memory[key] = (text, created)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, now):
+        """
+        Remove entradas expiradas e, se o total passar de max_bytes, as menos usadas recentemente.
+        """
+        evicted = 0
+        if self.ttl is not None:
+            evicted += self._db.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,)).rowcount
+        total = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total > self.max_bytes:
+            rows = self._db.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall()
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                self._db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._memory.pop(key, None)
+                total -= size
+                evicted += 1
+        self._stats["evictions"] += evicted
+
+    def stats(self):
+        """
+        Retorna os contadores de acertos e falhas, incluindo a taxa de acerto sobre as consultas elegíveis.
+        """
+        with self._lock:
+            stats = dict(self._stats)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = hits / lookups if lookups else 0.0
+        return stats
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM entries")
+                self._db.commit()
+
+
+_cache_instance = None
+_cache_lock = threading.Lock()
+
+
+def get_llm_cache():
+    """
+    Retorna o cache de respostas compartilhado pelo processo, criando-o na primeira chamada.
+
+    Defina OMNILLAMA_CACHE_SAMPLED=1 para também armazenar respostas geradas com temperatura > 0.
+    """
+    global _cache_instance
+    if _cache_instance is None:
+        with _cache_lock:
+            if _cache_instance is None:
+                _cache_instance = LLMCache(cache_sampled=os.environ.get("OMNILLAMA_CACHE_SAMPLED") == "1")
+                logging.info(f"Cache de respostas do LLM em {_cache_instance.path}")
+    return _cache_instance
+
+
+def set_llm_cache(cache):
+    """
+    Substitui o cache compartilhado (por exemplo, para desativar a camada em disco ou mudar os limites).
+    """
+    global _cache_instance
+    with _cache_lock:
+        _cache_instance = cache
@@ -0,0 +1,74 @@
+# model_routes.py
+
+import json
+import logging
+import os
+
+# Tempo que o Ollama mantém cada modelo carregado após uma geração: longo o bastante para que os modelos
+# usados nas etapas de uma mensagem (e das seguintes) continuem na memória em vez de serem trocados
+DEFAULT_KEEP_ALIVE = "30m"
+
+# Rota de cada etapa do pipeline. Chaves:
+#   "model": modelo do Ollama (ausente ou None usa o modelo padrão do ModeloLLM);
+#   "keep_alive": substitui DEFAULT_KEEP_ALIVE;
+#   "max_tokens" e "temperature": substituem os valores da chamada;
+#   demais chaves: opções do Ollama, como "num_ctx" (tamanho do contexto) ou "top_p".
+DEFAULT_STAGE_ROUTES = {
+    "classify": {"num_ctx": 2048},
+    "decompose": {"num_ctx": 2048},
+    "subquery": {"num_ctx": 4096},
+    "reason": {"num_ctx": 4096},
+    "answer": {"num_ctx": 4096},
+    "synthesize": {"num_ctx": 4096},
+    "single": {"num_ctx": 8192},
+    "code": {"num_ctx": 4096},
+    "modify": {"num_ctx": 8192},
+}
+
+# Chaves da rota que não são enviadas como opções do Ollama
+_ROUTE_KEYS = ("model", "keep_alive", "max_tokens", "temperature")
+
+
+def load_routes(path):
+    """
+    Rotas padrão atualizadas com as do arquivo JSON em path ({"etapa": {"model": ..., ...}}), se existir.
+    """
+    routes = {stage: dict(route) for stage, route in DEFAULT_STAGE_ROUTES.items()}
+    if not path or not os.path.exists(path):
+        return routes
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    for stage, route in data.items():
+        routes.setdefault(stage, {}).update(route)
+    logging.info(f"Rotas de modelos por etapa carregadas de {path}")
+    return routes
+
+
+def resolve_routes(routes, default_model):
+    """
+    Completa as rotas com o modelo padrão e o keep_alive padrão e separa as opções do Ollama.
+
+    Etapas que usam o mesmo modelo recebem o maior num_ctx entre elas: o Ollama recarrega o modelo quando
+    o num_ctx muda, e alternar entre valores o tiraria da memória a cada troca de etapa.
+
+    Returns:
+        dict: etapa -> {"model", "options", "keep_alive", "max_tokens", "temperature"}.
+    """
+    resolved = {}
+    num_ctx = {}
+    for stage, route in routes.items():
+        model = route.get("model") or default_model
+        options = {key: value for key, value in route.items() if key not in _ROUTE_KEYS}
+        resolved[stage] = {
+            "model": model,
+            "options": options,
+            "keep_alive": route.get("keep_alive", DEFAULT_KEEP_ALIVE),
+            "max_tokens": route.get("max_tokens"),
+            "temperature": route.get("temperature"),
+        }
+        if "num_ctx" in options:
+            num_ctx[model] = max(num_ctx.get(model, 0), options["num_ctx"])
+    for route in resolved.values():
+        if route["model"] in num_ctx:
+            route["options"]["num_ctx"] = num_ctx[route["model"]]
+    return resolved
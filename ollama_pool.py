@@ -0,0 +1,455 @@
+# ollama_pool.py
+
+import copy
+import http.client
+import json
+import logging
+import random
+import socket
+import threading
+import time
+import urllib.parse
+
+DEFAULT_OLLAMA_URL = "http://localhost:11434"
+
+# Respostas HTTP que indicam sobrecarga ou falha passageira do servidor e justificam nova tentativa
+RETRYABLE_STATUS = (408, 429, 500, 502, 503, 504)
+
+# Estados do circuito de cada servidor
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class OllamaError(Exception):
+    """
+    Falha ao gerar uma resposta no Ollama.
+
+    Attributes:
+        host (str): Servidor em que a falha ocorreu (None se nenhum pôde ser usado).
+        retryable (bool): Se uma nova tentativa, talvez em outro servidor, pode ter sucesso.
+    """
+    retryable = False
+
+    def __init__(self, message, host=None):
+        super().__init__(message)
+        self.host = host
+
+
+class OllamaConnectionError(OllamaError):
+    """
+    Conexão recusada ou interrompida, ou resposta HTTP malformada.
+    """
+    retryable = True
+
+
+class OllamaTimeout(OllamaError):
+    """
+    O servidor não respondeu dentro do tempo limite.
+    """
+    retryable = True
+
+
+class OllamaHTTPError(OllamaError):
+    """
+    Resposta HTTP de erro; só as de RETRYABLE_STATUS justificam nova tentativa (um modelo inexistente não).
+    """
+    def __init__(self, message, host=None, status=None):
+        super().__init__(message, host)
+        self.status = status
+        self.retryable = status in RETRYABLE_STATUS
+
+
+class OllamaUnavailable(OllamaError):
+    """
+    Nenhum servidor disponível: todos estão com o circuito aberto após falhas seguidas.
+    """
+
+
+def parse_hosts(value):
+    """
+    Lista de URLs de servidores a partir de uma lista ou de um texto separado por vírgulas.
+    """
+    if isinstance(value, str):
+        value = value.split(",")
+    hosts = [url.strip().rstrip("/") for url in value or () if url and url.strip()]
+    return hosts or [DEFAULT_OLLAMA_URL]
+
+
+def _typed_error(error, host):
+    if isinstance(error, (socket.timeout, TimeoutError)):
+        return OllamaTimeout(f"Tempo limite esgotado em {host.url}.", host.url)
+    return OllamaConnectionError(f"Falha de conexão com {host.url}: {str(error)}", host.url)
+
+
+class _Generation:
+    def __init__(self, text):
+        self.text = text
+
+
+class _LLMResult:
+    def __init__(self, texts):
+        self.generations = [[_Generation(text)] for text in texts]
+
+
+class _Host:
+    """
+    Um servidor Ollama: conexões keep-alive ociosas, requisições em andamento e estado do circuito.
+    """
+    def __init__(self, url, timeout):
+        parsed = urllib.parse.urlsplit(url if "://" in url else f"http://{url}")
+        self.url = f"{parsed.scheme}://{parsed.netloc}"
+        self.https = parsed.scheme == "https"
+        self.address = parsed.hostname
+        self.port = parsed.port or (443 if self.https else 80)
+        self.timeout = timeout
+        self.idle = []  # Conexões prontas para reutilização
+        self.in_flight = 0
+        self.requests = 0
+        self.errors = 0
+        self.failures = 0  # Falhas seguidas; zeradas no primeiro sucesso
+        self.state = CLOSED
+        self.opened_at = None
+
+    def connection(self):
+        """
+        Retorna (conexão, reutilizada): uma conexão ociosa, se houver, ou uma nova.
+        """
+        try:
+            return self.idle.pop(), True
+        except IndexError:
+            cls = http.client.HTTPSConnection if self.https else http.client.HTTPConnection
+            return cls(self.address, self.port, timeout=self.timeout), False
+
+
+class OllamaPool:
+    """
+    Cliente do Ollama que distribui as requisições entre vários servidores, com a interface usada do cliente
+    Ollama do LangChain (model, generate, stream, invoke).
+
+    Cada requisição vai para o servidor com menos requisições em andamento, reaproveitando conexões
+    keep-alive. Falhas passageiras (conexão, tempo limite, HTTP 429/5xx) são repetidas, de preferência em
+    outro servidor, após uma espera aleatória com teto exponencial; as demais viram OllamaError na hora.
+    failure_threshold falhas seguidas abrem o circuito do servidor, que sai da seleção por cooldown
+    segundos e depois recebe uma única requisição de teste antes de voltar.
+
+    Args:
+        hosts (list ou str): URLs dos servidores (texto separado por vírgulas também é aceito).
+        model (str): Modelo usado nas gerações.
+        timeout (float): Tempo limite, em segundos, para conectar e para cada leitura da resposta.
+        max_attempts (int): Tentativas por chamada, incluindo a primeira.
+        base_delay (float): Teto da espera antes da segunda tentativa; dobra a cada nova tentativa.
+        max_delay (float): Teto máximo da espera entre tentativas.
+        on_retry (callable, opcional): Chamado antes de cada nova tentativa; uma exceção levantada por ele
+            interrompe as tentativas (por exemplo, cancelamento ou orçamento esgotado).
+        options (dict, opcional): Opções do Ollama enviadas em todas as gerações (por exemplo, num_ctx).
+        keep_alive (str ou int, opcional): Por quanto tempo o servidor mantém o modelo carregado após
+            cada geração ("30m", -1 para sempre); None usa o padrão do servidor.
+    """
+    def __init__(self, hosts=None, model="llama3.2", timeout=120.0, max_attempts=4, base_delay=0.25,
+                 max_delay=4.0, failure_threshold=3, cooldown=15.0, max_idle=8, on_retry=None, options=None,
+                 keep_alive=None):
+        self.model = model
+        self.options = dict(options or {})
+        self.keep_alive = keep_alive
+        self.hosts = [_Host(url, timeout) for url in parse_hosts(hosts)]
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.max_idle = max_idle
+        self.on_retry = on_retry
+        self._next = 0  # Desempate entre servidores igualmente ocupados
+        self._lock = threading.Lock()
+
+    def variant(self, model=None, options=None, keep_alive=None):
+        """
+        Cliente com outro modelo, opções ou keep_alive que compartilha os servidores, as conexões, os
+        contadores de requisições em andamento e os circuitos deste.
+        """
+        other = copy.copy(self)
+        other.model = model or self.model
+        other.options = dict(options if options is not None else self.options)
+        other.keep_alive = keep_alive if keep_alive is not None else self.keep_alive
+        return other
+
+    def _acquire(self, tried=()):
+        """
+        Escolhe o servidor com menos requisições em andamento entre os que aceitam requisições, evitando os
+        já tentados nesta chamada enquanto houver alternativa.
+        """
+        with self._lock:
+            now = time.monotonic()
+            candidates = []
+            for host in self.hosts:
+                if host.state == OPEN and now - host.opened_at >= self.cooldown:
+                    host.state = HALF_OPEN
+                # Um servidor em teste recebe uma requisição por vez até o resultado
+                if host.state == CLOSED or (host.state == HALF_OPEN and host.in_flight == 0):
+                    candidates.append(host)
+            if not candidates:
+                raise OllamaUnavailable(
+                    f"Nenhum servidor Ollama disponível: circuito aberto em {len(self.hosts)} servidor(es)."
+                )
+            candidates = [host for host in candidates if host not in tried] or candidates
+            start = self._next % len(candidates)
+            self._next += 1
+            host = min(candidates[start:] + candidates[:start], key=lambda h: h.in_flight)
+            host.in_flight += 1
+            host.requests += 1
+            return host
+
+    def _release(self, host, connection=None, error=None, neutral=False):
+        """
+        Devolve a conexão ao servidor (se ainda utilizável) e atualiza o circuito com o resultado.
+        Erros não repetíveis, como um modelo inexistente, não contam contra o servidor.
+
+        Args:
+            neutral (bool): A requisição terminou sem um resultado que diga algo sobre o servidor (o gerador
+                foi fechado antes do fim ou a resposta veio malformada): o circuito não muda, e um servidor
+                em teste volta a aceitar uma nova requisição de teste.
+        """
+        with self._lock:
+            host.in_flight -= 1
+            if connection is not None and len(host.idle) < self.max_idle:
+                host.idle.append(connection)
+            elif connection is not None:
+                connection.close()
+            if neutral:
+                return
+            if error is None or not error.retryable:
+                if host.state != CLOSED:
+                    logging.info(f"Servidor Ollama {host.url} voltou a responder; circuito fechado.")
+                host.failures = 0
+                host.state = CLOSED
+                return
+            host.errors += 1
+            host.failures += 1
+            if host.state == HALF_OPEN or host.failures >= self.failure_threshold:
+                if host.state == CLOSED:
+                    logging.warning(
+                        f"Circuito aberto para {host.url} após {host.failures} falhas seguidas; "
+                        f"fora da seleção por {self.cooldown:.0f}s."
+                    )
+                host.state = OPEN
+                host.opened_at = time.monotonic()
+
+    def _backoff(self, attempt):
+        # Espera aleatória até o teto exponencial, para que chamadas simultâneas não repitam em sincronia
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def _post(self, host, payload):
+        """
+        Envia uma requisição a /api/generate e retorna (conexão, resposta) com status 200.
+        Uma conexão keep-alive que o servidor já fechou é trocada por uma nova sem contar como falha.
+        """
+        body = json.dumps(payload).encode("utf-8")
+        while True:
+            with self._lock:
+                connection, reused = host.connection()
+            try:
+                connection.request("POST", "/api/generate", body, {"Content-Type": "application/json"})
+                response = connection.getresponse()
+                break
+            except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError) as e:
+                connection.close()
+                if not reused:
+                    raise _typed_error(e, host) from e
+            except (OSError, http.client.HTTPException) as e:
+                connection.close()
+                raise _typed_error(e, host) from e
+        if response.status != 200:
+            try:
+                detail = json.loads(response.read() or b"{}").get("error", "")
+            except (OSError, http.client.HTTPException, ValueError, AttributeError):
+                detail = ""
+            connection.close()
+            raise OllamaHTTPError(
+                f"Ollama em {host.url} respondeu {response.status} {response.reason}. {detail}".strip(),
+                host.url, response.status,
+            )
+        return connection, response
+
+    def _request(self, payload):
+        """
+        Envia a requisição com novas tentativas até obter uma resposta 200.
+
+        Returns:
+            tuple: (servidor, conexão, resposta); quem chama deve devolver o servidor com _release.
+        """
+        tried = set()
+        last_error = None
+        for attempt in range(self.max_attempts):
+            if attempt:
+                if self.on_retry is not None:
+                    self.on_retry()
+                time.sleep(self._backoff(attempt))
+            try:
+                host = self._acquire(tried)
+            except OllamaUnavailable as e:
+                if last_error is None:
+                    raise
+                raise OllamaUnavailable(f"{str(e)} Última falha: {str(last_error)}") from last_error
+            tried.add(host)
+            try:
+                connection, response = self._post(host, payload)
+            except OllamaError as e:
+                self._release(host, error=e)
+                if not e.retryable or attempt == self.max_attempts - 1:
+                    raise
+                logging.warning(f"Tentativa {attempt + 1} de {self.max_attempts} falhou: {str(e)}")
+                last_error = e
+                continue
+            except BaseException:
+                self._release(host, neutral=True)
+                raise
+            return host, connection, response
+
+    def _read_json(self, host, connection, response):
+        """
+        Lê a resposta sem streaming e devolve o servidor; levanta OllamaError se ela não for válida.
+        """
+        try:
+            data = json.loads(response.read())
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            error = _typed_error(e, host)
+            self._release(host, error=error)
+            raise error from e
+        except ValueError as e:
+            connection.close()
+            self._release(host, neutral=True)
+            raise OllamaError(f"Resposta inválida de {host.url}: {str(e)}", host.url) from e
+        self._release(host, None if response.will_close else connection)
+        if "error" in data:
+            raise OllamaError(f"Ollama em {host.url}: {data['error']}", host.url)
+        return data
+
+    def _payload(self, prompt, stream, num_predict=None, temperature=None):
+        options = dict(self.options)
+        if num_predict is not None:
+            options["num_predict"] = num_predict
+        if temperature is not None:
+            options["temperature"] = temperature
+        payload = {"model": self.model, "prompt": prompt, "stream": stream, "options": options}
+        if self.keep_alive is not None:
+            payload["keep_alive"] = self.keep_alive
+        return payload
+
+    def complete(self, prompt, num_predict=None, temperature=None):
+        """
+        Gera a resposta completa de um prompt, sem streaming.
+
+        Returns:
+            str: O texto gerado. Levanta OllamaError se a geração falhar após as tentativas.
+        """
+        host, connection, response = self._request(self._payload(prompt, False, num_predict, temperature))
+        return self._read_json(host, connection, response).get("response", "")
+
+    def generate(self, prompts, model_kwargs=None, **kwargs):
+        """
+        Compatível com Ollama.generate do LangChain: response.generations[i][0].text.
+        """
+        model_kwargs = model_kwargs or {}
+        num_predict = model_kwargs.get("num_predict", model_kwargs.get("max_tokens"))
+        texts = [self.complete(prompt, num_predict, model_kwargs.get("temperature")) for prompt in prompts]
+        return _LLMResult(texts)
+
+    def invoke(self, prompt, num_predict=None, temperature=None, **kwargs):
+        return self.complete(prompt, num_predict, temperature)
+
+    def stream(self, prompt, num_predict=None, temperature=None, **kwargs):
+        """
+        Produz os pedaços de texto conforme chegam. Só a abertura da requisição é repetida: uma falha depois
+        do primeiro pedaço levanta OllamaError, para não duplicar texto já entregue. Fechar o gerador antes
+        do fim encerra a conexão, o que interrompe a geração no servidor sem contar como sucesso nem como
+        falha do servidor.
+        """
+        host, connection, response = self._request(self._payload(prompt, True, num_predict, temperature))
+        done = False
+        error = None
+        invalid = False
+        try:
+            for line in response:
+                if not line.strip():
+                    continue
+                data = json.loads(line)
+                if "error" in data:
+                    error = OllamaError(f"Ollama em {host.url}: {data['error']}", host.url)
+                    raise error
+                if data.get("response"):
+                    yield data["response"]
+                if data.get("done"):
+                    done = True
+                    break
+            if done:
+                response.read()  # Consome o fim da resposta para reaproveitar a conexão
+            else:
+                error = OllamaConnectionError(f"Resposta interrompida por {host.url}.", host.url)
+                raise error
+        except (OSError, http.client.HTTPException) as e:
+            done = False
+            error = _typed_error(e, host)
+            raise error from e
+        except ValueError as e:
+            done = False
+            invalid = True
+            error = OllamaError(f"Resposta inválida de {host.url}: {str(e)}", host.url)
+            raise error from e
+        finally:
+            if not done or response.will_close:
+                connection.close()
+            if done:
+                self._release(host, None if response.will_close else connection)
+            elif error is None or invalid:
+                self._release(host, neutral=True)  # Gerador fechado antes do fim, ou resposta malformada
+            else:
+                self._release(host, error=error)
+
+    def warm_up(self):
+        """
+        Carrega o modelo (com as opções e o keep_alive deste cliente) em todos os servidores com uma
+        geração de um único token.
+
+        Returns:
+            int: Quantos servidores responderam. Se nenhum responder, levanta o erro recebido quando ele não
+            justifica nova tentativa (como um modelo inexistente) e OllamaUnavailable nos demais casos.
+        """
+        payload = self._payload("ok", False, num_predict=1)
+        ready = 0
+        last_error = None
+        for host in self.hosts:
+            with self._lock:
+                host.in_flight += 1
+                host.requests += 1
+            try:
+                connection, response = self._post(host, payload)
+            except OllamaError as e:
+                self._release(host, error=e)
+                logging.error(f"Falha ao aquecer o modelo {self.model} em {host.url}: {str(e)}")
+                last_error = e
+                continue
+            try:
+                self._read_json(host, connection, response)
+            except OllamaError as e:
+                logging.error(f"Falha ao aquecer o modelo {self.model} em {host.url}: {str(e)}")
+                last_error = e
+                continue
+            ready += 1
+        if not ready:
+            if last_error is not None and not last_error.retryable:
+                raise last_error
+            raise OllamaUnavailable(f"Nenhum dos {len(self.hosts)} servidor(es) Ollama respondeu.") from last_error
+        return ready
+
+    def stats(self):
+        """
+        Estado de cada servidor: circuito, requisições em andamento, totais e conexões ociosas.
+        """
+        with self._lock:
+            return [
+                {
+                    "url": host.url, "state": host.state, "in_flight": host.in_flight, "requests": host.requests,
+                    "errors": host.errors, "idle_connections": len(host.idle),
+                }
+                for host in self.hosts
+            ]
@@ -0,0 +1,389 @@
+# session_store.py
+
+import base64
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from chat_history import ChatHistory, ChatMessage, STATUS_PENDING, STATUS_STREAMING
+from edit_history import apply_delta, diff_span
+
+SESSION_FORMAT = "omnillama-session"
+SESSION_VERSION = 2  # A versão 1 é o JSON único das versões anteriores ("messages" ou "chat_history" e "code")
+
+# Tipo e posição de um registro, lidos do início da linha sem decodificar o JSON inteiro
+_RECORD_RE = re.compile(rb'^\{"type": "(\w+)"(?:, "index": (\d+))?')
+
+
+class SessionError(Exception):
+    """
+    Arquivo de sessão ilegível ou de uma versão mais nova que a suportada.
+    """
+
+
+def encode_text(text):
+    return base64.b64encode(zlib.compress(text.encode("utf-8"))).decode("ascii")
+
+
+def decode_text(data):
+    return zlib.decompress(base64.b64decode(data)).decode("utf-8")
+
+
+def _record(kind, **fields):
+    # "type" (e "index", nas mensagens) vêm primeiro para que _RECORD_RE os encontre
+    return (json.dumps({"type": kind, **fields}, ensure_ascii=False) + "\n").encode("utf-8")
+
+
+class LoadedSession:
+    """
+    Sessão lida por SessionStore.open(). messages traz só as mensagens mais recentes; as anteriores são
+    decodificadas sob demanda com load_older().
+
+    Attributes:
+        path (str): Arquivo lido.
+        version (int): Versão do formato do arquivo.
+        messages (list): Mensagens mais recentes (ChatMessage), em ordem cronológica.
+        code (str): Código do editor.
+        undo (dict): Histórico de desfazer (EditHistory.to_dict()), ou None se não foi salvo.
+        total (int): Número total de mensagens da sessão.
+    """
+    def __init__(self, path, version, messages, code, undo=None, older_lines=None):
+        self.path = path
+        self.version = version
+        self.messages = messages
+        self.code = code
+        self.undo = undo
+        self._older = list(older_lines or [])
+        self.total = len(messages) + len(self._older)
+
+    @property
+    def has_older(self):
+        return bool(self._older)
+
+    def load_older(self, count=500):
+        """
+        Decodifica até count mensagens anteriores às já carregadas, da mais recente para a mais antiga.
+
+        Returns:
+            list: As mensagens, em ordem cronológica.
+        """
+        lines = self._older[-count:]
+        del self._older[-count:]
+        messages = []
+        for line in lines:
+            try:
+                messages.append(ChatMessage.from_dict(json.loads(line)))
+            except (ValueError, KeyError) as e:
+                logging.warning(f"Mensagem ilegível em {self.path} ignorada: {e}")
+        return messages
+
+
+class SessionStore:
+    """
+    Persistência da sessão (chat, código e histórico de desfazer) em um log só de acréscimos.
+
+    Cada linha do arquivo é um registro JSON:
+        header: formato e versão do arquivo.
+        message: uma mensagem concluída, identificada pela posição no chat; a última gravação de uma
+            posição prevalece.
+        code: snapshot comprimido do código do editor.
+        code_delta: trecho alterado do código desde o registro de código anterior.
+        undo: histórico de desfazer comprimido.
+
+    save() grava em uma thread própria apenas o que mudou desde a gravação anterior. Quando os registros
+    superados passam do tamanho do que ainda vale, o arquivo é reescrito compactado. Uma linha truncada no
+    fim (queda durante a gravação) é ignorada na leitura.
+
+    Args:
+        path (str, opcional): Arquivo da sessão; None até ela ser salva ou carregada pela primeira vez.
+        snapshot_every (int): Deltas de código gravados entre snapshots completos.
+        compact_min_bytes (int): Bytes superados tolerados antes de compactar o arquivo.
+    """
+    def __init__(self, path=None, snapshot_every=50, compact_min_bytes=1024 * 1024):
+        self.path = path
+        self.snapshot_every = snapshot_every
+        self.compact_min_bytes = compact_min_bytes
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session")
+        # Lado de quem chama save(): o que já foi enviado para gravação
+        self._saved_messages = []  # (id, versão, estado) por posição
+        self._undo_revision = None
+        self._rewrite = path is not None
+        # Lado da thread de gravação: o que está no arquivo
+        self._lock = threading.Lock()
+        self._reset_file_state()
+
+    def _reset_file_state(self, code="", size=0):
+        self._code = code
+        self._deltas = 0  # Deltas de código desde o último snapshot
+        self._code_bytes = 0  # Bytes dos registros de código ainda válidos
+        self._undo_bytes = 0
+        self._indices = set()  # Posições de mensagem já gravadas
+        self._size = size
+        self._garbage = 0  # Bytes de registros superados
+
+    def save(self, history, code, edit_history=None, path=None):
+        """
+        Agenda a gravação do que mudou na sessão desde a gravação anterior.
+
+        Args:
+            history (ChatHistory): Chat atual; mensagens ainda sendo geradas não são gravadas.
+            code (str): Código do editor.
+            edit_history (EditHistory, opcional): Histórico de desfazer, gravado só quando mudou.
+            path (str, opcional): Novo arquivo da sessão (salvar como); reescreve a sessão inteira nele.
+
+        Returns:
+            concurrent.futures.Future: Concluído quando a gravação termina, com a exceção em caso de erro.
+        """
+        if path is not None and path != self.path:
+            self.path = path
+            self._rewrite = True
+        if self.path is None:
+            raise SessionError("A sessão ainda não tem um arquivo.")
+        rewrite = self._rewrite or self._history_replaced(history)
+        self._rewrite = False
+        messages = self._changed_messages(history, rewrite)
+        undo = None
+        if edit_history is not None and (rewrite or edit_history.revision != self._undo_revision):
+            undo = edit_history.to_dict()
+            self._undo_revision = edit_history.revision
+        return self._executor.submit(self._write, self.path, rewrite, messages, code, undo)
+
+    def _history_replaced(self, history):
+        saved = self._saved_messages
+        if len(history) < len(saved):
+            return True
+        return any(key[0] != message.id for key, message in zip(saved, history.messages))
+
+    def _changed_messages(self, history, rewrite):
+        saved = [] if rewrite else self._saved_messages
+        keys = []
+        changed = []
+        for i, message in enumerate(history.messages):
+            if message.status in (STATUS_PENDING, STATUS_STREAMING):
+                break  # Só a última mensagem fica pendente; ela é gravada quando concluir
+            key = (message.id, message.version, message.status)
+            keys.append(key)
+            if i >= len(saved) or saved[i] != key:
+                changed.append((i, message.to_dict()))
+        self._saved_messages = keys
+        return changed
+
+    def mark_saved(self, messages, edit_history=None):
+        """
+        Registra mensagens e histórico de desfazer carregados do arquivo atual como já gravados.
+        """
+        self._saved_messages = [(m.id, m.version, m.status) for m in messages]
+        self._undo_revision = edit_history.revision if edit_history is not None else None
+
+    def flush(self, timeout=None):
+        """
+        Espera as gravações agendadas terminarem.
+        """
+        self._executor.submit(lambda: None).result(timeout)
+
+    def _write(self, path, rewrite, messages, code, undo):
+        with self._lock:
+            try:
+                if rewrite:
+                    self._rewrite_file(path, messages, code, undo)
+                else:
+                    self._append(path, messages, code, undo)
+            except Exception:
+                # O arquivo pode não ter recebido esta gravação; a próxima reescreve tudo
+                self._rewrite = True
+                raise
+
+    def _rewrite_file(self, path, messages, code, undo):
+        lines = [_record("header", format=SESSION_FORMAT, version=SESSION_VERSION, created=time.time())]
+        lines.extend(_record("message", index=i, **data) for i, data in messages)
+        lines.append(_record("code", data=encode_text(code)))
+        code_bytes = len(lines[-1])
+        if undo is not None:
+            lines.append(_record("undo", data=encode_text(json.dumps(undo))))
+        content = b"".join(lines)
+        self._replace(path, content)
+        self._reset_file_state(code, len(content))
+        self._code_bytes = code_bytes
+        self._undo_bytes = len(lines[-1]) if undo is not None else 0
+        self._indices = {i for i, _ in messages}
+
+    def _append(self, path, messages, code, undo):
+        lines = []
+        for i, data in messages:
+            lines.append(_record("message", index=i, **data))
+            if i in self._indices:
+                self._garbage += len(lines[-1])  # Aproximação: o registro anterior tem tamanho parecido
+            self._indices.add(i)
+        if code != self._code:
+            lines.append(self._code_record(code))
+        if undo is not None:
+            lines.append(_record("undo", data=encode_text(json.dumps(undo))))
+            self._garbage += self._undo_bytes
+            self._undo_bytes = len(lines[-1])
+        if not lines:
+            return
+        content = b"".join(lines)
+        with open(path, "ab") as f:
+            f.write(content)
+        self._size += len(content)
+        if self._garbage > max(self.compact_min_bytes, self._size - self._garbage):
+            self._compact(path)
+
+    def _code_record(self, code):
+        start, old_end, new_end = diff_span(self._code, code)
+        text = code[start:new_end]
+        if self._deltas >= self.snapshot_every or len(text) * 2 > len(code):
+            line = _record("code", data=encode_text(code))
+            self._garbage += self._code_bytes
+            self._code_bytes = len(line)
+            self._deltas = 0
+        else:
+            line = _record("code_delta", start=start, end=old_end, text=text)
+            self._code_bytes += len(line)
+            self._deltas += 1
+        self._code = code
+        return line
+
+    def _compact(self, path):
+        """
+        Reescreve o arquivo só com os registros válidos: a última versão de cada mensagem, um snapshot
+        do código e o último histórico de desfazer.
+        """
+        with open(path, "rb") as f:
+            lines = f.read().splitlines(keepends=True)
+        messages = {}
+        undo_line = None
+        for line in lines[1:]:
+            match = _RECORD_RE.match(line)
+            if match is None or not line.endswith(b"\n"):
+                continue
+            if match.group(1) == b"message":
+                messages[int(match.group(2))] = line
+            elif match.group(1) == b"undo":
+                undo_line = line
+        content = [lines[0]] + [messages[i] for i in sorted(messages)]
+        content.append(_record("code", data=encode_text(self._code)))
+        code_bytes = len(content[-1])
+        if undo_line is not None:
+            content.append(undo_line)
+        data = b"".join(content)
+        self._replace(path, data)
+        indices = set(messages)
+        self._reset_file_state(self._code, len(data))
+        self._code_bytes = code_bytes
+        self._undo_bytes = len(undo_line or b"")
+        self._indices = indices
+        logging.info(f"Sessão {path} compactada: {len(lines)} registros -> {len(content)}")
+
+    @staticmethod
+    def _replace(path, content):
+        temporary = path + ".tmp"
+        with open(temporary, "wb") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, path)
+
+    def open(self, path, recent=60):
+        """
+        Lê uma sessão, decodificando só as recent mensagens mais recentes (as demais ficam para
+        LoadedSession.load_older()). Sessões no formato antigo são lidas inteiras e não recebem gravações
+        automáticas até serem salvas em um novo arquivo.
+
+        Raises:
+            OSError: Se o arquivo não puder ser lido.
+            SessionError: Se o conteúdo não for uma sessão reconhecida.
+        """
+        self.flush()
+        with open(path, "rb") as f:
+            data = f.read()
+        lines = data.splitlines(keepends=True)
+        match = _RECORD_RE.match(lines[0]) if lines else None
+        if match is None or match.group(1) != b"header":
+            return self._open_legacy(path, data)
+        header = json.loads(lines[0])
+        if header.get("format") != SESSION_FORMAT or header.get("version", 0) > SESSION_VERSION:
+            raise SessionError(f"Formato de sessão não suportado: {header.get('format')} {header.get('version')}")
+
+        message_lines = {}
+        code_lines = []
+        undo_line = None
+        for line in lines[1:]:
+            match = _RECORD_RE.match(line)
+            if match is None or not line.endswith(b"\n"):
+                continue
+            kind = match.group(1)
+            if kind == b"message":
+                message_lines[int(match.group(2))] = line
+            elif kind == b"code":
+                code_lines = [line]
+            elif kind == b"code_delta":
+                code_lines.append(line)
+            elif kind == b"undo":
+                undo_line = line
+
+        code = self._read_code(code_lines)
+        undo = None
+        if undo_line is not None:
+            try:
+                undo = json.loads(decode_text(json.loads(undo_line)["data"]))
+            except (ValueError, KeyError, zlib.error) as e:
+                logging.warning(f"Histórico de desfazer ilegível em {path}: {e}")
+        indices = sorted(message_lines)
+        session = LoadedSession(
+            path, header.get("version", SESSION_VERSION), [], code, undo, [message_lines[i] for i in indices],
+        )
+        session.messages = session.load_older(recent) if recent else []
+
+        with self._lock:
+            self.path = path
+            self._rewrite = False
+            self._saved_messages = []
+            self._undo_revision = None
+            self._reset_file_state(code, len(data))
+            self._deltas = max(len(code_lines) - 1, 0)
+            self._code_bytes = sum(len(line) for line in code_lines)
+            self._undo_bytes = len(undo_line or b"")
+            self._indices = set(indices)
+            live = len(lines[0]) + sum(len(line) for line in message_lines.values())
+            self._garbage = max(len(data) - live - self._code_bytes - self._undo_bytes, 0)
+        return session
+
+    def _read_code(self, lines):
+        code = ""
+        for line in lines:
+            try:
+                record = json.loads(line)
+                if record["type"] == "code":
+                    code = decode_text(record["data"])
+                else:
+                    code = apply_delta(code, [(record["start"], record["end"], record["text"])])
+            except (ValueError, KeyError, zlib.error) as e:
+                # Só a última linha pode estar truncada; o código fica como estava antes dela
+                logging.warning(f"Registro de código ilegível ignorado: {e}")
+                break
+        return code
+
+    def _open_legacy(self, path, data):
+        try:
+            session_data = json.loads(data.decode("utf-8"))
+        except ValueError as e:
+            raise SessionError(f"Arquivo de sessão ilegível: {e}")
+        if not isinstance(session_data, dict):
+            raise SessionError("Arquivo de sessão ilegível.")
+        if "messages" in session_data:
+            history = ChatHistory.from_list(session_data["messages"])
+        else:
+            # Sessões salvas antes de as mensagens serem guardadas individualmente
+            history = ChatHistory.from_plain_text(session_data.get("chat_history", ""))
+        with self._lock:
+            self.path = None
+            self._saved_messages = []
+            self._undo_revision = None
+            self._reset_file_state()
+        return LoadedSession(path, 1, history.messages, session_data.get("code", ""))
@@ -0,0 +1,274 @@
+# stage_graph.py
+
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Estados de uma tarefa do grafo
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+
+# Tarefa em execução na thread atual
+_current_task = contextvars.ContextVar("current_task", default=None)
+
+
+class TaskCancelled(Exception):
+    """
+    Levantada dentro de uma tarefa cancelada (por exemplo, o caminho especulativo que perdeu).
+    """
+
+
+class _Task:
+    __slots__ = ("graph", "name", "fn", "deps", "speculative", "speculated", "state", "result", "error", "start",
+                 "end", "cancel_event")
+
+    def __init__(self, graph, name, fn, deps, speculative):
+        self.graph = graph
+        self.name = name
+        self.fn = fn
+        self.deps = deps
+        self.speculative = speculative
+        self.speculated = speculative  # Começou especulativa, mesmo que depois confirmada
+        self.state = PENDING
+        self.result = None
+        self.error = None
+        self.start = None
+        self.end = None
+        self.cancel_event = threading.Event()
+
+
+def current_task():
+    """
+    Nome da tarefa do grafo em execução na thread atual, ou None fora de um StageGraph.
+    """
+    task = _current_task.get()
+    return task.name if task is not None else None
+
+
+def task_cancelled():
+    """
+    Indica se a tarefa do grafo em execução na thread atual foi cancelada (False fora de um StageGraph).
+    """
+    task = _current_task.get()
+    return task is not None and task.cancel_event.is_set()
+
+
+def task_speculated():
+    """
+    Indica se a tarefa do grafo em execução na thread atual começou especulativa, mesmo que já confirmada
+    (False fora de um StageGraph).
+    """
+    task = _current_task.get()
+    return task is not None and task.speculated
+
+
+def check_task():
+    """
+    Levanta TaskCancelled se a tarefa em execução na thread atual foi cancelada. As etapas longas devem
+    chamá-la periodicamente (por exemplo, a cada pedaço recebido em streaming).
+    """
+    task = _current_task.get()
+    if task is not None and task.cancel_event.is_set():
+        raise TaskCancelled(task.name)
+
+
+class StageGraph:
+    """
+    Executa etapas com dependências entre si, com no máximo max_concurrency simultâneas.
+
+    Cada etapa é uma função que recebe um dicionário com os resultados das suas dependências e roda em
+    uma thread do grafo, com uma cópia do contexto (contextvars) de quem chamou run(). Etapas podem
+    acrescentar outras ao grafo enquanto rodam; as novas dependem implicitamente de quem as acrescentou.
+
+    Etapas especulativas só ocupam vagas que nenhuma etapa confirmada esteja esperando: com
+    max_concurrency=1 o grafo roda em série, e com mais vagas o caminho provável começa antes de a decisão
+    sair. confirm() torna uma etapa especulativa obrigatória, e cancel() descarta uma etapa e as que
+    dependem dela; a etapa cancelada que já está rodando percebe o cancelamento em check_task().
+    A falha de uma etapa ainda especulativa só descarta as que dependem dela: o erro é levantado por
+    confirm(), se ela for confirmada depois.
+
+    Args:
+        max_concurrency (int): Etapas rodando ao mesmo tempo.
+    """
+    def __init__(self, max_concurrency=4):
+        self.max_concurrency = max(1, max_concurrency)
+        self.started = None
+        self.finished = None
+        self._tasks = {}  # nome -> _Task, na ordem em que foram acrescentadas (uma ordem topológica)
+        self._running = 0
+        self._error = None
+        self._condition = threading.Condition()
+
+    def add(self, name, fn, deps=(), speculative=False):
+        """
+        Acrescenta a etapa name, que roda fn(resultados das dependências) quando todas as deps terminarem.
+
+        Returns:
+            str: name, para ser usado como dependência de outras etapas.
+        """
+        parent = _current_task.get()
+        deps = tuple(deps)
+        if parent is not None and parent.graph is self and parent.name not in deps:
+            deps += (parent.name,)
+        with self._condition:
+            if name in self._tasks:
+                raise ValueError(f"Etapa repetida no grafo: {name}")
+            desconhecidas = [dep for dep in deps if dep not in self._tasks]
+            if desconhecidas:
+                raise ValueError(f"Dependências desconhecidas da etapa {name}: {', '.join(desconhecidas)}")
+            task = self._tasks[name] = _Task(self, name, fn, deps, speculative)
+            if any(self._tasks[dep].state in (CANCELLED, FAILED) for dep in deps):
+                self._cancel(task)
+            self._condition.notify_all()
+        return name
+
+    def confirm(self, name):
+        """
+        Torna obrigatória uma etapa especulativa. Se ela já falhou, levanta o erro dela.
+        """
+        with self._condition:
+            task = self._tasks[name]
+            if task.state == FAILED:
+                raise task.error
+            task.speculative = False
+            self._condition.notify_all()
+
+    def cancel(self, name):
+        """
+        Cancela a etapa name e as que dependem dela.
+        """
+        with self._condition:
+            self._cancel(self._tasks[name])
+            self._condition.notify_all()
+
+    def _cancel(self, task):
+        if task.state not in (PENDING, RUNNING):
+            return
+        task.state = CANCELLED
+        task.cancel_event.set()
+        for other in self._tasks.values():
+            if task.name in other.deps:
+                self._cancel(other)
+
+    def run(self):
+        """
+        Roda o grafo até todas as etapas terminarem ou serem canceladas. Etapas canceladas que ainda estão
+        rodando não são esperadas.
+
+        Returns:
+            dict: Resultado de cada etapa concluída. Se uma etapa falhar, as demais são canceladas e a
+            exceção dela é levantada.
+        """
+        self.started = time.perf_counter()
+        executor = ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="stage")
+        try:
+            with self._condition:
+                while self._error is None:
+                    self._dispatch(executor)
+                    if all(task.state in (DONE, FAILED, CANCELLED) for task in self._tasks.values()):
+                        break
+                    self._condition.wait()
+                if self._error is not None:
+                    for task in self._tasks.values():
+                        self._cancel(task)
+        finally:
+            executor.shutdown(wait=False)
+            self.finished = time.perf_counter()
+        if self._error is not None:
+            raise self._error
+        return {name: task.result for name, task in self._tasks.items() if task.state == DONE}
+
+    def _dispatch(self, executor):
+        # Etapas confirmadas primeiro, na ordem em que foram acrescentadas; as especulativas ficam com as sobras
+        prontas = [
+            task for task in self._tasks.values()
+            if task.state == PENDING and all(self._tasks[dep].state == DONE for dep in task.deps)
+        ]
+        prontas.sort(key=lambda task: task.speculative)
+        for task in prontas:
+            if self._running >= self.max_concurrency:
+                break
+            task.state = RUNNING
+            self._running += 1
+            executor.submit(contextvars.copy_context().run, self._execute, task)
+
+    def _execute(self, task):
+        token = _current_task.set(task)
+        task.start = time.perf_counter()
+        result = error = None
+        try:
+            result = task.fn({dep: self._tasks[dep].result for dep in task.deps})
+        except BaseException as e:
+            error = e
+        finally:
+            _current_task.reset(token)
+        with self._condition:
+            task.end = time.perf_counter()
+            self._running -= 1
+            if task.state == CANCELLED:
+                pass  # Resultado descartado, inclusive o TaskCancelled da própria etapa
+            elif error is not None:
+                task.state = FAILED
+                task.error = error
+                if task.speculative:
+                    # Pode ser o caminho que perderia; só falha a requisição se for confirmada
+                    logging.info(f"Etapa especulativa {task.name} falhou ({type(error).__name__}: {error}).")
+                    for other in self._tasks.values():
+                        if task.name in other.deps:
+                            self._cancel(other)
+                elif self._error is None:
+                    self._error = error
+            else:
+                task.state = DONE
+                task.result = result
+            self._condition.notify_all()
+
+    def report(self):
+        """
+        Tempos do grafo: o total, o caminho crítico (a maior soma de durações ao longo das dependências
+        entre etapas concluídas, ou seja, o tempo com vagas ilimitadas), o trabalho somado de todas as etapas
+        (próximo ao tempo de uma execução em série) e o gasto com etapas canceladas.
+        """
+        with self._condition:
+            tasks = list(self._tasks.values())
+            origin = self.started if self.started is not None else time.perf_counter()
+            end = self.finished if self.finished is not None else time.perf_counter()
+            caminho = {}  # nome -> (duração acumulada, etapa anterior no caminho)
+            for task in tasks:
+                if task.state != DONE:
+                    continue
+                anterior = max((dep for dep in task.deps if dep in caminho), key=lambda dep: caminho[dep][0],
+                               default=None)
+                base = caminho[anterior][0] if anterior is not None else 0.0
+                caminho[task.name] = (base + task.end - task.start, anterior)
+            critico = []
+            nome = max(caminho, key=lambda n: caminho[n][0], default=None)
+            while nome is not None:
+                critico.append(nome)
+                nome = caminho[nome][1]
+            executadas = [task for task in tasks if task.start is not None]
+            return {
+                "max_concurrency": self.max_concurrency,
+                "total_seconds": end - origin,
+                "critical_path_seconds": caminho[critico[0]][0] if critico else 0.0,
+                "critical_path": critico[::-1],
+                "work_seconds": sum((task.end or end) - task.start for task in executadas),
+                "cancelled_seconds": sum((task.end or end) - task.start for task in executadas
+                                         if task.state == CANCELLED),
+                "tasks": [
+                    {
+                        "name": task.name,
+                        "deps": list(task.deps),
+                        "speculative": task.speculated,
+                        "state": task.state,
+                        "start": task.start - origin if task.start is not None else None,
+                        "seconds": (task.end or end) - task.start if task.start is not None else None,
+                    }
+                    for task in tasks
+                ],
+            }
@@ -0,0 +1,402 @@
+# telemetry.py
+
+import argparse
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+# Span aninhado ativo na thread (ou tarefa) atual, como (trace, span)
+_active_span = contextvars.ContextVar("active_span", default=None)
+
+REQUEST_STATUSES = ("ok", "cancelled", "budget", "error")
+
+
+class Span:
+    """
+    Trecho medido de uma requisição: uma etapa do pipeline ou uma operação dentro dela.
+    Chamadas ao LLM, tokens, acertos do cache e novas tentativas contam no span ativo e em seus ancestrais.
+    """
+    __slots__ = ("name", "parent", "start", "end", "prompt_tokens", "completion_tokens", "llm_calls",
+                 "cache_hits", "retries", "error")
+
+    def __init__(self, name, parent, start):
+        self.name = name
+        self.parent = parent
+        self.start = start
+        self.end = None
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.llm_calls = 0
+        self.cache_hits = 0
+        self.retries = 0
+        self.error = None
+
+    def seconds(self, now=None):
+        end = self.end if self.end is not None else (now if now is not None else time.perf_counter())
+        return end - self.start
+
+    def to_dict(self, origin):
+        return {
+            "name": self.name,
+            "parent": self.parent.name if self.parent is not None else None,
+            "start": self.start - origin,
+            "seconds": self.seconds(),
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "llm_calls": self.llm_calls,
+            "cache_hits": self.cache_hits,
+            "retries": self.retries,
+            "error": self.error,
+        }
+
+
+class Trace:
+    """
+    Spans de uma requisição. As etapas são sequenciais (cada uma termina quando a seguinte começa); spans
+    abertos com span() ficam dentro da etapa ou do span ativo na thread, inclusive em tarefas paralelas
+    que copiam o contexto. Etapas que se sobrepõem, como as de um StageGraph, usam spans de primeiro nível
+    (span(nome, top_level=True)) depois de end_stage(), e o relatório do grafo fica em schedule. Cada
+    chamada ao LLM também fica em calls, com a rota e o modelo usados.
+    """
+    def __init__(self):
+        self.started = time.time()
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.calls = []
+        self.schedule = None  # Relatório do StageGraph (stage_graph.StageGraph.report)
+        self.status = None
+        self.total_seconds = None
+        self._stage = None
+        self._lock = threading.Lock()
+
+    def enter_stage(self, name):
+        with self._lock:
+            now = time.perf_counter()
+            if self._stage is not None:
+                self._stage.end = now
+            self._stage = Span(name, None, now)
+            self.spans.append(self._stage)
+
+    def end_stage(self):
+        with self._lock:
+            if self._stage is not None:
+                self._stage.end = time.perf_counter()
+            self._stage = None
+
+    @contextlib.contextmanager
+    def span(self, name, top_level=False):
+        with self._lock:
+            span = Span(name, None if top_level else self._active(), time.perf_counter())
+            self.spans.append(span)
+        token = _active_span.set((self, span))
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.end = time.perf_counter()
+            _active_span.reset(token)
+
+    def _active(self):
+        active = _active_span.get()
+        if active is not None and active[0] is self:
+            return active[1]
+        return self._stage
+
+    def record_call(self, prompt_tokens, completion_tokens, cached=False, model=None, stage=None, seconds=None):
+        with self._lock:
+            span = self._active()
+            self.calls.append({
+                "stage": stage or (span.name if span is not None else None),
+                "model": model,
+                "seconds": seconds,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "cached": cached,
+            })
+            while span is not None:
+                if cached:
+                    span.cache_hits += 1
+                else:
+                    span.llm_calls += 1
+                    span.prompt_tokens += prompt_tokens
+                    span.completion_tokens += completion_tokens
+                span = span.parent
+
+    def record_retry(self):
+        with self._lock:
+            span = self._active()
+            while span is not None:
+                span.retries += 1
+                span = span.parent
+
+    def record_schedule(self, report):
+        with self._lock:
+            self.schedule = report
+
+    def finish(self, status):
+        with self._lock:
+            now = time.perf_counter()
+            if self._stage is not None and self._stage.end is None:
+                self._stage.end = now
+            self.status = status
+            self.total_seconds = now - self.origin
+
+    def summary(self):
+        """
+        Dicionário serializável com o estado, o tempo total, todos os spans (início relativo ao da requisição)
+        e as chamadas ao LLM.
+        """
+        with self._lock:
+            return {
+                "started": self.started,
+                "status": self.status,
+                "total_seconds": self.total_seconds if self.total_seconds is not None
+                else time.perf_counter() - self.origin,
+                "spans": [span.to_dict(self.origin) for span in self.spans],
+                "calls": list(self.calls),
+                "schedule": self.schedule,
+            }
+
+
+def format_summary(summary):
+    """
+    Resumo de uma linha dos tempos por etapa, para logs e para a barra de status da interface.
+    """
+    partes = [f"total {summary['total_seconds']:.2f}s"]
+    for span in summary["spans"]:
+        if span["parent"] is not None:
+            continue
+        texto = f"{span['name']} {span['seconds']:.2f}s"
+        if span["llm_calls"]:
+            texto += f" ({span['prompt_tokens']}→{span['completion_tokens']} tok)"
+        partes.append(texto)
+    cache_hits = sum(s["cache_hits"] for s in summary["spans"] if s["parent"] is None)
+    retries = sum(s["retries"] for s in summary["spans"] if s["parent"] is None)
+    partes.append(f"cache {cache_hits}")
+    partes.append(f"tentativas extras {retries}")
+    if summary.get("schedule"):
+        partes.append(f"caminho crítico {summary['schedule']['critical_path_seconds']:.2f}s")
+    return " | ".join(partes)
+
+
+class Telemetry:
+    """
+    Agrega os traces das requisições concluídas e os exporta: um JSON por linha em path (opcional) e
+    métricas no formato de texto do Prometheus (render_prometheus).
+
+    As métricas são agrupadas pelo nome do span; spans aninhados (como "retrieval" e "merge") também
+    contam nos seus ancestrais. As chamadas ao LLM também são agrupadas por modelo e rota, para ajustar a
+    tabela de rotas (model_routes).
+
+    Args:
+        path (str, opcional): Arquivo JSONL que recebe o resumo de cada requisição.
+        buckets (tuple): Limites, em segundos, do histograma de duração dos spans.
+    """
+    def __init__(self, path=None, buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)):
+        self.path = path
+        self.buckets = buckets
+        self.last = None  # Resumo da última requisição registrada
+        self._spans = {}  # nome -> totais
+        self._models = {}  # (modelo, rota) -> totais das chamadas ao LLM
+        self._requests = {status: 0 for status in REQUEST_STATUSES}
+        self._request_seconds = 0.0
+        self._schedule = {"graphs": 0, "seconds": 0.0, "critical_path_seconds": 0.0, "cancelled_seconds": 0.0}
+        self._lock = threading.Lock()
+
+    def record(self, trace):
+        summary = trace.summary()
+        with self._lock:
+            self.last = summary
+            self._requests[summary["status"]] = self._requests.get(summary["status"], 0) + 1
+            self._request_seconds += summary["total_seconds"]
+            if summary.get("schedule"):
+                self._schedule["graphs"] += 1
+                self._schedule["seconds"] += summary["schedule"]["total_seconds"]
+                self._schedule["critical_path_seconds"] += summary["schedule"]["critical_path_seconds"]
+                self._schedule["cancelled_seconds"] += summary["schedule"]["cancelled_seconds"]
+            for span in summary["spans"]:
+                totals = self._spans.get(span["name"])
+                if totals is None:
+                    totals = self._spans[span["name"]] = {
+                        "count": 0, "seconds": 0.0, "buckets": [0] * len(self.buckets), "prompt_tokens": 0,
+                        "completion_tokens": 0, "llm_calls": 0, "cache_hits": 0, "retries": 0, "errors": 0,
+                    }
+                totals["count"] += 1
+                totals["seconds"] += span["seconds"]
+                for i, limit in enumerate(self.buckets):
+                    if span["seconds"] <= limit:
+                        totals["buckets"][i] += 1
+                for key in ("prompt_tokens", "completion_tokens", "llm_calls", "cache_hits", "retries"):
+                    totals[key] += span[key]
+                totals["errors"] += span["error"] is not None
+            for call in summary["calls"]:
+                key = (call["model"] or "desconhecido", call["stage"] or "desconhecida")
+                totals = self._models.setdefault(key, {
+                    "calls": 0, "cache_hits": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0,
+                })
+                if call["cached"]:
+                    totals["cache_hits"] += 1
+                    continue
+                totals["calls"] += 1
+                totals["seconds"] += call["seconds"] or 0.0
+                totals["prompt_tokens"] += call["prompt_tokens"]
+                totals["completion_tokens"] += call["completion_tokens"]
+            if self.path:
+                try:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+                except OSError as e:
+                    logging.error(f"Falha ao exportar telemetria para {self.path}: {str(e)}")
+        return summary
+
+    def render_prometheus(self):
+        """
+        Métricas acumuladas no formato de exposição de texto do Prometheus.
+        """
+        with self._lock:
+            linhas = [
+                "# HELP omnillama_requests_total Requisições concluídas, por estado.",
+                "# TYPE omnillama_requests_total counter",
+            ]
+            linhas += [f'omnillama_requests_total{{status="{s}"}} {n}' for s, n in self._requests.items()]
+            linhas += [
+                "# HELP omnillama_request_seconds_total Tempo total das requisições concluídas.",
+                "# TYPE omnillama_request_seconds_total counter",
+                f"omnillama_request_seconds_total {self._request_seconds:.6f}",
+                "# HELP omnillama_graph_runs_total Execuções do grafo de etapas do pipeline.",
+                "# TYPE omnillama_graph_runs_total counter",
+                f"omnillama_graph_runs_total {self._schedule['graphs']}",
+                "# HELP omnillama_graph_seconds_total Tempo total do grafo de etapas, por tipo.",
+                "# TYPE omnillama_graph_seconds_total counter",
+                f'omnillama_graph_seconds_total{{kind="total"}} {self._schedule["seconds"]:.6f}',
+                f'omnillama_graph_seconds_total{{kind="critical_path"}} {self._schedule["critical_path_seconds"]:.6f}',
+                f'omnillama_graph_seconds_total{{kind="cancelled"}} {self._schedule["cancelled_seconds"]:.6f}',
+                "# HELP omnillama_span_seconds Duração de cada etapa ou operação do pipeline.",
+                "# TYPE omnillama_span_seconds histogram",
+            ]
+            for name, totals in sorted(self._spans.items()):
+                for limit, count in zip(self.buckets, totals["buckets"]):
+                    linhas.append(f'omnillama_span_seconds_bucket{{span="{name}",le="{limit}"}} {count}')
+                linhas.append(f'omnillama_span_seconds_bucket{{span="{name}",le="+Inf"}} {totals["count"]}')
+                linhas.append(f'omnillama_span_seconds_sum{{span="{name}"}} {totals["seconds"]:.6f}')
+                linhas.append(f'omnillama_span_seconds_count{{span="{name}"}} {totals["count"]}')
+            contadores = (
+                ("tokens_total", "Tokens estimados enviados e gerados.", None),
+                ("llm_calls_total", "Chamadas ao LLM.", "llm_calls"),
+                ("cache_hits_total", "Respostas obtidas do cache.", "cache_hits"),
+                ("retries_total", "Novas tentativas após falhas.", "retries"),
+                ("errors_total", "Spans interrompidos por exceção.", "errors"),
+            )
+            for metric, help_text, key in contadores:
+                linhas.append(f"# HELP omnillama_span_{metric} {help_text}")
+                linhas.append(f"# TYPE omnillama_span_{metric} counter")
+                for name, totals in sorted(self._spans.items()):
+                    if key is None:
+                        linhas.append(f'omnillama_span_{metric}{{span="{name}",kind="prompt"}} {totals["prompt_tokens"]}')
+                        linhas.append(
+                            f'omnillama_span_{metric}{{span="{name}",kind="completion"}} {totals["completion_tokens"]}'
+                        )
+                    else:
+                        linhas.append(f'omnillama_span_{metric}{{span="{name}"}} {totals[key]}')
+            contadores = (
+                ("calls_total", "Chamadas ao LLM por modelo e rota.", "calls"),
+                ("cache_hits_total", "Respostas do cache por modelo e rota.", "cache_hits"),
+                ("seconds_total", "Tempo das chamadas ao LLM por modelo e rota.", "seconds"),
+                ("prompt_tokens_total", "Tokens estimados enviados por modelo e rota.", "prompt_tokens"),
+                ("completion_tokens_total", "Tokens estimados gerados por modelo e rota.", "completion_tokens"),
+            )
+            for metric, help_text, key in contadores:
+                linhas.append(f"# HELP omnillama_model_{metric} {help_text}")
+                linhas.append(f"# TYPE omnillama_model_{metric} counter")
+                for (model, stage), totals in sorted(self._models.items()):
+                    valor = f"{totals[key]:.6f}" if key == "seconds" else totals[key]
+                    linhas.append(f'omnillama_model_{metric}{{model="{model}",stage="{stage}"}} {valor}')
+        return "\n".join(linhas) + "\n"
+
+
+_telemetry_instance = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry():
+    """
+    Retorna o agregador de telemetria compartilhado pelo processo, criando-o na primeira chamada.
+
+    Defina OMNILLAMA_TELEMETRY com um caminho para exportar o resumo de cada requisição em JSON lines.
+    """
+    global _telemetry_instance
+    if _telemetry_instance is None:
+        with _telemetry_lock:
+            if _telemetry_instance is None:
+                _telemetry_instance = Telemetry(os.environ.get("OMNILLAMA_TELEMETRY"))
+    return _telemetry_instance
+
+
+def set_telemetry(telemetry):
+    """
+    Substitui o agregador compartilhado (por exemplo, para exportar para outro arquivo).
+    """
+    global _telemetry_instance
+    with _telemetry_lock:
+        _telemetry_instance = telemetry
+
+
+def routing_report(summaries):
+    """
+    Latência das chamadas ao LLM por rota e modelo, a partir de resumos de requisições (Trace.summary),
+    para decidir que etapas podem usar um modelo menor.
+
+    Returns:
+        list: Um dicionário por (rota, modelo) com chamadas, acertos do cache, p50 e p95 em segundos e
+        tokens gerados por segundo.
+    """
+    grupos = {}
+    for summary in summaries:
+        for call in summary.get("calls", ()):
+            grupo = grupos.setdefault((call["stage"], call["model"]), {"seconds": [], "tokens": 0, "cache_hits": 0})
+            if call["cached"]:
+                grupo["cache_hits"] += 1
+            elif call["seconds"] is not None:
+                grupo["seconds"].append(call["seconds"])
+                grupo["tokens"] += call["completion_tokens"]
+    linhas = []
+    for (stage, model), grupo in sorted(grupos.items(), key=lambda item: (str(item[0][0]), str(item[0][1]))):
+        seconds = sorted(grupo["seconds"])
+        linhas.append({
+            "stage": stage,
+            "model": model,
+            "calls": len(seconds),
+            "cache_hits": grupo["cache_hits"],
+            "p50": seconds[len(seconds) // 2] if seconds else None,
+            "p95": seconds[min(int(0.95 * len(seconds)), len(seconds) - 1)] if seconds else None,
+            "tokens_per_second": grupo["tokens"] / sum(seconds) if sum(seconds) else None,
+        })
+    return linhas
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latência por rota e modelo a partir da telemetria exportada.")
+    parser.add_argument("spans", help="Arquivo JSONL gravado com OMNILLAMA_TELEMETRY ou headless.py --telemetry.")
+    args = parser.parse_args()
+
+    with open(args.spans, "r", encoding="utf-8") as f:
+        summaries = [json.loads(line) for line in f if line.strip()]
+    print(f"{'rota':<12} {'modelo':<24} {'chamadas':>8} {'cache':>6} {'p50':>8} {'p95':>8} {'tok/s':>8}")
+    for linha in routing_report(summaries):
+        p50 = f"{linha['p50']:.2f}s" if linha["p50"] is not None else "-"
+        p95 = f"{linha['p95']:.2f}s" if linha["p95"] is not None else "-"
+        vazao = f"{linha['tokens_per_second']:.0f}" if linha["tokens_per_second"] is not None else "-"
+        print(
+            f"{str(linha['stage']):<12} {str(linha['model']):<24} {linha['calls']:>8} {linha['cache_hits']:>6} "
+            f"{p50:>8} {p95:>8} {vazao:>8}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,31 @@
+# tests/test_edit_history.py
+
+from edit_history import EditHistory, KIND_AI
+
+
+def _undo_bytes(history):
+    return sum(step.size for step in history._undo)
+
+
+def test_new_edit_after_undo_releases_redo_bytes():
+    texto = "x = 1\n" * 50
+    history = EditHistory(texto)
+    for i in range(60):
+        history.record(texto + f"ai_{i} = 0\n" * 30, kind=KIND_AI)
+        history.undo()
+        texto += f"n{i} = 1\n"
+        history.record(texto, kind=KIND_AI)
+        assert history.bytes_used == _undo_bytes(history)
+    assert len(history.labels()) == 60
+    assert not history.can_redo()
+
+
+def test_multi_step_undo_and_redo():
+    history = EditHistory("", keyframe_interval=3)
+    estados = [""]
+    for i in range(10):
+        estados.append(estados[-1] + f"linha {i}\n")
+        history.record(estados[-1], kind=KIND_AI)
+    assert history.undo(steps=4) == estados[6]
+    assert history.redo() == estados[7]
+    assert history.bytes_used == _undo_bytes(history) + sum(step.size for step in history._redo)
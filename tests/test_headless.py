@@ -0,0 +1,37 @@
+# tests/test_headless.py
+
+import io
+import json
+
+import pytest
+
+from headless import HeadlessEngine, RequestError, parse_request, run_batch
+
+
+class _Core:
+    """
+    Substituto do CoderCore que responde na hora, sem LLM nem embeddings.
+    """
+    max_llm_calls = 4
+
+    def run_pipeline(self, query, history, code, context=None, mode=None):
+        return f"resposta: {query}", [f"{len(history)} mensagens"], ""
+
+
+@pytest.mark.parametrize("item", [{"content": "x"}, {"role": "user"}, {"role": "user", "content": 1}, 3])
+def test_parse_request_rejects_malformed_history_items(item):
+    with pytest.raises(RequestError):
+        parse_request({"query": "oi", "history": [item]})
+
+
+def test_batch_reports_malformed_history_and_keeps_going():
+    lines = [
+        json.dumps({"id": 1, "query": "oi", "history": [{"content": "x"}]}),
+        json.dumps({"id": 2, "query": "tudo bem?", "history": ["oi", {"role": "user", "content": "olá"}]}),
+    ]
+    out = io.StringIO()
+    summary = run_batch(HeadlessEngine(core=_Core()), lines, out, concurrency=2)
+    results = {result["line"]: result for result in map(json.loads, out.getvalue().splitlines())}
+    assert results[1]["status"] == "error" and "history" in results[1]["error"]
+    assert results[2]["status"] == "ok" and results[2]["steps"] == ["2 mensagens"]
+    assert summary["ok"] == 1 and summary["error"] == 1 and summary["total"] == 2
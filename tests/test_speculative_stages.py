@@ -0,0 +1,26 @@
+# tests/test_speculative_stages.py
+
+from benchmarks.bench_pipeline import SCENARIOS, script, _Store
+from benchmarks.fakes import ScriptedOllama
+from coder_core import CoderCore, ModeloLLM, RequestContext, VectorStoreManager
+from complexity import ComplexityClassifier
+from llm_cache import LLMCache, set_llm_cache
+
+
+def test_speculative_path_is_announced_only_after_confirmation():
+    # O classificador local não decide a pergunta "simple": os dois caminhos começam especulativos
+    scenario = SCENARIOS["simple"]
+    set_llm_cache(LLMCache(None))
+    store = _Store()
+    core = CoderCore(
+        model=ModeloLLM(cliente=ScriptedOllama(script(scenario), latency=0.05, tokens_per_second=500)),
+        vectorstore_manager=VectorStoreManager(embeddings=store.embeddings, vectorstore=store.vectorstore),
+        complexity_classifier=ComplexityClassifier.load("complexity_weights.json"),
+    )
+    stages = []
+    context = RequestContext(on_stage=stages.append)
+    core.run_pipeline(scenario["query"], [], "", context=context)
+
+    assert stages == ["classify", "reason", "answer", "code"]
+    spans = [span["name"] for span in context.trace.summary()["spans"] if span["parent"] is None]
+    assert "reason:simple (especulativa)" in spans and "reason:simple" not in spans